@@ -0,0 +1,121 @@
+from typing import Dict, Any, List, Tuple
+
+from .sensors import Sensor
+
+
+class BackPressure:
+    """
+    Sheds load when the agent falls behind.
+
+    A tick is overrun when gathering and saving took longer than
+    `budget * global.refresh` or when the number of buffered samples is above
+    `max_backlog` and still growing (the DB does not keep up). After `sustain`
+    overrun ticks in a row one more degradation step is applied:
+
+    1. the interval of the most expensive sensor is doubled, up to
+       `max_factor`. Candidates are the sensors listed in `expensive` and all
+       sensors whose gather and save time exceeds `cost_share` of their
+       interval
+    2. if no interval can be stretched any further, the next sensor listed in
+       `aggregate` writes a single row per series and flush with the mean of
+       all FLOAT columns instead of every sample
+
+    After `recover` healthy ticks in a row the last step is undone.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.overrun_ticks = 0
+        self.healthy_ticks = 0
+        self.last_backlog = 0
+
+        # applied steps, (action, sensor), undone in reverse order
+        self.steps: List[Tuple[str, Sensor]] = []
+        self.configure(config)
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        settings = config.get('backpressure', {})
+        self.refresh = config['global']['refresh']
+        self.enabled = settings.get('enabled', True)
+        self.budget = settings.get('budget', 1.0)
+        self.sustain = settings.get('sustain', 3)
+        self.recover = settings.get('recover', 30)
+        self.max_backlog = settings.get('max_backlog', 1000)
+        self.max_factor = settings.get('max_factor', 16)
+        self.cost_share = settings.get('cost_share', 0.25)
+        self.expensive = list(settings.get('expensive', ['SMARTCtl', 'Netstat']))
+        self.aggregate = list(settings.get('aggregate', ['PSUtil', 'LMSensors']))
+
+    def backlog(self) -> int:
+        return sum(len(sensor.raw_data) for sensor in Sensor.registry if sensor.is_enabled)
+
+    def observe(self, duration: float) -> None:
+        """
+        Feed back how long the last tick (gather and save) took
+        """
+        if not self.enabled:
+            return
+
+        backlog = self.backlog()
+        growing = backlog > self.max_backlog and backlog > self.last_backlog
+        self.last_backlog = backlog
+
+        if duration <= self.budget * self.refresh and not growing:
+            self.overrun_ticks = 0
+            self.healthy_ticks += 1
+            if self.healthy_ticks >= self.recover and len(self.steps) > 0:
+                self.healthy_ticks = 0
+                self.restore()
+            return
+
+        self.healthy_ticks = 0
+        self.overrun_ticks += 1
+        if self.overrun_ticks >= self.sustain:
+            self.overrun_ticks = 0
+            if growing:
+                self.degrade(f"{backlog} samples buffered")
+            else:
+                self.degrade(f"tick took {duration:.2f}s")
+
+    def cost(self, sensor: Sensor) -> float:
+        return sensor.gather_time + sensor.save_time
+
+    def degrade(self, reason: str) -> None:
+        sensors = [sensor for sensor in Sensor.registry if sensor.is_enabled]
+
+        candidates = [
+            sensor for sensor in sensors
+            if sensor.interval_factor * 2 <= self.max_factor and (
+                sensor.name in self.expensive or
+                self.cost(sensor) > self.cost_share * (sensor.interval or self.refresh)
+            )
+        ]
+        if len(candidates) > 0:
+            sensor = max(candidates, key=self.cost)
+            sensor.interval_factor *= 2
+            sensor.degradations += 1
+            self.steps.append(('stretch', sensor))
+            print(f"WARNING: Falling behind ({reason}), stretching interval of {sensor.name} by {sensor.interval_factor:g}x")
+            return
+
+        candidates = [
+            sensor for sensor in sensors
+            if sensor.name in self.aggregate and not sensor.aggregate
+        ]
+        if len(candidates) > 0:
+            sensor = max(candidates, key=self.cost)
+            sensor.aggregate = True
+            sensor.degradations += 1
+            self.steps.append(('aggregate', sensor))
+            print(f"WARNING: Falling behind ({reason}), aggregating {sensor.name} before writing")
+            return
+
+        print(f"WARNING: Falling behind ({reason}), nothing left to degrade")
+
+    def restore(self) -> None:
+        action, sensor = self.steps.pop()
+        if action == 'stretch':
+            sensor.interval_factor /= 2
+            print(f"Recovered, interval of {sensor.name} stretched by {sensor.interval_factor:g}x")
+        else:
+            sensor.aggregate = False
+            print(f"Recovered, writing all samples of {sensor.name} again")
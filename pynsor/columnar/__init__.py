@@ -0,0 +1,3 @@
+from .connection import DB, Connection
+
+__all__ = [DB, Connection]
@@ -0,0 +1,299 @@
+from typing import Dict, Any, List, Union, Tuple, Optional
+import os
+import gzip
+import json
+from threading import Thread, Event, RLock
+from time import monotonic
+from datetime import datetime, timezone
+
+from pynsor import storage
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+
+# column types used by the sensors (and their usual SQL spellings) -> arrow
+# types, `timestamp` columns are written as UTC
+ARROW_TYPES = {
+    'TEXT':             'string',
+    'VARCHAR':          'string',
+    'SMALLINT':         'int16',
+    'INT':              'int32',
+    'INTEGER':          'int32',
+    'BIGINT':           'int64',
+    'REAL':             'float32',
+    'FLOAT':            'float64',
+    'DOUBLE PRECISION': 'float64',
+    'BOOL':             'bool_',
+    'BOOLEAN':          'bool_',
+    'TIMESTAMPTZ':      'timestamp',
+}
+
+TIMESTAMP = ('us', 'UTC')
+
+
+def arrow_type(typ: str) -> str:
+    """
+    Arrow type name of a column type
+
+    :raises ValueError: for types without an arrow type
+    """
+    name = ARROW_TYPES.get(typ.upper().strip(), None)
+    if name is None:
+        raise ValueError(f"Column type {typ} can not be written to columnar files")
+    return name
+
+
+def arrow_field(name: str, typ: str) -> Any:
+    typ = arrow_type(typ)
+    if typ == 'timestamp':
+        return (name, pyarrow.timestamp(*TIMESTAMP))
+    return (name, getattr(pyarrow, typ)())
+
+EXTENSIONS = {
+    'parquet': 'parquet',
+    'arrow':   'arrow',
+    'json':    'jsonl.gz',
+}
+
+
+class Writer:
+    """
+    A single file of a table partition. Files are written with a `.tmp` suffix
+    and renamed when they are rotated, so readers only ever see complete files.
+    """
+
+    def __init__(self, path: str, format: str, compression: Optional[str], schema: List[Dict[str, str]]):
+        self.path = path
+        self.format = format
+        self.columns = ['time'] + [column['name'] for column in schema]
+        self.rows = 0
+        self.opened = monotonic()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if format == 'json':
+            self.file = open(path + '.tmp', 'ab')
+            return
+
+        self.schema = pyarrow.schema(
+            [arrow_field('time', 'TIMESTAMPTZ')] +
+            [arrow_field(column['name'], column['type']) for column in schema]
+        )
+        if format == 'parquet':
+            self.file = pyarrow.parquet.ParquetWriter(path + '.tmp', self.schema, compression=compression or 'zstd')
+        else:
+            options = pyarrow.ipc.IpcWriteOptions(compression=compression or 'zstd')
+            self.file = pyarrow.ipc.new_file(path + '.tmp', self.schema, options=options)
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        columns = {name: [row.get(name, None) for row in rows] for name in self.columns}
+        if self.format == 'json':
+            # every batch is a gzip member of its own, so the file stays
+            # readable even if the process dies before rotating it
+            columns['time'] = [t.isoformat() if t is not None else None for t in columns['time']]
+            self.file.write(gzip.compress(json.dumps(columns, separators=(',', ':'), default=str).encode('utf-8') + b'\n'))
+            self.file.flush()
+        else:
+            self.file.write_table(pyarrow.table(columns, schema=self.schema))
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        self.file.close()
+        os.rename(self.path + '.tmp', self.path)
+
+
+class DB(storage.DB):
+    """
+    Writes every table into rotating, compressed columnar files partitioned
+    by table and hour:
+
+        <directory>/<table>/date=2021-05-01/hour=13/<timestamp>.parquet
+
+    Parquet and Arrow IPC files need `pyarrow`, without it gzip compressed
+    JSON batches (one object of column lists per flush) are written instead.
+
+    Files are rotated by a background thread as well, so the file of a table
+    that gets no more rows is finished after `rotate_seconds` (or when its
+    hour is over) and not only when the next row arrives.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.directory = config.get('directory', '/var/lib/pynsor/columnar')
+        self.format = config.get('format', 'parquet' if pyarrow is not None else 'json')
+        if self.format not in EXTENSIONS:
+            print(f"ERROR: Unknown columnar format {self.format}, using json")
+            self.format = 'json'
+        if self.format != 'json' and pyarrow is None:
+            print(f"WARNING: pyarrow is not installed, writing json instead of {self.format}")
+            self.format = 'json'
+        self.compression = config.get('compression', None)
+        self.rotate_seconds = config.get('rotate_seconds', 900)
+        self.rotate_rows = config.get('rotate_rows', 1000000)
+
+        # table -> columns as passed to create_table
+        self.schema: Dict[str, List[Dict[str, str]]] = {}
+
+        # table -> (partition, open writer)
+        self.writers: Dict[str, Tuple[str, Writer]] = {}
+        self.lock = RLock()
+
+        self.finish_stale()
+        self.stop = Event()
+        self.thread = Thread(target=self.rotate_loop, name='pynsor-columnar', daemon=True)
+        self.thread.start()
+
+    def finish_stale(self) -> None:
+        """
+        Rename the `.tmp` files an earlier run left behind. JSON files are
+        complete up to the last flush, Parquet and Arrow files have no footer
+        and can not be read, they are renamed to `.incomplete`.
+        """
+        for path, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.tmp'):
+                    continue
+                stale = os.path.join(path, name)
+                if name.endswith('.' + EXTENSIONS['json'] + '.tmp'):
+                    os.rename(stale, stale[:-4])
+                else:
+                    print(f"WARNING: {stale} was not closed, renaming it to .incomplete")
+                    os.rename(stale, stale[:-4] + '.incomplete')
+
+    def rotate_loop(self) -> None:
+        interval = max(1, min(self.rotate_seconds, 60))
+        while not self.stop.wait(interval):
+            try:
+                self.rotate_expired()
+            except Exception as e:
+                print(f"ERROR: Could not rotate columnar files: {e!r}")
+
+    def rotate_expired(self) -> None:
+        """
+        Finish all files that are open for longer than `rotate_seconds` or
+        whose hour is over
+        """
+        partition = self.partition(datetime.now(timezone.utc))
+        with self.lock:
+            for table, (current, writer) in list(self.writers.items()):
+                if current != partition or monotonic() - writer.opened >= self.rotate_seconds:
+                    self.rotate(table)
+
+    def connect(self) -> 'Connection':
+        return Connection(self)
+
+    def partition(self, timestamp: datetime) -> str:
+        return timestamp.astimezone(timezone.utc).strftime('date=%Y-%m-%d/hour=%H')
+
+    def rotate(self, table: str) -> None:
+        with self.lock:
+            if table in self.writers:
+                _, writer = self.writers.pop(table)
+                writer.close()
+
+    def write(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        with self.lock:
+            self.write_partitions(table, rows)
+
+    def write_partitions(self, table: str, rows: List[Dict[str, Any]]) -> None:
+        # split the batch by hour, usually there is only one partition
+        partitions: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            partitions.setdefault(self.partition(row.get('time', None) or datetime.now(timezone.utc)), []).append(row)
+
+        for partition, rows in sorted(partitions.items()):
+            current = self.writers.get(table, None)
+            if current is not None and (
+                current[0] != partition or
+                current[1].rows >= self.rotate_rows or
+                monotonic() - current[1].opened >= self.rotate_seconds
+            ):
+                self.rotate(table)
+                current = None
+            if current is None:
+                name = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f') + '.' + EXTENSIONS[self.format]
+                path = os.path.join(self.directory, table, partition, name)
+                current = (partition, Writer(path, self.format, self.compression, self.schema.get(table, [])))
+                self.writers[table] = current
+            current[1].write(rows)
+
+    def close(self) -> None:
+        self.stop.set()
+        self.thread.join()
+        with self.lock:
+            for table in list(self.writers.keys()):
+                self.rotate(table)
+
+    def stats(self) -> Dict[str, int]:
+        size = 0
+        files = 0
+        for path, _, names in os.walk(self.directory):
+            for name in names:
+                size += os.path.getsize(os.path.join(path, name))
+                files += 1
+        return {'bytes': size, 'files': files}
+
+
+class Connection(storage.Connection):
+    """
+    Collects the rows of one transaction and hands them to the files on commit
+    """
+
+    def __init__(self, db: DB):
+        self.db = db
+
+    def __enter__(self):
+        self.rows: Dict[str, List[Dict[str, Any]]] = {}
+        self.savepoints: Dict[str, Dict[str, int]] = {}
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            for table, rows in self.rows.items():
+                if len(rows) > 0:
+                    self.db.write(table, rows)
+        self.rows = {}
+
+    def savepoint(self, name: str) -> None:
+        self.savepoints[name] = {table: len(rows) for table, rows in self.rows.items()}
+
+    def release_savepoint(self, name: str) -> None:
+        self.savepoints.pop(name, None)
+
+    def rollback_to_savepoint(self, name: str) -> None:
+        counts = self.savepoints.get(name, {})
+        for table, rows in self.rows.items():
+            del rows[counts.get(table, 0):]
+
+    def insert(self, table: str, data: Dict[str, Any]) -> None:
+        self.rows.setdefault(table, []).append(data)
+
+    def upsert(self, table: str, data: Dict[str, Any], keys: List[str]) -> None:
+        # files are append only, every change is archived as a new row
+        self.insert(table, data)
+
+    def create_table(self, table: str, items: List[Dict[str, str]], hypertable: bool=True) -> str:
+        if table in self.db.schema:
+            return 'already_exists'
+        # unknown types fail here once instead of on every write
+        for item in items:
+            arrow_type(item['type'])
+        self.db.schema[table] = list(items)
+        return 'ok'
+
+    def add_column(self, table: str, name: str, type: str, null: str='NULL') -> None:
+        columns = self.db.schema.setdefault(table, [])
+        if any(column['name'] == name for column in columns):
+            return
+        arrow_type(type)
+        columns.append({'name': name, 'type': type, 'null': null})
+        # the schema of open files can not change, start new ones
+        self.db.rotate(table)
+
+    def create_index(self, table: str, field: Union[str, List[str], Tuple[str]], type: str='BTREE', unique: bool=False) -> str:
+        # files are scanned as a whole, nothing to index
+        return 'ok'
@@ -0,0 +1,422 @@
+from typing import Dict, Any, List, Tuple, Optional
+import os
+import pickle
+from collections import deque
+from threading import Thread, Condition
+from time import monotonic, time_ns
+
+from pynsor import storage
+from pynsor.sensors.sensor import compile_patterns
+
+
+# (method, args, kwargs) of a connection call
+Operation = Tuple[str, Tuple, Dict[str, Any]]
+
+# calls that change the schema, replayed whenever a destination reconnects
+SCHEMA_CALLS = ('create_table', 'add_column', 'create_index')
+
+# savepoints of the source transaction, the rows between them are written
+# and rolled back as one unit
+MARKERS = ('savepoint', 'release_savepoint')
+
+
+class Destination:
+    """
+    A named storage backend with its own queue and writer thread.
+
+    Transactions are queued and written in bulk (up to `bulk_size` rows per
+    transaction), the rows of every sensor in a savepoint of their own. If
+    the backend can not be reached, writing is retried every `retry_interval`
+    seconds for as long as it takes. Rows the backend rejects (data errors)
+    are rolled back on their own and retried separately, after `max_retries`
+    attempts they are moved to the `dead_letter` directory (or dropped if
+    there is none). While more than `queue_size` rows are queued, further
+    transactions are spooled to files in `spool` and written once the
+    destination caught up. Tables are routed with `tables` and `exclude`
+    patterns.
+    """
+
+    def __init__(self, name: str, db: storage.DB, config: Dict[str, Any]):
+        self.name = name
+        self.db = db
+        self.include = compile_patterns(config.get('tables', ['*']), config.get('tables_regex', []))
+        self.exclude = compile_patterns(config.get('exclude', []), config.get('exclude_regex', []))
+        self.queue_size = config.get('queue_size', 100000)
+        self.bulk_size = config.get('bulk_size', 10000)
+        self.retry_interval = config.get('retry_interval', 10)
+        self.max_retries = config.get('max_retries', 10)
+        self.spool = config.get('spool', f'/var/lib/pynsor/spool/{name}')
+        self.dead_letter = config.get('dead_letter', os.path.join(self.spool, 'dead'))
+        self.max_spool = config.get('max_spool', 1024 * 1024 * 1024)
+        self.shutdown_timeout = config.get('shutdown_timeout', 5)
+
+        self.schema: List[Operation] = []
+        self.needs_schema = True
+
+        self.condition = Condition()
+        self.queue: deque = deque()
+        self.queued_rows = 0
+        self.failures = 0
+
+        # units the backend rejected: (operations, attempts, retry after)
+        self.rejected: deque = deque()
+        # spool file -> attempts that failed with a data error
+        self.spool_attempts: Dict[str, int] = {}
+        self.stopped = False
+
+        self.thread = Thread(target=self.run, name=f'pynsor-{name}', daemon=True)
+        self.thread.start()
+
+    def accept(self, table: str) -> bool:
+        if self.include is not None and self.include.match(table) is None:
+            return False
+        if self.exclude is not None and self.exclude.match(table) is not None:
+            return False
+        return True
+
+    def rows(self, operations: List[Operation]) -> int:
+        return sum(1 for name, _, _ in operations if name not in SCHEMA_CALLS and name not in MARKERS)
+
+    def enqueue(self, operations: List[Operation]) -> None:
+        with self.condition:
+            for operation in operations:
+                if operation[0] in SCHEMA_CALLS and operation not in self.schema:
+                    self.schema.append(operation)
+
+            rows = self.rows(operations)
+            if self.queued_rows + rows > self.queue_size:
+                self.spool_batch(operations)
+            else:
+                self.queue.append(operations)
+                self.queued_rows += rows
+            self.condition.notify()
+
+    def spool_files(self, directory: Optional[str]=None) -> List[str]:
+        directory = directory or self.spool
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name for name in os.listdir(directory) if name.endswith('.batch'))
+
+    def make_room(self, directory: str) -> None:
+        """
+        Drop the oldest files of a spool directory while it is larger than
+        `max_spool`
+        """
+        os.makedirs(directory, exist_ok=True)
+        files = self.spool_files(directory)
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+        while size > self.max_spool and len(files) > 0:
+            oldest = os.path.join(directory, files.pop(0))
+            size -= os.path.getsize(oldest)
+            os.unlink(oldest)
+            print(f"ERROR: Spool of {self.name} is full, dropped {oldest}")
+
+    def spool_batch(self, operations: List[Operation], directory: Optional[str]=None) -> str:
+        directory = directory or self.spool
+        self.make_room(directory)
+        path = os.path.join(directory, f'{time_ns()}.batch')
+        with open(path + '.tmp', 'wb') as fp:
+            pickle.dump(operations, fp)
+        os.rename(path + '.tmp', path)
+        return path
+
+    def give_up(self, operations: List[Operation], path: Optional[str], attempts: int) -> None:
+        """
+        Move a batch that was rejected `max_retries` times out of the way,
+        into the dead letter directory if there is one
+
+        :param operations: the failed batch
+        :param path: the spool file it came from, if any
+        :param attempts: number of failed attempts
+        """
+        rows = self.rows(operations)
+        if not self.dead_letter:
+            print(f"ERROR: Dropping {rows} rows for {self.name} after {attempts} failed attempts")
+            if path is not None:
+                os.unlink(path)
+            return
+
+        try:
+            if path is not None:
+                self.make_room(self.dead_letter)
+                target = os.path.join(self.dead_letter, os.path.basename(path))
+                os.rename(path, target)
+            else:
+                target = self.spool_batch(operations, self.dead_letter)
+            print(f"ERROR: Moved {rows} rows for {self.name} to {target} after {attempts} failed attempts")
+        except OSError as e:
+            print(f"ERROR: Dropping {rows} rows for {self.name}, could not move them to {self.dead_letter}: {e!r}")
+            if path is not None and os.path.exists(path):
+                os.unlink(path)
+
+    def has_work(self) -> bool:
+        if len(self.queue) > 0:
+            return True
+        if len(self.rejected) > 0 and self.rejected[0][2] <= monotonic():
+            return True
+        return self.failures == 0 and len(self.spool_files()) > 0
+
+    def next_batch(self) -> Tuple[List[List[Operation]], Optional[str], int]:
+        """
+        Collect queued transactions up to `bulk_size` rows, a rejected unit
+        that is due for a retry, or the oldest spooled transaction
+
+        :returns: transactions, the spool file they came from and how often
+                  they were rejected before
+        """
+        if len(self.rejected) > 0 and self.rejected[0][2] <= monotonic():
+            operations, attempts, _ = self.rejected.popleft()
+            return [operations], None, attempts
+
+        transactions = []
+        rows = 0
+        while len(self.queue) > 0 and (rows == 0 or rows + self.rows(self.queue[0]) <= self.bulk_size):
+            batch = self.queue.popleft()
+            transactions.append(batch)
+            rows += self.rows(batch)
+        self.queued_rows -= rows
+        if len(transactions) > 0:
+            return transactions, None, 0
+
+        files = self.spool_files()
+        if len(files) == 0:
+            return [], None, 0
+        path = os.path.join(self.spool, files[0])
+        try:
+            with open(path, 'rb') as fp:
+                return [pickle.load(fp)], path, self.spool_attempts.get(path, 0)
+        except Exception as e:
+            print(f"ERROR: Could not read spooled batch {path}, dropping it: {e!r}")
+            os.unlink(path)
+            return [], None, 0
+
+    def units(self, transactions: List[List[Operation]]) -> List[List[Operation]]:
+        """
+        Split transactions into the calls of the savepoints of the source
+        transaction, calls outside of savepoints form units of their own
+        """
+        result = []
+        for operations in transactions:
+            unit = []
+            depth = 0
+            for operation in operations:
+                if operation[0] in MARKERS:
+                    if len(unit) > 0 and (depth == 0 or (operation[0] == 'release_savepoint' and depth == 1)):
+                        result.append(unit)
+                        unit = []
+                    depth += 1 if operation[0] == 'savepoint' else -1
+                    continue
+                unit.append(operation)
+            if len(unit) > 0:
+                result.append(unit)
+        return result
+
+    def write(self, transactions: List[List[Operation]]) -> List[Tuple[List[Operation], Exception]]:
+        """
+        Write transactions in one DB transaction, every unit in a savepoint
+
+        :returns: the units the backend rejected, with the error
+        """
+        rejected = []
+        with self.db.connect() as connection:
+            if self.needs_schema:
+                for name, args, kwargs in list(self.schema):
+                    getattr(connection, name)(*args, **kwargs)
+            for unit in self.units(transactions):
+                connection.savepoint('unit')
+                try:
+                    for name, args, kwargs in unit:
+                        getattr(connection, name)(*args, **kwargs)
+                    connection.release_savepoint('unit')
+                except self.db.data_errors as e:
+                    connection.rollback_to_savepoint('unit')
+                    rejected.append((unit, e))
+        self.needs_schema = False
+        return rejected
+
+    def reject(self, transactions: List[List[Operation]], path: Optional[str], attempts: int) -> None:
+        """
+        Retry transactions that failed with a data error on their own after
+        `retry_interval`, give up on them after `max_retries` attempts
+
+        :param transactions: rejected transactions or units
+        :param path: the spool file they came from, if any
+        :param attempts: failed attempts including this one
+        """
+        if len(transactions) > 1:
+            # written in bulk, find out which one is bad
+            for operations in transactions:
+                self.reject([operations], None, attempts)
+            return
+
+        operations = transactions[0]
+        if self.max_retries > 0 and attempts >= self.max_retries:
+            self.spool_attempts.pop(path, None)
+            self.give_up(operations, path, attempts)
+        elif path is not None:
+            self.spool_attempts[path] = attempts
+        else:
+            with self.condition:
+                self.rejected.append((operations, attempts, monotonic() + self.retry_interval))
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.stopped and not self.has_work():
+                    self.condition.wait(self.retry_interval)
+                    if self.failures > 0:
+                        break
+                if self.stopped:
+                    return
+                transactions, path, attempts = self.next_batch()
+            if len(transactions) == 0:
+                continue
+            rows = sum(self.rows(operations) for operations in transactions)
+
+            start = monotonic()
+            try:
+                rejected = self.write(transactions)
+            except Exception as e:
+                self.needs_schema = True
+                self.failures += 1
+                if isinstance(e, self.db.data_errors):
+                    print(f"ERROR: {self.name} rejected {rows} rows ({attempts + 1}/{self.max_retries}): {e!r}")
+                    self.reject(transactions, path, attempts + 1)
+                else:
+                    # not the fault of the data, retry for as long as it takes
+                    print(f"ERROR: Could not write to {self.name} ({self.failures}): {e!r}")
+                    with self.condition:
+                        if attempts > 0 and path is None:
+                            self.rejected.appendleft((transactions[0], attempts, 0))
+                        elif path is None:
+                            for operations in reversed(transactions):
+                                self.queue.appendleft(operations)
+                            self.queued_rows += rows
+                with self.condition:
+                    if not self.stopped:
+                        self.condition.wait(self.retry_interval)
+                continue
+
+            if self.failures > 0:
+                print(f"Writing to {self.name} again after {self.failures} failures")
+                self.failures = 0
+            if path is not None:
+                self.spool_attempts.pop(path, None)
+                os.unlink(path)
+            for unit, e in rejected:
+                print(f"ERROR: {self.name} rejected {self.rows(unit)} rows ({attempts + 1}/{self.max_retries}): {e!r}")
+                self.reject([unit], None, attempts + 1)
+            if monotonic() - start > self.retry_interval:
+                print(f"WARNING: Writing {rows} rows to {self.name} took {monotonic() - start:.1f}s")
+
+    def close(self) -> None:
+        """
+        Give the writer `shutdown_timeout` seconds to drain the queue, spool
+        whatever is left
+        """
+        deadline = monotonic() + self.shutdown_timeout
+        with self.condition:
+            while len(self.queue) > 0 and self.failures == 0 and monotonic() < deadline:
+                self.condition.wait(0.1)
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join(self.shutdown_timeout)
+        with self.condition:
+            batches = list(self.queue) + [operations for operations, _, _ in self.rejected]
+            if len(batches) > 0:
+                operations = [operation for batch in batches for operation in batch]
+                print(f"Spooling {len(batches)} queued transactions for {self.name}")
+                self.spool_batch(operations)
+                self.queue.clear()
+                self.rejected.clear()
+                self.queued_rows = 0
+        self.db.close()
+
+
+class FanoutConnection(storage.Connection):
+    """
+    Collects the calls of a transaction and hands them to the destinations
+    on commit, savepoints are emulated by truncating the collected calls.
+    Released savepoints are kept as markers, so the destinations can write
+    the rows of every sensor in a savepoint of their own.
+    """
+
+    def __init__(self, db: 'FanoutDB'):
+        self.db = db
+
+    def __enter__(self):
+        self.operations: List[Operation] = []
+        self.savepoints: Dict[str, int] = {}
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.db.dispatch(self.operations)
+        self.operations = []
+
+    def savepoint(self, name: str) -> None:
+        self.savepoints[name] = len(self.operations)
+        self.operations.append(('savepoint', (name,), {}))
+
+    def release_savepoint(self, name: str) -> None:
+        self.savepoints.pop(name, None)
+        self.operations.append(('release_savepoint', (name,), {}))
+
+    def rollback_to_savepoint(self, name: str) -> None:
+        del self.operations[self.savepoints.get(name, 0):]
+
+    def insert(self, table: str, data: Dict[str, Any]) -> None:
+        self.operations.append(('insert', (table, data), {}))
+
+    def upsert(self, table: str, data: Dict[str, Any], keys: List[str]) -> None:
+        self.operations.append(('upsert', (table, data, keys), {}))
+
+    def create_table(self, table: str, items: List[Dict[str, str]], **kwargs) -> str:
+        self.operations.append(('create_table', (table, items), kwargs))
+        return 'ok'
+
+    def add_column(self, table: str, name: str, type: str, null: str='NULL') -> None:
+        self.operations.append(('add_column', (table, name, type, null), {}))
+
+    def create_index(self, table: str, field: Any, **kwargs) -> str:
+        self.operations.append(('create_index', (table, field), kwargs))
+        return 'ok'
+
+
+class FanoutDB(storage.DB):
+    """
+    Writes to multiple destinations, every destination gets the tables its
+    routing rules accept. A slow or unreachable destination does not block
+    the others or the sensors.
+    """
+
+    # transactions are only collected, the writer threads do the rest
+    concurrent = True
+
+    def __init__(self, destinations: List[Destination]):
+        super().__init__({})
+        self.destinations = destinations
+
+    def connect(self) -> FanoutConnection:
+        return FanoutConnection(self)
+
+    def dispatch(self, operations: List[Operation]) -> None:
+        for destination in self.destinations:
+            routed = [
+                operation for operation in operations
+                if operation[0] in MARKERS or destination.accept(operation[1][0])
+            ]
+            if any(operation[0] not in MARKERS for operation in routed):
+                destination.enqueue(routed)
+
+    def stats(self) -> Dict[str, int]:
+        result = {}
+        for destination in self.destinations:
+            for name, value in destination.db.stats().items():
+                result[f'{destination.name}.{name}'] = value
+            result[f'{destination.name}.queued_rows'] = destination.queued_rows
+        return result
+
+    def close(self) -> None:
+        for destination in self.destinations:
+            destination.close()
@@ -0,0 +1,100 @@
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timezone
+
+
+class FlushPolicy:
+    """
+    Decides when the buffered samples of a sensor are written to the DB.
+
+    A sensor is flushed as soon as any of these limits is reached:
+
+    - `max_samples`: number of buffered ticks (defaults to `global.batch_size`
+      if none of the other limits is configured)
+    - `max_rows`: estimated number of rows the buffered samples turn into
+    - `max_bytes`: size of the buffered raw data
+    - `max_age`: seconds since the oldest buffered sample was taken
+
+    If writing a sensor fails, its samples stay buffered and are retried on
+    the next flush, after `max_retries` failed attempts they are dropped.
+    While the DB can not be written at all, the oldest samples of a sensor
+    are dropped once more than `max_buffered` are buffered.
+
+    If `target_duration` is set, the row limit of every sensor is adapted to
+    the observed write rate: it moves towards the number of rows that can be
+    written in `target_duration`, starting at and capped by `max_rows` and
+    never below `min_rows`.
+    """
+
+    def __init__(self, config: Dict[str, Any], batch_size: int=1):
+        self.limits: Dict[str, float] = {}
+        self.configure(config, batch_size)
+
+    def configure(self, config: Dict[str, Any], batch_size: int=1) -> None:
+        if 'max_samples' in config or any(name in config for name in ('max_rows', 'max_bytes', 'max_age')):
+            # with a default of one sample the other limits would never trigger
+            self.max_samples = config.get('max_samples', None)
+        else:
+            self.max_samples = batch_size
+        self.max_rows = config.get('max_rows', None)
+        self.min_rows = config.get('min_rows', 1)
+        self.max_bytes = config.get('max_bytes', None)
+        self.max_age = config.get('max_age', None)
+        self.target_duration = config.get('target_duration', None)
+        self.max_retries = config.get('max_retries', 3)
+        self.max_buffered = config.get('max_buffered', 10000)
+
+    def setting(self, sensor, name: str) -> Optional[float]:
+        # sensors may override every limit with a `flush_<name>` setting
+        return sensor.config.get(f'flush_{name}', getattr(self, name))
+
+    def row_limit(self, sensor) -> Optional[float]:
+        max_rows = self.setting(sensor, 'max_rows')
+        if max_rows is None:
+            return None
+        return self.limits.get(sensor.name, max_rows)
+
+    def is_due(self, sensor, now: datetime) -> bool:
+        samples = len(sensor.raw_data)
+        if samples == 0:
+            return False
+
+        max_samples = self.setting(sensor, 'max_samples')
+        if max_samples is not None and samples >= max_samples:
+            return True
+
+        row_limit = self.row_limit(sensor)
+        if row_limit is not None and samples * sensor.rows_per_sample >= row_limit:
+            return True
+
+        max_bytes = self.setting(sensor, 'max_bytes')
+        if max_bytes is not None and sensor.buffered_bytes() >= max_bytes:
+            return True
+
+        max_age = self.setting(sensor, 'max_age')
+        if max_age is not None and (now - sensor.raw_data[0]['time']).total_seconds() >= max_age:
+            return True
+
+        return False
+
+    def due(self, sensors: List[Any]) -> List[Any]:
+        now = datetime.now(timezone.utc)
+        return [sensor for sensor in sensors if self.is_due(sensor, now)]
+
+    def observe(self, sensor, rows: int, duration: float) -> None:
+        """
+        Feed back how long writing `rows` rows of a sensor took
+        """
+        max_rows = self.setting(sensor, 'max_rows')
+        if self.target_duration is None or max_rows is None or rows == 0:
+            return
+
+        limit = self.limits.get(sensor.name, max_rows)
+        wanted = rows * self.target_duration / max(duration, 0.001)
+        if rows < limit and wanted < limit:
+            # a flush smaller than the limit (e.g. by `max_age`) says nothing
+            # about whether the limit is too high
+            return
+
+        # move half way to the wanted limit to dampen noisy measurements
+        limit = (limit + wanted) / 2
+        self.limits[sensor.name] = max(self.setting(sensor, 'min_rows'), min(max_rows, limit))
@@ -0,0 +1,234 @@
+from typing import Dict, Any, List, Tuple, Optional
+import os
+import json
+import socketserver
+from threading import Lock, Thread
+from time import monotonic
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pynsor.storage import Connection
+
+
+class LatestCache:
+    """
+    Keeps the latest row of every series in memory.
+
+    A series is identified by the table and the values of its key columns
+    (the columns the sensor created single column indices for, e.g. `disk`
+    or `core`). Tables without key columns hold a single series.
+
+    Series that were not updated for `max_age` seconds (e.g. of processes that
+    exited) are dropped, and a table never holds more than `max_series`
+    series, the least recently updated ones are dropped first.
+    """
+
+    def __init__(self, config: Dict[str, Any], schema: Dict[str, Dict[str, Any]]):
+        self.schema = schema
+        self.configure(config)
+
+        self.lock = Lock()
+        self.values: Dict[str, Dict[Tuple, Dict[str, Any]]] = {}
+        self.dirty: Dict[str, Dict[Tuple, Dict[str, Any]]] = {}
+        # table -> series -> monotonic time of the last update, least
+        # recently updated first
+        self.updated: Dict[str, Dict[Tuple, float]] = {}
+        self.latest_tables = set()
+        self.server = None
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        self.config = dict(config)
+        self.listen = config.get('listen', None)
+        self.socket = config.get('socket', None)
+        self.upsert = config.get('upsert', False)
+        self.max_age = config.get('max_age', 3600)
+        self.max_series = config.get('max_series', 10000)
+
+    def keys(self, table: str) -> List[str]:
+        return self.schema.get(table, {}).get('keys', [])
+
+    def record(self, table: str, row: Dict[str, Any]) -> None:
+        key = tuple(row.get(k, None) for k in self.keys(table))
+        with self.lock:
+            previous = self.values.setdefault(table, {}).get(key, None)
+            if previous is not None and previous['time'] > row['time']:
+                return
+            self.values[table][key] = row
+            updated = self.updated.setdefault(table, {})
+            updated.pop(key, None)
+            updated[key] = monotonic()
+            if self.upsert:
+                self.dirty.setdefault(table, {})[key] = row
+            while len(updated) > self.max_series:
+                self.evict(table, next(iter(updated)))
+
+    def evict(self, table: str, key: Tuple) -> None:
+        """
+        Forget a series, the lock has to be held
+        """
+        del self.updated[table][key]
+        del self.values[table][key]
+        self.dirty.get(table, {}).pop(key, None)
+
+    def expire(self) -> None:
+        """
+        Drop all series that were not updated for `max_age` seconds
+        """
+        if self.max_age is None:
+            return
+        deadline = monotonic() - self.max_age
+        with self.lock:
+            for table, updated in self.updated.items():
+                while len(updated) > 0:
+                    key = next(iter(updated))
+                    if updated[key] > deadline:
+                        break
+                    self.evict(table, key)
+
+    def flush(self, connection: Connection) -> None:
+        """
+        Write all series that changed since the last flush into `latest_<table>`
+        """
+        self.expire()
+        if not self.upsert:
+            return
+
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = {}
+
+        for table, rows in dirty.items():
+            keys = self.keys(table)
+            latest = f'latest_{table}'
+            if latest not in self.latest_tables:
+                connection.create_table(latest, self.schema[table]['columns'], hypertable=False)
+                if len(keys) > 0:
+                    connection.create_index(latest, keys if len(keys) > 1 else keys[0], unique=True)
+                self.latest_tables.add(latest)
+            # per sample columns like `burst` or `captured` are not kept
+            columns = {'time'} | {column['name'] for column in self.schema[table]['columns']}
+            for row in rows.values():
+                connection.upsert(latest, {k: v for k, v in row.items() if k in columns}, keys)
+
+    def commit(self) -> None:
+        # only the latest value of a series is kept, rows that are recorded
+        # again after a failed transaction just replace themselves
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def snapshot(self, table: Optional[str]=None) -> Dict[str, List[Dict[str, Any]]]:
+        with self.lock:
+            if table is not None:
+                return {table: list(self.values.get(table, {}).values())}
+            return {t: list(series.values()) for t, series in self.values.items()}
+
+    def to_json(self, table: Optional[str]=None) -> str:
+        def encode(value):
+            if isinstance(value, datetime):
+                return value.isoformat()
+            return str(value)
+        return json.dumps(self.snapshot(table), default=encode)
+
+    def to_prometheus(self) -> str:
+        """
+        Render all numeric columns as prometheus gauges named
+        `pynsor_<table>_<column>`, key columns become labels
+        """
+        metrics: Dict[str, List[str]] = {}
+        for table, rows in self.snapshot().items():
+            keys = self.keys(table)
+            for row in rows:
+                labels = ",".join(
+                    [f'{k}="{escape_label(row.get(k, None))}"' for k in keys]
+                )
+                timestamp = int(row['time'].timestamp() * 1000) if isinstance(row['time'], datetime) else ''
+                for column, value in row.items():
+                    if column == 'time' or column in keys:
+                        continue
+                    if isinstance(value, bool):
+                        value = int(value)
+                    if not isinstance(value, (int, float)):
+                        continue
+                    name = f'pynsor_{table}_{column}'
+                    metrics.setdefault(name, []).append(f'{name}{{{labels}}} {value} {timestamp}'.rstrip())
+
+        result = []
+        for name, lines in metrics.items():
+            result.append(f'# TYPE {name} gauge')
+            result.extend(lines)
+        return "\n".join(result) + "\n"
+
+    def start(self) -> None:
+        if self.socket is not None:
+            if os.path.exists(self.socket):
+                os.unlink(self.socket)
+            self.server = UnixHTTPServer(self.socket, LatestHandler)
+            print(f"Serving latest values on unix:{self.socket}")
+        elif self.listen is not None:
+            host, _, port = self.listen.rpartition(':')
+            self.server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), LatestHandler)
+            print(f"Serving latest values on http://{self.listen}")
+        else:
+            return
+
+        self.server.cache = self
+        Thread(target=self.server.serve_forever, name='pynsor-latest', daemon=True).start()
+
+    def stop(self) -> None:
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        if self.socket is not None and os.path.exists(self.socket):
+            os.unlink(self.socket)
+        self.server = None
+
+
+def escape_label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class LatestHandler(BaseHTTPRequestHandler):
+    """
+    GET /metrics          prometheus text format
+    GET /latest           JSON of all tables
+    GET /latest/<table>   JSON of a single table
+    """
+
+    def do_GET(self):
+        cache = self.server.cache
+        path = self.path.split('?')[0].rstrip('/')
+        if path == '/metrics':
+            body = cache.to_prometheus()
+            content_type = 'text/plain; version=0.0.4'
+        elif path in ('', '/latest'):
+            body = cache.to_json()
+            content_type = 'application/json'
+        elif path.startswith('/latest/'):
+            body = cache.to_json(path[8:])
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self) -> str:
+        # unix sockets have no peer address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format: str, *args) -> None:
+        pass
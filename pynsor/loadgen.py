@@ -0,0 +1,383 @@
+from typing import Dict, Any, List, Tuple, Optional
+import os
+import math
+import random
+import argparse
+from threading import Thread, Lock, Event
+from time import sleep, monotonic
+from datetime import datetime, timedelta, timezone
+from tomlkit import parse
+
+from .sensors import Sensor
+from .sensors.sensor import SensorConnection
+from .storage import open_db
+from .workers import OperationRecorder, replay
+
+
+# sensors modelled when the config file has no [sensor] sections
+DEFAULT_SENSORS = ['PSUtil', 'ProcStat', 'DiskStats', 'NetDev', 'LMSensors', 'SMARTCtl', 'Pressure', 'Interrupts', 'MemInfo']
+
+# series key column -> cardinality setting, keys not listed use `series`
+KEY_CARDINALITY = {
+    'core':         'cores',
+    'cpu':          'cores',
+    'disk':         'disks',
+    'interface':    'nics',
+    'temp_type':    'sensors',
+    'fan_type':     'sensors',
+    'voltage_type': 'sensors',
+    'current_type': 'sensors',
+    'power_type':   'sensors',
+    'pid':          'processes',
+    'cgroup':       'cgroups',
+    'node':         'nodes',
+}
+
+
+class FleetModel:
+    """
+    Tables, series keys and value types of the modelled sensors, taken from
+    the table definitions of the real sensors
+    """
+
+    def __init__(self, sensors: List[str], cardinality: Dict[str, int]):
+        self.cardinality = cardinality
+
+        # operations creating the tables, replayed by every virtual host
+        self.datamodel: List[Tuple[str, Tuple, Dict[str, Any]]] = []
+
+        # table -> {'columns': [...], 'keys': [...], 'unique': bool}
+        self.tables: Dict[str, Dict[str, Any]] = {}
+
+        for name in sensors:
+            try:
+                sensor = Sensor.load(name)()
+                recorder = OperationRecorder()
+                sensor.create_datamodel(SensorConnection(sensor, recorder))
+            except Exception as e:
+                print(f"WARNING: Could not get the tables of {name}, skipping: {e!r}")
+                continue
+            self.datamodel.extend(recorder.operations)
+            unique = {args[0] for op, args, kwargs in recorder.operations if op == 'create_index' and kwargs.get('unique', False)}
+            for table in sorted(sensor.tables):
+                self.tables[table] = dict(Sensor.schema[table], unique=table in unique)
+
+    def count(self, key: str) -> int:
+        return self.cardinality[KEY_CARDINALITY.get(key, 'series')]
+
+    def series(self, host: int) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Key values of all series of a host. Hosts do not share series: TEXT
+        keys are prefixed with the host name, numeric keys are offset by the
+        host number.
+        """
+        result = {}
+        for table, definition in self.tables.items():
+            types = {column['name']: column['type'] for column in definition['columns']}
+            series = [{}]
+            for key in definition['keys']:
+                count = self.count(key)
+                if types.get(key, 'TEXT') == 'TEXT':
+                    values = [f'host{host}-{key}{i}' for i in range(count)]
+                else:
+                    values = [host * count + i for i in range(count)]
+                series = [dict(s, **{key: value}) for s in series for value in values]
+            result[table] = series
+        return result
+
+    def row(self, table: str, key: Dict[str, Any], counters: Dict[str, int], timestamp: datetime) -> Dict[str, Any]:
+        """
+        Synthetic row of a series: gauges are random, BIGINT columns are
+        increasing counters like the real ones
+        """
+        row = dict(key, time=timestamp)
+        for column in self.tables[table]['columns']:
+            name = column['name']
+            if name in key:
+                continue
+            typ = column['type']
+            if typ == 'FLOAT':
+                row[name] = random.random() * 100.0
+            elif typ == 'BIGINT':
+                counters[name] = counters.get(name, random.randrange(1 << 32)) + random.randrange(1 << 16)
+                row[name] = counters[name]
+            elif typ == 'INT':
+                row[name] = random.randrange(1 << 16)
+            elif typ in ('BOOL', 'BOOLEAN'):
+                row[name] = random.random() < 0.99
+            else:
+                row[name] = f'{name}-{len(name) % 4}'
+        return row
+
+
+class VirtualHost(Sensor):
+    """
+    Stands in for all sensors of one simulated host and writes rows shaped
+    like theirs through the normal sensor write path
+    """
+
+    def __init__(self, index: int, model: FleetModel):
+        super().__init__()
+        self.name = f'host{index}'
+        self.is_enabled = True
+        self.model = model
+        self.series = model.series(index)
+
+        # (table, series index) -> counter values
+        self.counters: Dict[Tuple[str, int], Dict[str, int]] = {}
+
+    def rows(self) -> int:
+        return sum(len(series) for series in self.series.values())
+
+    def create_datamodel(self, connection) -> None:
+        replay(self.model.datamodel, connection)
+
+    def gather(self, timestamp: datetime):
+        self.raw_data.append({'time': timestamp})
+
+    def data(self) -> Optional[List[Dict[str, Any]]]:
+        return self.raw_data
+
+    def save(self, connection) -> None:
+        for item in self.raw_data:
+            for table, series in self.series.items():
+                definition = self.model.tables[table]
+                for i, key in enumerate(series):
+                    row = self.model.row(table, key, self.counters.setdefault((table, i), {}), item['time'])
+                    if definition['unique']:
+                        connection.upsert(table, row, definition['keys'])
+                    else:
+                        connection.insert(table, row)
+        self.raw_data = []
+
+
+class LoadGenerator:
+    """
+    Simulates a fleet of hosts writing to the configured DB. Every host
+    flushes `samples` samples every `interval` seconds in a transaction of
+    its own, the flushes of all hosts are spread evenly over the interval and
+    run on `connections` threads.
+    """
+
+    def __init__(self, db, hosts: List[VirtualHost], interval: float, samples: int, connections: int):
+        self.db = db
+        self.hosts = hosts
+        self.interval = interval
+        self.samples = samples
+        self.connections = connections
+
+        self.lock = Lock()
+        self.stopped = Event()
+        self.latencies: List[float] = []
+        self.rows = 0
+        self.flushes = 0
+        self.failures = 0
+        self.late = 0
+
+    def run_worker(self, hosts: List[Tuple[float, VirtualHost]], start: float) -> None:
+        cycle = 0
+        while not self.stopped.is_set():
+            for offset, host in hosts:
+                due = start + cycle * self.interval + offset
+                delay = due - monotonic()
+                if delay > 0:
+                    if self.stopped.wait(delay):
+                        return
+                elif delay < -self.interval:
+                    with self.lock:
+                        self.late += 1
+
+                now = datetime.now(timezone.utc)
+                step = self.interval / self.samples
+                for i in range(self.samples):
+                    host.gather(now - timedelta(seconds=step * (self.samples - 1 - i)))
+
+                flush_start = monotonic()
+                Sensor.save_all(self.db, items=[host])
+                duration = monotonic() - flush_start
+
+                with self.lock:
+                    if len(host.raw_data) > 0:
+                        self.failures += 1
+                        host.raw_data = []
+                    else:
+                        self.flushes += 1
+                        self.rows += host.rows() * self.samples
+                        self.latencies.append(duration)
+            cycle += 1
+
+    def take(self) -> Tuple[int, int, List[float]]:
+        """
+        Counters since the last call
+        """
+        with self.lock:
+            result = (self.rows, self.flushes, self.latencies)
+            self.rows = 0
+            self.flushes = 0
+            self.latencies = []
+        return result
+
+    def run(self, duration: float, report: float) -> Dict[str, Any]:
+        start = monotonic()
+        threads = []
+        for n in range(self.connections):
+            hosts = [
+                (self.interval * i / len(self.hosts), host)
+                for i, host in enumerate(self.hosts) if i % self.connections == n
+            ]
+            thread = Thread(target=self.run_worker, args=(hosts, start), name=f'pynsor-loadgen-{n}', daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        total_rows = 0
+        total_flushes = 0
+        latencies: List[float] = []
+        last = start
+        try:
+            while monotonic() - start < duration:
+                sleep(min(report, max(0.0, duration - (monotonic() - start))))
+                rows, flushes, window = self.take()
+                now = monotonic()
+                print(
+                    f"{now - start:7.1f}s: {rows / (now - last):10.0f} rows/s, {flushes} flushes, "
+                    f"flush p50 {percentile(window, 0.5) * 1000:.1f}ms p99 {percentile(window, 0.99) * 1000:.1f}ms, "
+                    f"{self.late} late, {self.failures} failed"
+                )
+                total_rows += rows
+                total_flushes += flushes
+                latencies.extend(window)
+                last = now
+        except KeyboardInterrupt:
+            print("Interrupted, stopping")
+        finally:
+            self.stopped.set()
+            for thread in threads:
+                thread.join()
+
+        rows, flushes, window = self.take()
+        total_rows += rows
+        total_flushes += flushes
+        latencies.extend(window)
+        elapsed = monotonic() - start
+        return {
+            'seconds': elapsed,
+            'rows': total_rows,
+            'rows_per_second': total_rows / elapsed,
+            'flushes': total_flushes,
+            'failed': self.failures,
+            'late': self.late,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies) if len(latencies) > 0 else 0.0,
+        }
+
+
+def percentile(values: List[float], p: float) -> float:
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(p * len(values)) - 1)]
+
+
+def init():
+    parser = argparse.ArgumentParser(description='Simulate a fleet of hosts writing to the configured DB to measure ingestion capacity')
+    parser.add_argument(
+        '-c', '--config',
+        type=str,
+        dest='configfile',
+        default='/etc/pynsor/pynsor.conf',
+        help="Location of the config file (toml format), the DB sections are used"
+    )
+    parser.add_argument('--hosts', type=int, default=100, help="Number of simulated hosts")
+    parser.add_argument('--sensors', type=str, help="Comma separated sensors to model, defaults to the configured ones")
+    parser.add_argument('--cores', type=int, default=16, help="CPU cores per host")
+    parser.add_argument('--disks', type=int, default=4, help="Disks per host")
+    parser.add_argument('--nics', type=int, default=2, help="Network interfaces per host")
+    parser.add_argument('--nodes', type=int, default=2, help="NUMA nodes per host")
+    parser.add_argument('--hw-sensors', type=int, dest='sensors_per_host', default=8, help="Temperature, fan, ... sensors per host")
+    parser.add_argument('--processes', type=int, default=50, help="Processes per host")
+    parser.add_argument('--cgroups', type=int, default=20, help="Control groups per host")
+    parser.add_argument('--series', type=int, default=4, help="Series per host for all other keys")
+    parser.add_argument('--interval', type=float, help="Seconds between two flushes of a host, defaults to refresh * batch_size")
+    parser.add_argument('--samples', type=int, help="Samples per flush, defaults to batch_size")
+    parser.add_argument('--connections', type=int, default=4, help="Parallel DB connections")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds to run")
+    parser.add_argument('--report', type=float, default=10, help="Seconds between progress reports")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.configfile):
+        print(f"Could not open config file {args.configfile}")
+        exit(1)
+    with open(args.configfile, 'r') as fp:
+        config = parse(fp.read())
+
+    if args.sensors is not None:
+        sensors = [name.strip() for name in args.sensors.split(',') if name.strip() != '']
+    elif len(config.get('sensor', {})) > 0:
+        sensors = [
+            sensor_config.get('type', name) for name, sensor_config in config['sensor'].items()
+            if sensor_config.get('enabled', True)
+        ]
+    else:
+        sensors = DEFAULT_SENSORS
+
+    batch_size = config.get('global', {}).get('batch_size', 1)
+    samples = args.samples or batch_size
+    interval = args.interval or config.get('global', {}).get('refresh', 10) * samples
+
+    model = FleetModel(sensors, {
+        'cores': args.cores,
+        'disks': args.disks,
+        'nics': args.nics,
+        'nodes': args.nodes,
+        'sensors': args.sensors_per_host,
+        'processes': args.processes,
+        'cgroups': args.cgroups,
+        'series': args.series,
+    })
+    if len(model.tables) == 0:
+        print("ERROR: No tables to write")
+        exit(1)
+    hosts = [VirtualHost(i, model) for i in range(args.hosts)]
+
+    db = open_db(config)
+    connections = max(1, min(args.connections, len(hosts)))
+    if connections > 1 and not db.concurrent:
+        print("WARNING: The DB backend can not write from multiple threads, using one connection")
+        connections = 1
+
+    rows_per_flush = hosts[0].rows() * samples
+    print(
+        f"Simulating {len(hosts)} hosts with {len(model.tables)} tables, {hosts[0].rows()} rows per sample, "
+        f"{samples} samples every {interval}s: {rows_per_flush * len(hosts) / interval:.0f} rows/s expected"
+    )
+
+    with db.connect() as cursor:
+        hosts[0].create_datamodel(cursor)
+    before = db.stats()
+
+    generator = LoadGenerator(db, hosts, interval, samples, connections)
+    try:
+        result = generator.run(args.duration, args.report)
+        after = db.stats()
+    finally:
+        db.close()
+
+    print(
+        f"\nWrote {result['rows']} rows in {result['flushes']} flushes in {result['seconds']:.1f}s: "
+        f"{result['rows_per_second']:.0f} rows/s sustained"
+    )
+    print(
+        f"Flush latency: p50 {result['p50'] * 1000:.1f}ms, p99 {result['p99'] * 1000:.1f}ms, max {result['max'] * 1000:.1f}ms, "
+        f"{result['late']} flushes more than one interval late, {result['failed']} failed"
+    )
+    for name in sorted(after.keys()):
+        growth = after[name] - before.get(name, 0)
+        line = f"{name}: {after[name]} ({growth:+d})"
+        if name.endswith('bytes') and result['rows'] > 0:
+            line += f", {growth / result['rows']:.1f} per row"
+        print(line)
+
+
+if __name__ == "__main__":
+    init()
@@ -1,24 +1,124 @@
 from typing import Dict, Any
 
 import os
+import signal
 import argparse
-from time import sleep
+from time import sleep, monotonic
 from tomlkit import parse
 from pprint import pprint
 
 from .sensors import Sensor
-from .postgres import DB
+from .sensors.sensor import plain
+from .storage import open_db
+from .latest import LatestCache
+from .ring import RingBuffer, cli
+from .flush import FlushPolicy
+from .scheduler import Scheduler
+from .backpressure import BackPressure
+from .profiling import Profiler
 
-def run(config: Dict[str, Any]) -> None:
+reload_requested = False
+
+def request_reload(signum, frame) -> None:
+    global reload_requested
+    reload_requested = True
+
+def load_config(configfile: str) -> Dict[str, Any]:
+    with open(configfile, 'r') as fp:
+        return parse(fp.read())
+
+def run(config: Dict[str, Any], configfile: str) -> None:
+    global reload_requested
+
+    db = open_db(config)
+
+    latest = None
+    if 'latest' in config and config['latest'].get('enabled', True):
+        latest = LatestCache(config['latest'], Sensor.schema)
+        Sensor.observers.append(latest)
+
+    ring = None
+    if 'ring' in config and config['ring'].get('enabled', True):
+        ring = RingBuffer(config['ring'], Sensor.schema)
+        Sensor.observers.append(ring)
 
-    db = DB(config['db'])
     Sensor.init_all(db, config['sensor'])
-    Sensor.gather_all()
-    while True:
-        Sensor.save_all(db)
-        for i in range(0, config['global']['batch_size']):
-            Sensor.gather_all()
-            sleep(config['global']['refresh'])
+    if latest is not None:
+        latest.start()
+
+    policy = FlushPolicy(config.get('flush', {}), config['global'].get('batch_size', 1))
+    scheduler = Scheduler(config)
+    backpressure = BackPressure(config)
+    profiler = Profiler(config.get('profiling', {}))
+
+    signal.signal(signal.SIGHUP, request_reload)
+    signal.signal(signal.SIGUSR1, profiler.request)
+
+    try:
+        while True:
+            start = monotonic()
+            profiler.begin()
+            with profiler.measure('gather'):
+                scheduler.tick()
+            with profiler.measure('save'):
+                Sensor.save_all(db, policy)
+            profiler.end()
+            backpressure.observe(monotonic() - start)
+
+            if reload_requested:
+                reload_requested = False
+                try:
+                    new_config = load_config(configfile)
+                except Exception as e:
+                    print(f"ERROR: Could not reload config file {configfile}: {e}")
+                    new_config = config
+
+                if new_config is not config:
+                    print("Reloading config...")
+                    if any(plain(new_config.get(section, {})) != plain(config.get(section, {}))
+                           for section in ('db', 'columnar', 'destination')):
+                        print("DB config changed, reconnecting")
+                        db.close()
+                        try:
+                            db = open_db(new_config)
+                        except Exception as e:
+                            print(f"ERROR: Could not open the new DB, keeping the old one: {e!r}")
+                            db = open_db(config)
+                            # so the next reload tries the new settings again
+                            for section in ('db', 'columnar', 'destination'):
+                                if section in config:
+                                    new_config[section] = plain(config[section])
+                                else:
+                                    new_config.pop(section, None)
+                        else:
+                            # the tables are created on the next successful connect
+                            Sensor.datamodels_pending = True
+                            Sensor.ensure_datamodels(db)
+                    if latest is not None and plain(new_config.get('latest', {})) != latest.config:
+                        latest.stop()
+                        latest.configure(new_config.get('latest', {}))
+                        latest.start()
+                    if ring is not None and plain(new_config.get('ring', {})) != ring.config:
+                        ring.configure(new_config.get('ring', {}))
+                    try:
+                        Sensor.reload_all(db, new_config['sensor'])
+                    except Exception as e:
+                        print(f"ERROR: Could not reload the sensors, keeping them as they are: {e!r}")
+                    policy.configure(new_config.get('flush', {}), new_config['global'].get('batch_size', 1))
+                    scheduler.configure(new_config)
+                    backpressure.configure(new_config)
+                    if plain(new_config.get('profiling', {})) != profiler.config:
+                        profiler.configure(new_config.get('profiling', {}))
+                    config = new_config
+
+            sleep(scheduler.sleep_time())
+    finally:
+        Sensor.close_all()
+        db.close()
+        if latest is not None:
+            latest.stop()
+        if ring is not None:
+            ring.close()
 
 def init():
     parser = argparse.ArgumentParser(description='Monitor sensors and write measurements to TimescaleDB')
@@ -29,18 +129,37 @@ def init():
         default='/etc/pynsor/pynsor.conf',
         help="Location of the config file (toml format)"
     )
+    commands = parser.add_subparsers(dest='command')
+    for command, description in (
+        ('tail', 'Show the most recent rows of a table from the local ring buffer'),
+        ('query', 'Show the rows of a time range from the local ring buffer')
+    ):
+        subparser = commands.add_parser(command, help=description)
+        subparser.add_argument('table', type=str, help="Table to read")
+        subparser.add_argument('-s', '--series', type=str, action='append', help="Only show this series (disk, core, ...), may be repeated")
+        subparser.add_argument('-d', '--directory', type=str, help="Ring buffer directory, defaults to the one in the config file")
+        subparser.add_argument('--json', action='store_true', help="Print one JSON object per row")
+        if command == 'tail':
+            subparser.add_argument('-n', '--lines', type=int, default=20, help="Number of rows to show")
+        else:
+            subparser.add_argument('--since', type=str, default='1h', help="Start of the range, ISO timestamp or relative like 10m, 2h, 1d")
+            subparser.add_argument('--until', type=str, help="End of the range, ISO timestamp or relative")
     args = parser.parse_args()
 
+    if args.command is not None:
+        config = load_config(args.configfile) if os.path.exists(args.configfile) else {}
+        cli(args, config)
+        return
+
     if not os.path.exists(args.configfile):
         print(f"Could not open config file {args.configfile}")
         exit(1)
     
-    with open(args.configfile, 'r') as fp:
-        config = parse(fp.read())
+    config = load_config(args.configfile)
 
     print("Loaded config:")
     pprint(config)
-    run(config)
+    run(config, args.configfile)
 
 
 if __name__ == "__main__":
@@ -1,38 +1,75 @@
-from typing import Dict, Any, List, Union, Tuple
+from typing import Dict, Any, List, Union, Tuple, Optional
+from threading import Lock
 import psycopg2
-
-class Connection:
-    def __init__(self, config: Dict[str, Any]):
-        dsn = 'postgres://'
-        if 'username' in config:
-            dsn += config['username']
-        if 'password' in config:
-            dsn += ':' + config['password']
-        if 'username' in config:
-            dsn += '@'
-        if 'host' in config:
-            dsn += config['host']
-        else:
-            dsn += 'localhost'
-        if 'port' in config:
-            dsn += ':' + str(config['port'])
-        if 'database' in config:
-            dsn += '/' + config['database']
-
-        self.dsn = dsn
+import psycopg2.pool
+
+from pynsor import storage
+
+def build_dsn(config: Dict[str, Any]) -> str:
+    dsn = 'postgres://'
+    if 'username' in config:
+        dsn += config['username']
+    if 'password' in config:
+        dsn += ':' + config['password']
+    if 'username' in config:
+        dsn += '@'
+    if 'host' in config:
+        dsn += config['host']
+    else:
+        dsn += 'localhost'
+    if 'port' in config:
+        dsn += ':' + str(config['port'])
+    if 'database' in config:
+        dsn += '/' + config['database']
+    return dsn
+
+class Connection(storage.Connection):
+    def __init__(self, config: Dict[str, Any], pool: Optional[psycopg2.pool.AbstractConnectionPool]=None):
+        self.dsn = build_dsn(config)
+        self.pool = pool
 
     def __enter__(self):
-        self.connection = psycopg2.connect(self.dsn)
-        self.cursor = self.connection.cursor()
+        self.connection = self.pool.getconn() if self.pool is not None else psycopg2.connect(self.dsn)
+        try:
+            self.cursor = self.connection.cursor()
+        except psycopg2.Error:
+            self.release(broken=True)
+            raise
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.cursor.close()
-        if exc_type is None:
-            self.connection.commit()
-        else:
-            self.connection.rollback()
-        self.connection.close()
+        broken = exc_type is not None and issubclass(exc_type, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        try:
+            self.cursor.close()
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        except psycopg2.Error:
+            broken = True
+            if exc_type is None:
+                raise
+        finally:
+            self.release(broken)
+
+    def release(self, broken: bool) -> None:
+        """
+        Give the connection back to the pool, connections that failed or were
+        closed by the server are dropped and replaced on the next `connect`
+        """
+        if self.pool is None:
+            self.connection.close()
+            return
+        self.pool.putconn(self.connection, close=broken or self.connection.closed != 0)
+
+    def savepoint(self, name: str) -> None:
+        self.cursor.execute(f"SAVEPOINT {name}")
+
+    def release_savepoint(self, name: str) -> None:
+        self.cursor.execute(f"RELEASE SAVEPOINT {name}")
+
+    def rollback_to_savepoint(self, name: str) -> None:
+        self.cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
 
     def insert(self, table: str, data: Dict[str, Any]) -> None:
         keys = ", ".join([f'"{k}"' for k in data.keys()])
@@ -40,12 +77,26 @@ class Connection:
         sql = f"INSERT INTO {table} ({keys}) VALUES ({placeholders})"
         self.cursor.execute(sql, data)
 
-    def create_table(self, table: str, items: List[Dict[str, str]]) -> str:
+    def upsert(self, table: str, data: Dict[str, Any], keys: List[str]) -> None:
+        if len(keys) == 0:
+            self.cursor.execute(f"DELETE FROM {table}")
+            self.insert(table, data)
+            return
+
+        columns = ", ".join([f'"{k}"' for k in data.keys()])
+        placeholders = ", ".join([f'%({key})s' for key in data.keys()])
+        conflict = ", ".join([f'"{k}"' for k in keys])
+        updates = ", ".join([f'"{k}" = EXCLUDED."{k}"' for k in data.keys() if k not in keys])
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) ON CONFLICT ({conflict}) DO UPDATE SET {updates}"
+        self.cursor.execute(sql, data)
+
+    def create_table(self, table: str, items: List[Dict[str, str]], hypertable: bool=True) -> str:
         """
         Create a TimescaleDB hypertable if it not exists already
 
         :param table: Table name
         :param items: Fields to create, is a list {'name': 'measurement', 'type': "TEXT", 'null': 'NOT NULL'}
+        :param hypertable: set to False to create a plain table
         :returns: 'already_exists', 'ok' or 'error'
         """
         sql = """
@@ -68,14 +119,34 @@ class Connection:
                     time TIMESTAMPTZ NOT NULL DEFAULT now(),
                     {fields}
                 );
-
-                SELECT create_hypertable('{table}', 'time')
             """
+            if hypertable:
+                sql += f"SELECT create_hypertable('{table}', 'time')"
             self.cursor.execute(sql)
         except Exception:
             return 'error'
         return 'ok'
 
+    def add_column(self, table: str, name: str, type: str, null: str='NULL') -> None:
+        """
+        Add a column to an existing table if it does not exist yet
+        """
+        # `ALTER TABLE` takes an exclusive lock on the table even if the
+        # column exists, which blocks every reader until the transaction ends
+        sql = """
+            SELECT EXISTS (
+                SELECT FROM information_schema.columns
+                WHERE  table_schema = 'public'
+                AND    table_name   = %(table)s
+                AND    column_name  = %(name)s
+            );
+        """
+        self.cursor.execute(sql, {'table': table, 'name': name})
+        result = self.cursor.fetchone()
+        if result[0] == True:
+            return
+        self.cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS "{name}" {type} {null}')
+
     def create_index(self, table: str, field: Union[str, List[str], Tuple[str]], type: str='BTREE', unique: bool=False) -> str:
         """
         Create an index over the fields
@@ -128,9 +199,55 @@ class Connection:
         print(sql)
         self.cursor.execute(sql)
 
-class DB:
+class DB(storage.DB):
+    """
+    PostgreSQL/TimescaleDB, connections are kept open between flushes in a
+    pool of up to `pool_size` connections (one per writing thread)
+    """
+
+    data_errors = storage.DB.data_errors + (psycopg2.DataError, psycopg2.IntegrityError, psycopg2.ProgrammingError)
+
+    concurrent = True
+
     def __init__(self, config: Dict[str, Any]):
-        self.config = config
+        super().__init__(config)
+        self.pool_size = config.get('pool_size', 2)
+        self.pool = None
+        self.lock = Lock()
 
     def connect(self) -> Connection:
-        return Connection(self.config)
+        with self.lock:
+            # created on first use and without opening a connection, a DB
+            # that is down fails the `with` block and not the constructor
+            if self.pool is None:
+                self.pool = psycopg2.pool.ThreadedConnectionPool(0, self.pool_size, build_dsn(self.config))
+        return Connection(self.config, self.pool)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Size of the database and its indices and the live and dead tuples of
+        all tables (including hypertable chunks). The tuple counts come from
+        the statistics collector and lag behind a little.
+        """
+        with self.connect() as connection:
+            connection.cursor.execute("""
+                SELECT
+                    pg_database_size(current_database()),
+                    coalesce(sum(pg_indexes_size(relid)), 0),
+                    coalesce(sum(n_live_tup), 0),
+                    coalesce(sum(n_dead_tup), 0)
+                FROM pg_stat_user_tables
+            """)
+            size, index_size, live, dead = connection.cursor.fetchone()
+        return {
+            'bytes': int(size),
+            'index_bytes': int(index_size),
+            'live_tuples': int(live),
+            'dead_tuples': int(dead),
+        }
@@ -0,0 +1,170 @@
+from typing import Dict, Any, List, Tuple, Callable
+import os
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from time import monotonic
+
+from .sensors import Sensor
+
+
+class Profiler:
+    """
+    Profiles the agent itself for the next `ticks` ticks, when `SIGUSR1` is
+    received or `enabled` is set in the `[profiling]` section.
+
+    Every sensor gets a cProfile profile of its `gather` and `save` calls,
+    with `tracemalloc` enabled the memory allocated per sensor and the
+    allocations of the gather and save phases are recorded as well. The
+    results are written to a directory per run in `directory`.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.requested = False
+        self.active = False
+        self.configure(config)
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        self.config = dict(config)
+        self.ticks = config.get('ticks', 10)
+        self.directory = config.get('directory', '/var/lib/pynsor/profiles')
+        self.tracemalloc = config.get('tracemalloc', True)
+        self.frames = config.get('frames', 10)
+        self.top = config.get('top', 30)
+        if config.get('enabled', False):
+            self.requested = True
+
+    def request(self, signum=None, frame=None) -> None:
+        # called from the signal handler, profiling starts with the next tick
+        self.requested = True
+
+    def begin(self) -> None:
+        """
+        Start profiling if requested, called before every tick
+        """
+        if not self.requested or self.active:
+            return
+        self.requested = False
+        self.active = True
+        self.remaining = self.ticks
+        self.started = monotonic()
+
+        # sensor name -> profile of its gather and save calls
+        self.profiles: Dict[str, cProfile.Profile] = {}
+
+        # (sensor name, phase) -> [calls, bytes allocated, max bytes allocated]
+        self.allocations: Dict[Tuple[str, str], List[int]] = {}
+
+        # phase -> allocated bytes per source line, peak traced memory
+        self.lines: Dict[str, Dict[str, int]] = {}
+        self.peaks: Dict[str, int] = {}
+
+        # only stop tracing afterwards if it was not running already
+        self.started_tracing = self.tracemalloc and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(self.frames)
+        self.first = self.snapshot() if tracemalloc.is_tracing() else None
+
+        print(f"Profiling the next {self.ticks} ticks")
+        Sensor.profiler = self
+
+    def end(self) -> None:
+        """
+        Count a tick, write the results after the last one
+        """
+        if not self.active:
+            return
+        self.remaining -= 1
+        if self.remaining > 0:
+            return
+
+        Sensor.profiler = None
+        self.active = False
+        try:
+            path = self.dump()
+            print(f"Wrote profile of {self.ticks} ticks to {path}")
+        except OSError as e:
+            print(f"ERROR: Could not write profile: {e!r}")
+        finally:
+            if self.started_tracing:
+                tracemalloc.stop()
+            self.profiles = {}
+            self.first = None
+
+    def snapshot(self) -> tracemalloc.Snapshot:
+        # leave out the memory used by the snapshots themselves
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    @contextmanager
+    def measure(self, phase: str):
+        """
+        Record the allocations and the peak memory of a phase of the tick
+        """
+        if not self.active or not tracemalloc.is_tracing():
+            yield
+            return
+        before = self.snapshot()
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            self.peaks[phase] = max(self.peaks.get(phase, 0), tracemalloc.get_traced_memory()[1])
+            lines = self.lines.setdefault(phase, {})
+            for statistic in self.snapshot().compare_to(before, 'lineno'):
+                if statistic.size_diff > 0:
+                    line = str(statistic.traceback)
+                    lines[line] = lines.get(line, 0) + statistic.size_diff
+
+    def call(self, sensor: Sensor, phase: str, method: Callable, *args) -> Any:
+        """
+        Run `gather` or `save` of a sensor under its profile
+        """
+        profile = self.profiles.get(sensor.name, None)
+        if profile is None:
+            profile = self.profiles[sensor.name] = cProfile.Profile()
+
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            before = tracemalloc.get_traced_memory()[0]
+        try:
+            return profile.runcall(method, *args)
+        finally:
+            if tracing:
+                allocated = tracemalloc.get_traced_memory()[0] - before
+                stats = self.allocations.setdefault((sensor.name, phase), [0, 0, 0])
+                stats[0] += 1
+                stats[1] += allocated
+                stats[2] = max(stats[2], allocated)
+
+    def dump(self) -> str:
+        path = os.path.join(self.directory, datetime.now().strftime('%Y%m%dT%H%M%S'))
+        os.makedirs(path, exist_ok=True)
+        duration = monotonic() - self.started
+
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(path, f'{name}.prof'))
+            with open(os.path.join(path, f'{name}.txt'), 'w') as fp:
+                fp.write(f"{name}: {self.ticks} ticks in {duration:.1f}s\n\n")
+                for phase in ('gather', 'save'):
+                    calls, allocated, maximum = self.allocations.get((name, phase), (0, 0, 0))
+                    if calls > 0:
+                        fp.write(f"{phase}: {calls} calls, {allocated} bytes retained in total, at most {maximum} per call\n")
+                fp.write("\n")
+                stats = pstats.Stats(profile, stream=fp)
+                stats.sort_stats('cumulative').print_stats(self.top)
+
+        if self.first is not None:
+            with open(os.path.join(path, 'memory.txt'), 'w') as fp:
+                current, peak = tracemalloc.get_traced_memory()
+                fp.write(f"Traced memory: {current} bytes, peak {peak} bytes\n")
+                for phase, lines in self.lines.items():
+                    fp.write(f"\nAllocations during {phase} (peak {self.peaks.get(phase, 0)} bytes):\n")
+                    for line, size in sorted(lines.items(), key=lambda item: item[1], reverse=True)[:self.top]:
+                        fp.write(f"{size:>12} {line}\n")
+
+                fp.write(f"\nGrowth over {self.ticks} ticks:\n")
+                for statistic in self.snapshot().compare_to(self.first, 'lineno')[:self.top]:
+                    fp.write(f"{statistic}\n")
+        return path
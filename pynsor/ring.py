@@ -0,0 +1,396 @@
+from typing import Dict, Any, List, Tuple, Optional, Iterator
+import os
+import re
+import sys
+import mmap
+import json
+import struct
+from datetime import datetime, timedelta, timezone
+
+from pynsor.storage import Connection
+
+
+MAGIC = b'PYNSRNG1'
+
+# magic, record size, capacity, head (next record to write), count
+HEADER = struct.Struct('<8sIQQQ')
+HEADER_SIZE = 4096
+
+# time, series id, flags, null bitmap
+RECORD = '<dIBQ'
+
+# time and series id only, to scan records without decoding them
+RECORD_KEY = struct.Struct('<dI')
+
+FLAG_BURST = 1
+
+# column types -> struct format, TEXT columns are truncated to 32 bytes.
+# INT is stored as 64 bit like BIGINT, values do not always fit the SQL type
+FORMATS = {
+    'FLOAT':   'd',
+    'INT':     'q',
+    'BIGINT':  'q',
+    'BOOLEAN': '?',
+    'TEXT':    '32s',
+}
+
+NULLS = {
+    'd': 0.0,
+    'i': 0,
+    'q': 0,
+    '?': False,
+    '32s': b'',
+}
+
+
+class RingLayout:
+    """
+    Fixed width record layout of a table. Key columns are not stored in the
+    records, every distinct combination of key values gets a series id.
+    """
+
+    def __init__(self, columns: List[Dict[str, str]], keys: List[str]):
+        self.keys = list(keys)
+        self.columns = [
+            (column['name'], FORMATS.get(column['type'], 'd'))
+            for column in columns if column['name'] not in keys
+        ][:64]
+        self.record = struct.Struct(RECORD + "".join(fmt for _, fmt in self.columns))
+
+    @classmethod
+    def from_description(cls, description: Dict[str, Any]) -> 'RingLayout':
+        """
+        Layout of an existing file, as written by `describe`
+        """
+        layout = cls([], description['keys'])
+        layout.columns = [(name, fmt) for name, fmt in description['columns']]
+        layout.record = struct.Struct(RECORD + "".join(fmt for _, fmt in layout.columns))
+        return layout
+
+    def describe(self) -> Dict[str, Any]:
+        return {'keys': self.keys, 'columns': self.columns}
+
+    def pack_into(self, buffer: Any, offset: int, time: float, series: int, flags: int, row: Dict[str, Any]) -> None:
+        nulls = 0
+        values = []
+        for i, (name, fmt) in enumerate(self.columns):
+            value = self.convert(fmt, row.get(name, None))
+            if value is None:
+                nulls |= 1 << i
+                value = NULLS[fmt]
+            values.append(value)
+        self.record.pack_into(buffer, offset, time, series, flags, nulls, *values)
+
+    def convert(self, fmt: str, value: Any) -> Any:
+        """
+        Value as stored for the format, None (stored as NULL) if it does not
+        fit, a bad value must not fail the whole row
+        """
+        if value is None:
+            return None
+        try:
+            if fmt == '32s':
+                return str(value).encode('utf-8')[:32]
+            if fmt == 'd':
+                return float(value)
+            if fmt == '?':
+                return bool(value)
+            value = int(value)
+        except (TypeError, ValueError, OverflowError):
+            return None
+        limit = 1 << (8 * struct.calcsize(fmt) - 1)
+        if not -limit <= value < limit:
+            return None
+        return value
+
+    def unpack_from(self, buffer: Any, offset: int) -> Tuple[float, int, int, Dict[str, Any]]:
+        time, series, flags, nulls, *values = self.record.unpack_from(buffer, offset)
+        row = {}
+        for i, (name, fmt) in enumerate(self.columns):
+            if nulls & (1 << i):
+                row[name] = None
+            elif fmt == '32s':
+                row[name] = values[i].rstrip(b'\0').decode('utf-8', errors='replace')
+            else:
+                row[name] = values[i]
+        return time, series, flags, row
+
+
+class RingFile:
+    """
+    Memory mapped ring of fixed width records of a single table:
+
+        <table>.ring    header (layout, position) and records
+        <table>.series  series id -> key values, one JSON list per line
+
+    When more than `max_series` series ids were handed out, the ids of series
+    that are no longer in the ring are dropped.
+    """
+
+    def __init__(self, path: str, layout: Optional[RingLayout]=None, size: int=8 * 1024 * 1024, max_series: int=65536):
+        self.path = path
+        self.max_series = max_series
+        self.series_path = path[:-len('.ring')] + '.series'
+        self.writable = layout is not None
+
+        if self.writable and not self.matches(layout):
+            self.create(layout, size)
+
+        self.fp = open(path, 'r+b' if self.writable else 'rb')
+        self.mmap = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ)
+        magic, record_size, self.capacity, _, _ = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a ring buffer")
+        description = json.loads(bytes(self.mmap[HEADER.size:HEADER_SIZE]).rstrip(b'\0'))
+        self.layout = layout or RingLayout.from_description(description)
+
+        # series id <-> key values
+        self.series: List[Tuple] = []
+        self.series_ids: Dict[Tuple, int] = {}
+        if os.path.exists(self.series_path):
+            with open(self.series_path, 'r') as fp:
+                for line in fp:
+                    key = tuple(json.loads(line))
+                    self.series_ids[key] = len(self.series)
+                    self.series.append(key)
+        self.series_fp = open(self.series_path, 'a') if self.writable else None
+
+    def matches(self, layout: RingLayout) -> bool:
+        """
+        Check if the existing file can be reused for the layout
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as fp:
+            header = fp.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+            return False
+        try:
+            description = json.loads(header[HEADER.size:].rstrip(b'\0'))
+        except ValueError:
+            return False
+        return description == json.loads(json.dumps(layout.describe()))
+
+    def create(self, layout: RingLayout, size: int) -> None:
+        if os.path.exists(self.path):
+            print(f"WARNING: Layout of {self.path} changed, starting a new ring buffer")
+        description = json.dumps(layout.describe()).encode('utf-8')
+        if HEADER.size + len(description) > HEADER_SIZE:
+            raise ValueError(f"Too many columns for a ring buffer in {self.path}")
+        capacity = max(1, (size - HEADER_SIZE) // layout.record.size)
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, layout.record.size, capacity, 0, 0))
+            fp.write(description)
+            fp.truncate(HEADER_SIZE + capacity * layout.record.size)
+        os.rename(tmp, self.path)
+        if os.path.exists(self.series_path):
+            os.unlink(self.series_path)
+
+    def close(self) -> None:
+        self.mmap.close()
+        self.fp.close()
+        if self.series_fp is not None:
+            self.series_fp.close()
+
+    def compact(self) -> None:
+        """
+        Drop the series ids of all series that have no records left in the
+        ring, renumber the rest and rewrite the series file
+        """
+        _, record_size, capacity, head, count = HEADER.unpack_from(self.mmap, 0)
+        first = (head - count) % capacity
+        mapping: Dict[int, int] = {}
+        for i in range(count):
+            offset = HEADER_SIZE + ((first + i) % capacity) * record_size
+            time, series_id = RECORD_KEY.unpack_from(self.mmap, offset)
+            new_id = mapping.get(series_id, None)
+            if new_id is None:
+                new_id = mapping[series_id] = len(mapping)
+            RECORD_KEY.pack_into(self.mmap, offset, time, new_id)
+
+        series = [None] * len(mapping)
+        for old_id, new_id in mapping.items():
+            series[new_id] = self.series[old_id]
+
+        tmp = self.series_path + '.tmp'
+        with open(tmp, 'w') as fp:
+            for key in series:
+                fp.write(json.dumps(list(key), default=str) + "\n")
+        self.series_fp.close()
+        os.rename(tmp, self.series_path)
+        self.series_fp = open(self.series_path, 'a')
+
+        print(f"Dropped {len(self.series) - len(series)} series that are no longer in {self.path}")
+        self.series = series
+        self.series_ids = {key: i for i, key in enumerate(series)}
+
+    def series_id(self, key: Tuple) -> int:
+        series = self.series_ids.get(key, None)
+        if series is None:
+            if len(self.series) >= self.max_series:
+                self.compact()
+                # there can not be more live series than records
+                self.max_series = max(self.max_series, 2 * len(self.series))
+            series = len(self.series)
+            self.series.append(key)
+            self.series_ids[key] = series
+            self.series_fp.write(json.dumps(list(key), default=str) + "\n")
+            self.series_fp.flush()
+        return series
+
+    def append(self, row: Dict[str, Any]) -> None:
+        key = tuple(row.get(k, None) for k in self.layout.keys)
+        timestamp = row['time'].timestamp() if isinstance(row.get('time', None), datetime) else datetime.now(timezone.utc).timestamp()
+        flags = FLAG_BURST if row.get('burst', False) else 0
+
+        series = self.series_id(key)
+        _, record_size, capacity, head, count = HEADER.unpack_from(self.mmap, 0)
+        self.layout.pack_into(self.mmap, HEADER_SIZE + head * record_size, timestamp, series, flags, row)
+        # position is updated after the record is complete
+        HEADER.pack_into(self.mmap, 0, MAGIC, record_size, capacity, (head + 1) % capacity, min(count + 1, capacity))
+
+    def records(self, since: Optional[float]=None, until: Optional[float]=None, series: Optional[set]=None, newest_first: bool=False) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over the records in the mapped file, only the matching
+        records are decoded
+
+        :param since: only records at or after this unix time
+        :param until: only records before this unix time
+        :param series: only these series ids
+        :param newest_first: iterate backwards
+        """
+        _, record_size, capacity, head, count = HEADER.unpack_from(self.mmap, 0)
+        first = (head - count) % capacity
+        indices = range(count - 1, -1, -1) if newest_first else range(count)
+        for i in indices:
+            offset = HEADER_SIZE + ((first + i) % capacity) * record_size
+            time, series_id = RECORD_KEY.unpack_from(self.mmap, offset)
+            if (since is not None and time < since) or (until is not None and time >= until):
+                continue
+            if series is not None and series_id not in series:
+                continue
+            time, series_id, flags, values = self.layout.unpack_from(self.mmap, offset)
+            row = {'time': datetime.fromtimestamp(time, timezone.utc)}
+            if series_id < len(self.series):
+                row.update(zip(self.layout.keys, self.series[series_id]))
+            row.update(values)
+            if flags & FLAG_BURST:
+                row['burst'] = True
+            yield row
+
+
+class RingBuffer:
+    """
+    Keeps the most recent rows of every table in memory mapped ring buffer
+    files in `directory`, which survive restarts and can be read with
+    `pynsor tail` and `pynsor query` without touching the DB.
+
+    Rows are only appended once the transaction they were written in is
+    committed, a sample that is written again after a failed transaction
+    ends up in the ring only once.
+    """
+
+    def __init__(self, config: Dict[str, Any], schema: Dict[str, Dict[str, Any]]):
+        self.schema = schema
+        self.rings: Dict[str, Optional[RingFile]] = {}
+        self.staged: List[Tuple[str, Dict[str, Any]]] = []
+        self.configure(config)
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        self.close()
+        self.config = dict(config)
+        self.directory = config.get('directory', '/var/lib/pynsor/ring')
+        self.size = config.get('size', 8 * 1024 * 1024)
+        self.max_series = config.get('max_series', 65536)
+        self.tables = config.get('tables', None)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def ring(self, table: str) -> Optional[RingFile]:
+        if table not in self.rings:
+            definition = self.schema.get(table, None)
+            if definition is None or (self.tables is not None and table not in self.tables):
+                self.rings[table] = None
+            else:
+                layout = RingLayout(definition['columns'], definition['keys'])
+                self.rings[table] = RingFile(os.path.join(self.directory, table + '.ring'), layout, self.size, self.max_series)
+        return self.rings[table]
+
+    def record(self, table: str, row: Dict[str, Any]) -> None:
+        self.staged.append((table, row))
+
+    def flush(self, connection: Connection) -> None:
+        # the kernel writes the mapped pages back, nothing to do
+        pass
+
+    def commit(self) -> None:
+        staged = self.staged
+        self.staged = []
+        for table, row in staged:
+            ring = self.ring(table)
+            if ring is not None:
+                ring.append(row)
+
+    def rollback(self) -> None:
+        self.staged = []
+
+    def close(self) -> None:
+        for ring in self.rings.values():
+            if ring is not None:
+                ring.close()
+        self.rings = {}
+
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    """
+    Parse `10m`, `2h`, `1d` (ago) or an ISO timestamp into a unix time
+    """
+    if value is None:
+        return None
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhd])', value)
+    if match is not None:
+        unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+        return (datetime.now(timezone.utc) - timedelta(**{unit: float(match.group(1))})).timestamp()
+    return datetime.fromisoformat(value).timestamp()
+
+
+def cli(args: Any, config: Dict[str, Any]) -> None:
+    """
+    `pynsor tail` and `pynsor query`
+    """
+    directory = args.directory or config.get('ring', {}).get('directory', '/var/lib/pynsor/ring')
+    path = os.path.join(directory, args.table + '.ring')
+    if not os.path.exists(path):
+        tables = sorted(name[:-len('.ring')] for name in os.listdir(directory) if name.endswith('.ring')) \
+            if os.path.isdir(directory) else []
+        print(f"No ring buffer for {args.table} in {directory}, available: {', '.join(tables)}", file=sys.stderr)
+        exit(1)
+
+    ring = RingFile(path)
+    series = None
+    if args.series:
+        series = {
+            i for i, key in enumerate(ring.series)
+            if any(str(value) in args.series for value in key)
+        }
+
+    if args.command == 'tail':
+        rows = []
+        for row in ring.records(series=series, newest_first=True):
+            rows.append(row)
+            if len(rows) >= args.lines:
+                break
+        rows.reverse()
+    else:
+        rows = ring.records(since=parse_time(args.since), until=parse_time(args.until), series=series)
+
+    columns = ['time'] + ring.layout.keys + [name for name, _ in ring.layout.columns] + ['burst']
+    if not args.json:
+        print("\t".join(columns))
+    for row in rows:
+        if args.json:
+            print(json.dumps(row, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v)))
+        else:
+            print("\t".join('' if row.get(c, None) is None else str(row[c]) for c in columns))
+    ring.close()
@@ -0,0 +1,193 @@
+from typing import Dict, Any, List
+import math
+import random
+import socket
+from time import monotonic, time
+from datetime import datetime, timezone
+
+from .sensors import Sensor
+
+
+class Trigger:
+    """
+    Switches sensors into burst mode when a value crosses a threshold:
+
+        [[trigger]]
+        table = "cpu_usage"
+        column = "idle"
+        series = "-1"          # optional, defaults to all series
+        below = 10             # or `above`
+        sensors = ["ProcStat", "PSUtil", "LMSensors"]
+        interval = 0.25        # refresh interval while bursting
+        duration = 60          # seconds to keep bursting
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.table = config['table']
+        self.column = config['column']
+        self.series = config.get('series', None)
+        self.above = config.get('above', None)
+        self.below = config.get('below', None)
+        self.sensors = list(config.get('sensors', []))
+        self.interval = config.get('interval', 0.25)
+        self.duration = config.get('duration', 60)
+
+    def matches(self, row: Dict[str, Any]) -> bool:
+        if self.series is not None:
+            keys = Sensor.schema.get(self.table, {}).get('keys', [])
+            if len(keys) == 0 or str(row.get(keys[0], '')) != str(self.series):
+                return False
+        value = row.get(self.column, None)
+        if not isinstance(value, (int, float)):
+            return False
+        if self.above is not None and value > self.above:
+            return True
+        if self.below is not None and value < self.below:
+            return True
+        return False
+
+    def __str__(self) -> str:
+        condition = f'> {self.above}' if self.above is not None else f'< {self.below}'
+        series = f'[{self.series}]' if self.series is not None else ''
+        return f'{self.table}{series}.{self.column} {condition}'
+
+
+class Scheduler:
+    """
+    Runs every sensor at its own interval (`refresh` in the sensor section,
+    defaults to `global.refresh`) and evaluates the burst triggers on the
+    freshly gathered samples.
+
+    With `global.align` set, sensors run on wall clock boundaries (multiples
+    of their interval since the epoch, in UTC) shifted by `global.align_offset`
+    plus a per host offset of up to `global.align_jitter` seconds. Samples are
+    stamped with the boundary itself, so all hosts write the same timestamps.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.next_run: Dict[str, float] = {}
+        self.burst_until: Dict[str, float] = {}
+        self.burst_interval: Dict[str, float] = {}
+        self.configure(config)
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        self.refresh = config['global']['refresh']
+        self.triggers = [Trigger(t) for t in config.get('trigger', [])]
+
+        align = config['global'].get('align', False)
+        if align != getattr(self, 'align', align):
+            # scheduled times are on another clock now
+            self.next_run = {}
+            self.burst_until = {}
+            self.burst_interval = {}
+        self.align = align
+        self.clock = time if self.align else monotonic
+
+        # the jitter is random but stays the same for a host across restarts,
+        # so the hosts of a fleet do not all hit the DB at the same moment
+        jitter = config['global'].get('align_jitter', 0)
+        self.offset = config['global'].get('align_offset', 0) + random.Random(socket.gethostname()).uniform(0, jitter)
+
+    def schedule(self, name: str, interval: float, now: float) -> float:
+        """
+        Next run of a sensor, missed runs are not caught up
+        """
+        if self.align:
+            return (math.floor((now - self.offset) / interval) + 1) * interval + self.offset
+        next_run = self.next_run.get(name, now) + interval
+        return next_run if next_run > now else now + interval
+
+    def interval(self, sensor: Sensor, now: float) -> float:
+        if self.burst_until.get(sensor.name, 0) > now:
+            return self.burst_interval[sensor.name]
+        return sensor.config.get('refresh', self.refresh) * sensor.interval_factor
+
+    def is_bursting(self, sensor: Sensor, now: float) -> bool:
+        return self.burst_until.get(sensor.name, 0) > now
+
+    def tick(self) -> None:
+        now = self.clock()
+        if self.align:
+            # new sensors start on their next boundary, if the clock was set
+            # back the sensors are rescheduled instead of waiting for it
+            for sensor in Sensor.registry:
+                if not sensor.is_enabled:
+                    continue
+                interval = self.interval(sensor, now)
+                if self.next_run.get(sensor.name, math.inf) > now + interval:
+                    self.next_run[sensor.name] = self.schedule(sensor.name, interval, now)
+
+        due = [
+            sensor for sensor in Sensor.registry
+            if sensor.is_enabled and self.next_run.get(sensor.name, 0) <= now
+        ]
+        if len(due) == 0:
+            return
+
+        for sensor in due:
+            if sensor.name in self.burst_until and not self.is_bursting(sensor, now):
+                print(f"Burst mode of {sensor.name} ended")
+                del self.burst_until[sensor.name]
+                del self.burst_interval[sensor.name]
+
+        burst = [sensor for sensor in due if self.is_bursting(sensor, now)]
+        if self.align:
+            # sensors due at the same boundary share its timestamp
+            boundaries: Dict[float, List[Sensor]] = {}
+            for sensor in due:
+                boundaries.setdefault(self.next_run[sensor.name] - self.offset, []).append(sensor)
+            for boundary, sensors in sorted(boundaries.items()):
+                Sensor.gather_all(sensors, burst=burst, timestamp=datetime.fromtimestamp(boundary, timezone.utc))
+        else:
+            Sensor.gather_all(due, burst=burst)
+
+        for sensor in due:
+            sensor.interval = self.interval(sensor, now)
+            self.next_run[sensor.name] = self.schedule(sensor.name, sensor.interval, now)
+
+        self.check_triggers(due, now)
+
+    def check_triggers(self, sensors: List[Sensor], now: float) -> None:
+        """
+        Check the triggers against the freshly gathered samples.
+
+        Rows are only built (with `Sensor.peek`, which runs the sensor's
+        `save` on the newest sample) for sensors that write a table a
+        trigger watches, and only once per sample for all triggers. That
+        still parses every checked sample twice, so watching the tables of
+        expensive sensors that run at a short interval costs noticeable CPU.
+        """
+        if len(self.triggers) == 0:
+            return
+
+        watched = {trigger.table for trigger in self.triggers}
+        for sensor in sensors:
+            tables = watched & sensor.tables
+            if len(tables) == 0:
+                continue
+            rows: Dict[str, List[Dict[str, Any]]] = {}
+            for table, row in sensor.peek(tables):
+                rows.setdefault(table, []).append(row)
+            for trigger in self.triggers:
+                if any(trigger.matches(row) for row in rows.get(trigger.table, [])):
+                    self.fire(trigger, now)
+
+    def fire(self, trigger: Trigger, now: float) -> None:
+        for name in trigger.sensors:
+            bursting = name in self.burst_until
+            if not bursting:
+                print(f"Burst mode of {name} triggered by {trigger}")
+                # sample right away (or on the next burst boundary) instead
+                # of waiting for the next run
+                self.next_run[name] = self.schedule(name, trigger.interval, now) if self.align else now
+                self.burst_interval[name] = trigger.interval
+            self.burst_until[name] = max(self.burst_until.get(name, 0), now + trigger.duration)
+            self.burst_interval[name] = min(self.burst_interval[name], trigger.interval)
+
+    def sleep_time(self) -> float:
+        now = self.clock()
+        next_run = min(
+            [self.next_run.get(sensor.name, now) for sensor in Sensor.registry if sensor.is_enabled],
+            default=now + self.refresh
+        )
+        return max(0.0, next_run - now)
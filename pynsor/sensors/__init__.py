@@ -1,19 +1,13 @@
 from .sensor import Sensor
-from .lm_sensors import LMSensors
-from .ryzen_power import RyzenPower
-from .diskstats import DiskStats
-from .stat import ProcStat
-from .psutils import PSUtil
-from .netstat import Netstat
-from .smartctl import SMARTCtl
 
 __all__ = [
-    Sensor,
-    LMSensors,
-    RyzenPower,
-    DiskStats,
-    ProcStat,
-    PSUtil,
-    Netstat,
-    SMARTCtl
-]
\ No newline at end of file
+    Sensor
+]
+
+
+def __getattr__(name: str):
+    # sensor modules pull in heavy dependencies (psutil, subprocess, json, ...)
+    # so they are only imported when somebody actually asks for them
+    if name in Sensor.builtins:
+        return Sensor.load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
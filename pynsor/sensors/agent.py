@@ -0,0 +1,72 @@
+from typing import Optional, Dict, Any, List
+from datetime import datetime
+
+from .sensor import Sensor
+from pynsor.storage import Connection
+
+
+class Agent(Sensor):
+    """
+    Metrics of pynsor itself: cost, interval and back pressure state of every
+    sensor
+    """
+
+    def create_datamodel(self, connection: Connection) -> None:
+        connection.create_table(
+            'agent_sensors',
+            [
+                {"name": "sensor", "type": "TEXT", "null": "NOT NULL"},
+                {"name": "interval", "type": "FLOAT", "null": "NULL"},
+                {"name": "interval_factor", "type": "FLOAT", "null": "NULL"},
+                {"name": "aggregated", "type": "BOOLEAN", "null": "NULL"},
+                {"name": "degradations", "type": "BIGINT", "null": "NULL"},
+                {"name": "gather_time", "type": "FLOAT", "null": "NULL"},
+                {"name": "save_time", "type": "FLOAT", "null": "NULL"},
+                {"name": "buffered", "type": "BIGINT", "null": "NULL"}
+            ]
+        )
+        connection.create_index('agent_sensors', ('time', 'sensor'))
+        connection.create_index('agent_sensors', 'sensor')
+
+    def gather(self, timestamp: datetime):
+        rows = []
+        for sensor in Sensor.registry:
+            if not sensor.is_enabled or not self.accept('agent_sensors', sensor.name):
+                continue
+            rows.append({
+                "sensor":          sensor.name,
+                "interval":        sensor.interval,
+                "interval_factor": sensor.interval_factor,
+                "aggregated":      sensor.aggregate,
+                "degradations":    sensor.degradations,
+                "gather_time":     sensor.gather_time,
+                "save_time":       sensor.save_time,
+                "buffered":        len(sensor.raw_data)
+            })
+        self.raw_data.append({
+            'time': timestamp,
+            'data': rows
+        })
+
+    def data(self) -> Optional[List[Dict[str, Any]]]:
+        if self.raw_data is None:
+            return None
+
+        result = []
+        for item in self.raw_data:
+            for row in item['data']:
+                result.append(dict(row, time=item['time']))
+        return result
+
+    def save(self, connection: Connection) -> None:
+        data = self.data()
+        if data is None:
+            print("ERROR: Could not read agent data!")
+            return
+
+        for measurement in data:
+            connection.insert('agent_sensors', measurement)
+
+        self.raw_data = []
+
+Sensor.register(Agent)
@@ -0,0 +1,264 @@
+from typing import Optional, Dict, Any, List
+import os
+from time import monotonic
+from datetime import datetime
+
+from .sensor import Sensor
+from pynsor.storage import Connection
+
+
+# files that are kept open for every cgroup
+FILES = ('cpu.stat', 'memory.current', 'memory.stat', 'io.stat', 'cpu.pressure')
+
+
+class CGroupState:
+    __slots__ = ('path', 'name', 'depth', 'mtime', 'fds', 'counters')
+
+    def __init__(self, path: str, name: str, depth: int):
+        self.path = path
+        self.name = name
+        self.depth = depth
+        self.mtime = None
+        self.fds: Dict[str, int] = {}
+        self.counters: Optional[Dict[str, int]] = None
+
+        for filename in FILES:
+            try:
+                self.fds[filename] = os.open(os.path.join(path, filename), os.O_RDONLY)
+            except (FileNotFoundError, PermissionError):
+                # controller not enabled for this group
+                pass
+
+    def read(self, filename: str) -> Optional[bytes]:
+        fd = self.fds.get(filename, None)
+        if fd is None:
+            return None
+        return os.pread(fd, 65536, 0)
+
+    def close(self) -> None:
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+
+
+class CGroups(Sensor):
+    def init(self, config: Dict[str, Any]) -> None:
+        super().init(config)
+        root = config.get('root', '/sys/fs/cgroup')
+        if not os.path.exists(os.path.join(root, 'cgroup.controllers')) \
+                and os.path.exists(os.path.join(root, 'unified', 'cgroup.controllers')):
+            # hybrid hierarchy, the v2 tree is mounted below unified
+            root = os.path.join(root, 'unified')
+        if not os.path.exists(os.path.join(root, 'cgroup.controllers')):
+            print(f"ERROR: No cgroup v2 hierarchy found at {root}")
+            self.is_enabled = False
+        self.root = root
+        self.max_depth = config.get('max_depth', 3)
+        self.rescan_interval = config.get('rescan_interval', 60)
+
+        self.groups: Dict[str, CGroupState] = {}
+        self.last_scan = None
+        self.last_rescan = None
+
+    def create_datamodel(self, connection: Connection) -> None:
+        connection.create_table(
+            'cgroup_stats',
+            [
+                {"name": "cgroup", "type": "TEXT", "null": "NOT NULL"},
+                {"name": "cpu", "type": "FLOAT", "null": "NULL"},
+                {"name": "cpu_user", "type": "FLOAT", "null": "NULL"},
+                {"name": "cpu_system", "type": "FLOAT", "null": "NULL"},
+                {"name": "cpu_throttled", "type": "FLOAT", "null": "NULL"},
+                {"name": "memory_current", "type": "BIGINT", "null": "NULL"},
+                {"name": "memory_anon", "type": "BIGINT", "null": "NULL"},
+                {"name": "memory_file", "type": "BIGINT", "null": "NULL"},
+                {"name": "io_read_bytes", "type": "FLOAT", "null": "NULL"},
+                {"name": "io_write_bytes", "type": "FLOAT", "null": "NULL"},
+                {"name": "io_read_ops", "type": "FLOAT", "null": "NULL"},
+                {"name": "io_write_ops", "type": "FLOAT", "null": "NULL"},
+                {"name": "cpu_pressure_some", "type": "FLOAT", "null": "NULL"},
+                {"name": "cpu_pressure_full", "type": "FLOAT", "null": "NULL"}
+            ]
+        )
+        connection.create_index('cgroup_stats', ('time', 'cgroup'))
+        connection.create_index('cgroup_stats', 'cgroup')
+
+    def close(self) -> None:
+        for group in self.groups.values():
+            group.close()
+        self.groups = {}
+        self.last_scan = None
+
+    def add(self, path: str, depth: int) -> None:
+        name = '/' + os.path.relpath(path, self.root) if path != self.root else '/'
+        self.groups[path] = CGroupState(path, name, depth)
+
+    def remove(self, path: str) -> None:
+        # remove the group and everything below it
+        for child in [p for p in self.groups if p == path or p.startswith(path + '/')]:
+            self.groups.pop(child).close()
+
+    def scan(self, group: CGroupState) -> None:
+        """
+        Sync the children of a group with the file system
+        """
+        if group.depth >= self.max_depth:
+            return
+        try:
+            children = [
+                entry.path for entry in os.scandir(group.path)
+                if entry.is_dir(follow_symlinks=False)
+            ]
+        except FileNotFoundError:
+            self.remove(group.path)
+            return
+
+        for path in children:
+            if path not in self.groups:
+                self.add(path, group.depth + 1)
+                self.scan(self.groups[path])
+
+        children = set(children)
+        for path in [p for p in self.groups if os.path.dirname(p) == group.path and p not in children]:
+            self.remove(path)
+
+    def update(self, force: bool) -> None:
+        """
+        Track added and removed groups by watching the directory mtimes,
+        `force` rescans all directories
+        """
+        if self.root not in self.groups:
+            self.add(self.root, 0)
+            force = True
+
+        for path in list(self.groups.keys()):
+            group = self.groups.get(path, None)
+            if group is None:
+                continue
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                self.remove(path)
+                continue
+            if force or mtime != group.mtime:
+                group.mtime = mtime
+                self.scan(group)
+
+    def read_counters(self, group: CGroupState) -> Optional[Dict[str, int]]:
+        counters = {}
+        try:
+            cpu_stat = group.read('cpu.stat')
+            if cpu_stat is not None:
+                for line in cpu_stat.splitlines():
+                    key, value = line.split()
+                    counters[key.decode('ascii')] = int(value)
+
+            current = group.read('memory.current')
+            if current is not None:
+                counters['memory_current'] = int(current)
+
+            memory_stat = group.read('memory.stat')
+            if memory_stat is not None:
+                for line in memory_stat.splitlines():
+                    if line.startswith(b'anon '):
+                        counters['memory_anon'] = int(line[5:])
+                    elif line.startswith(b'file '):
+                        counters['memory_file'] = int(line[5:])
+
+            io_stat = group.read('io.stat')
+            if io_stat is not None:
+                for key in ('rbytes', 'wbytes', 'rios', 'wios'):
+                    counters[key] = 0
+                for line in io_stat.splitlines():
+                    for field in line.split()[1:]:
+                        key, _, value = field.partition(b'=')
+                        key = key.decode('ascii')
+                        if key in counters:
+                            counters[key] += int(value)
+
+            pressure = group.read('cpu.pressure')
+            if pressure is not None:
+                for line in pressure.splitlines():
+                    kind, _, rest = line.partition(b' ')
+                    counters['pressure_' + kind.decode('ascii')] = int(rest[rest.rfind(b'total=') + 6:])
+        except (OSError, ValueError):
+            # group was removed while reading
+            return None
+        return counters
+
+    def gather(self, timestamp: datetime):
+        now = monotonic()
+        force = self.last_rescan is None or now - self.last_rescan >= self.rescan_interval
+        if force:
+            self.last_rescan = now
+        self.update(force)
+
+        elapsed = now - self.last_scan if self.last_scan is not None else None
+        self.last_scan = now
+
+        rows = []
+        for path, group in list(self.groups.items()):
+            if not self.accept('cgroup_stats', group.name):
+                continue
+            counters = self.read_counters(group)
+            if counters is None:
+                self.remove(path)
+                continue
+            previous = group.counters
+            group.counters = counters
+            if previous is None or elapsed is None:
+                continue
+
+            def rate(key: str, scale: float=1.0) -> Optional[float]:
+                if key not in counters or key not in previous:
+                    return None
+                return (counters[key] - previous[key]) * scale / elapsed
+
+            # usec per second -> percent of one core
+            usec = 100.0 / 1000000.0
+            rows.append({
+                "cgroup":            group.name,
+                "cpu":               rate('usage_usec', usec),
+                "cpu_user":          rate('user_usec', usec),
+                "cpu_system":        rate('system_usec', usec),
+                "cpu_throttled":     rate('throttled_usec', usec),
+                "memory_current":    counters.get('memory_current', None),
+                "memory_anon":       counters.get('memory_anon', None),
+                "memory_file":       counters.get('memory_file', None),
+                "io_read_bytes":     rate('rbytes'),
+                "io_write_bytes":    rate('wbytes'),
+                "io_read_ops":       rate('rios'),
+                "io_write_ops":      rate('wios'),
+                "cpu_pressure_some": rate('pressure_some', usec),
+                "cpu_pressure_full": rate('pressure_full', usec),
+            })
+
+        if len(rows) > 0:
+            self.raw_data.append({
+                'time': timestamp,
+                'data': rows
+            })
+
+    def data(self) -> Optional[List[Dict[str, Any]]]:
+        if self.raw_data is None:
+            return None
+
+        result = []
+        for item in self.raw_data:
+            for row in item['data']:
+                row['time'] = item['time']
+                result.append(row)
+        return result
+
+    def save(self, connection: Connection) -> None:
+        data = self.data()
+        if data is None:
+            print("ERROR: Could not read cgroup data!")
+            return
+
+        for measurement in data:
+            connection.insert('cgroup_stats', measurement)
+
+        self.raw_data = []
+
+Sensor.register(CGroups)
@@ -2,7 +2,7 @@ from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 from .sensor import Sensor
-from pynsor.postgres import Connection
+from pynsor.storage import Connection
 
 class DiskStats(Sensor):
     def init(self, config: Dict[str, Any]) -> None:
@@ -53,6 +53,8 @@ class DiskStats(Sensor):
             data = {}
             for line in item['data'].splitlines():
                 input = line.split()
+                if not self.accept('diskstats', input[2]):
+                    continue
                 data[input[2]] = {
                     "time":               item['time'],
                     "disk":               input[2],
@@ -0,0 +1,188 @@
+from typing import Optional, Dict, Any, List, Tuple
+import os
+import re
+import select
+import subprocess
+from time import monotonic
+from datetime import datetime
+
+from .sensor import Sensor
+from pynsor.storage import Connection
+
+
+# one `column=value` pair of a measurement line, values are either double
+# quoted strings or bare words (numbers, true, false)
+FIELD_RE = re.compile(r'\s*([A-Za-z_][A-Za-z0-9_]*)=("(?:[^"\\]|\\.)*"|[^,]*)\s*(?:,|$)')
+
+
+class Execd(Sensor):
+    """
+    Runs an external collector once and keeps it alive.
+
+    On every tick a newline is written to the collector's stdin, the
+    collector answers with measurement lines terminated by an empty line:
+
+        <table> <column>=<value>,<column>=<value>,...
+
+    Values may be integers, floats, `true`, `false` or double quoted strings.
+    """
+
+    def init(self, config: Dict[str, Any]) -> None:
+        super().init(config)
+        command = config.get('command', None)
+        if command is None:
+            print(f"ERROR: {self.name} has no command configured!")
+            self.is_enabled = False
+            return
+        if isinstance(command, str):
+            command = command.split()
+        self.command = [str(c) for c in command]
+        self.timeout = config.get('timeout', 5.0)
+        self.restart_delay = config.get('restart_delay', 10.0)
+        self.table_definitions = {table: dict(columns) for table, columns in config.get('tables', {}).items()}
+
+        self.process = None
+        self.buffer = b''
+        self.last_start = None
+
+    def create_datamodel(self, connection: Connection) -> None:
+        for table, columns in self.table_definitions.items():
+            items = []
+            for name, typ in columns.items():
+                typ = typ.upper()
+                items.append({"name": name, "type": typ, "null": "NOT NULL" if typ == 'TEXT' else "NULL"})
+            connection.create_table(table, items)
+            for item in items:
+                if item['type'] == 'TEXT':
+                    connection.create_index(table, ('time', item['name']))
+                    connection.create_index(table, item['name'])
+
+    def start(self) -> bool:
+        if self.last_start is not None and monotonic() - self.last_start < self.restart_delay:
+            return False
+        self.last_start = monotonic()
+        print(f"Starting collector for {self.name}: {' '.join(self.command)}")
+        try:
+            self.process = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                bufsize=0
+            )
+        except OSError as e:
+            print(f"ERROR: Could not start collector for {self.name}: {e}")
+            self.process = None
+            return False
+        self.buffer = b''
+        return True
+
+    def close(self) -> None:
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def read_reply(self) -> Optional[bytes]:
+        deadline = monotonic() + self.timeout
+        fd = self.process.stdout.fileno()
+        while True:
+            # a reply is complete as soon as we see an empty line
+            if self.buffer.startswith(b'\n'):
+                self.buffer = self.buffer[1:]
+                return b''
+            end = self.buffer.find(b'\n\n')
+            if end >= 0:
+                reply = self.buffer[:end + 1]
+                self.buffer = self.buffer[end + 2:]
+                return reply
+
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                return None
+            chunk = os.read(fd, 65536)
+            if len(chunk) == 0:
+                return None
+            self.buffer += chunk
+
+    def gather(self, timestamp: datetime):
+        if self.process is not None and self.process.poll() is not None:
+            print(f"WARNING: Collector for {self.name} exited with {self.process.returncode}")
+            self.process = None
+        if self.process is None and not self.start():
+            return
+
+        try:
+            self.process.stdin.write(b'\n')
+            reply = self.read_reply()
+        except (BrokenPipeError, OSError):
+            reply = None
+
+        if reply is None:
+            print(f"WARNING: Collector for {self.name} did not answer, restarting")
+            self.close()
+            return
+
+        self.raw_data.append({
+            'time': timestamp,
+            'data': reply
+        })
+
+    def parse_value(self, value: str) -> Any:
+        if value.startswith('"'):
+            return value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        if value == 'true':
+            return True
+        if value == 'false':
+            return False
+        if value == '':
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+    def data(self) -> Optional[List[Tuple[str, Dict[str, Any]]]]:
+        if self.raw_data is None:
+            return None
+
+        result = []
+        for item in self.raw_data:
+            for line in item['data'].decode('utf-8').splitlines():
+                table, _, fields = line.strip().partition(' ')
+                if table == '':
+                    continue
+                row = {'time': item['time']}
+                try:
+                    for name, value in FIELD_RE.findall(fields):
+                        row[name] = self.parse_value(value)
+                except ValueError:
+                    print(f"WARNING: {self.name}: could not parse line: {line}")
+                    continue
+                result.append((table, row))
+
+        return result
+
+    def save(self, connection: Connection) -> None:
+        data = self.data()
+        if data is None:
+            print(f"ERROR: Could not read sensordata from {self.name}!")
+            return
+
+        for table, measurement in data:
+            connection.insert(table, measurement)
+
+        self.raw_data = []
+
+Sensor.register(Execd)
@@ -0,0 +1,155 @@
+from typing import Optional, Dict, Any, List, Tuple
+from array import array
+from datetime import datetime
+
+from .sensor import Sensor
+from pynsor.storage import Connection
+
+
+class Interrupts(Sensor):
+    """
+    Per-IRQ and per-softirq counters per CPU. Only counters that changed
+    since the previous tick are written, as deltas.
+    """
+
+    def init(self, config: Dict[str, Any]) -> None:
+        super().init(config)
+        self.softirqs = config.get('softirqs', True)
+
+        # irq -> per cpu counters of the previous tick
+        self.counters: Dict[str, array] = {}
+
+        # source -> ids of the CPUs the counters belong to, offline CPUs
+        # have no column
+        self.cpu_ids: Dict[str, List[int]] = {}
+
+        # irq -> description, written to the irq_names table when changed
+        self.names: Dict[str, str] = {}
+
+    def create_datamodel(self, connection: Connection) -> None:
+        connection.create_table(
+            'interrupts',
+            [
+                {"name": "irq", "type": "TEXT", "null": "NOT NULL"},
+                {"name": "cpu", "type": "INT", "null": "NOT NULL"},
+                {"name": "count", "type": "BIGINT", "null": "NULL"}
+            ]
+        )
+        connection.create_index('interrupts', ('time', 'irq'))
+        connection.create_index('interrupts', 'irq')
+        connection.create_index('interrupts', 'cpu')
+
+        connection.create_table(
+            'irq_names',
+            [
+                {"name": "irq", "type": "TEXT", "null": "NOT NULL"},
+                {"name": "name", "type": "TEXT", "null": "NULL"}
+            ],
+            hypertable=False
+        )
+        connection.create_index('irq_names', 'irq', unique=True)
+
+    def parse(self, content: str, prefix: str) -> Tuple[List[int], List[Tuple[str, array, str]]]:
+        lines = content.splitlines()
+        # header is `CPU0 CPU1 CPU3 ...`, without the CPUs that are offline
+        cpu_ids = [int(token[3:]) for token in lines[0].split()]
+        cpus = len(cpu_ids)
+
+        result = []
+        for line in lines[1:]:
+            tokens = line.split()
+            if len(tokens) < 2:
+                continue
+            irq = prefix + tokens[0].rstrip(':')
+
+            # ERR and MIS only have a single system wide counter
+            values = tokens[1:cpus + 1]
+            count = len(values)
+            for i in range(count):
+                if not values[i].isdigit():
+                    count = i
+                    break
+            counters = array('q', map(int, values[:count]))
+            result.append((irq, counters, " ".join(tokens[count + 1:])))
+        return cpu_ids, result
+
+    def gather(self, timestamp: datetime):
+        sources = [('/proc/interrupts', '')]
+        if self.softirqs:
+            sources.append(('/proc/softirqs', 'softirq:'))
+
+        changes = []
+        changed_names = {}
+        for path, prefix in sources:
+            try:
+                with open(path, 'r') as fp:
+                    content = fp.read()
+            except FileNotFoundError:
+                continue
+
+            cpu_ids, lines = self.parse(content, prefix)
+            if self.cpu_ids.get(path, None) != cpu_ids:
+                # a CPU went on- or offline, the columns moved
+                self.cpu_ids[path] = cpu_ids
+                for irq, _, _ in lines:
+                    self.counters.pop(irq, None)
+            for irq, counters, name in lines:
+                if not self.accept('interrupts', irq):
+                    continue
+                if self.names.get(irq, None) != name:
+                    self.names[irq] = name
+                    changed_names[irq] = name
+
+                previous = self.counters.get(irq, None)
+                self.counters[irq] = counters
+                if previous is None or len(previous) != len(counters):
+                    continue
+                if previous == counters:
+                    # whole line unchanged, skip the per cpu comparison
+                    continue
+
+                if len(counters) < len(cpu_ids):
+                    changes.append((irq, -1, counters[0] - previous[0]))
+                    continue
+                for i in range(len(counters)):
+                    delta = counters[i] - previous[i]
+                    if delta != 0:
+                        changes.append((irq, cpu_ids[i], delta))
+
+        self.raw_data.append({
+            'time': timestamp,
+            'data': changes,
+            'names': changed_names
+        })
+
+    def data(self) -> Optional[List[Dict[str, Any]]]:
+        if self.raw_data is None:
+            return None
+
+        result = []
+        for item in self.raw_data:
+            for irq, cpu, delta in item['data']:
+                result.append({
+                    "time":  item['time'],
+                    "irq":   irq,
+                    "cpu":   cpu,
+                    "count": delta
+                })
+        return result
+
+    def save(self, connection: Connection) -> None:
+        data = self.data()
+        if data is None:
+            print("ERROR: Could not read sensordata from /proc/interrupts!")
+            return
+
+        for item in self.raw_data:
+            for irq, name in item['names'].items():
+                connection.upsert('irq_names', {"irq": irq, "name": name}, ['irq'])
+
+        for measurement in data:
+            connection.insert('interrupts', measurement)
+
+        self.raw_data = []
+
+Sensor.register(Interrupts)
@@ -3,7 +3,7 @@ import subprocess
 from datetime import datetime
 
 from .sensor import Sensor
-from pynsor.postgres import Connection
+from pynsor.storage import Connection
 
 class LMSensors(Sensor):
     def init(self, config: Dict[str, Any]) -> None:
@@ -133,6 +133,10 @@ class LMSensors(Sensor):
                     input = list(values.keys())[0]
                     value = values[input]
 
+                    table = self.table_for_input(input)
+                    if table is None or not self.accept(table, f"{chip}.{sensor_name}"):
+                        continue
+
                     if input.startswith('temp'):
                         self.insert_temp(timestamp, chip, sensor_name, value, connection)
                     elif input.startswith('in'):
@@ -145,6 +149,12 @@ class LMSensors(Sensor):
                         self.insert_power(timestamp, chip, sensor_name, value, connection)
         self.raw_data = []
 
+    def table_for_input(self, input: str) -> Optional[str]:
+        for prefix, table in (('temp', 'temps'), ('in', 'voltage'), ('fan', 'fans'), ('curr', 'current'), ('power', 'power')):
+            if input.startswith(prefix):
+                return table
+        return None
+
     def insert_temp(self, time: datetime, chip:str, sensor_name: str, value: float, connection:Connection) -> None:
         connection.insert('temps', {"time": time, "temp_type": f"{chip}.{sensor_name}", "temp": value})
 
@@ -0,0 +1,182 @@
+from typing import Optional, Dict, Any, List, Tuple
+import os
+import re
+from glob import glob
+from datetime import datetime
+
+from .sensor import Sensor
+from pynsor.storage import Connection
+
+
+DEFAULT_FIELDS = [
+    'MemTotal', 'MemFree', 'MemAvailable', 'MemUsed', 'Buffers', 'Cached', 'FilePages',
+    'SwapCached', 'SwapTotal', 'SwapFree',
+    'Active', 'Inactive', 'Active(anon)', 'Inactive(anon)', 'Active(file)', 'Inactive(file)',
+    'Unevictable', 'Mlocked', 'Dirty', 'Writeback', 'AnonPages', 'Mapped', 'Shmem',
+    'KReclaimable', 'Slab', 'SReclaimable', 'SUnreclaim', 'KernelStack', 'PageTables',
+    'CommitLimit', 'Committed_AS',
+    'AnonHugePages', 'ShmemHugePages', 'FileHugePages',
+    'HugePages_Total', 'HugePages_Free', 'HugePages_Rsvd', 'HugePages_Surp', 'Hugepagesize', 'Hugetlb',
+]
+
+DEFAULT_NUMASTAT = ['numa_hit', 'numa_miss', 'numa_foreign', 'interleave_hit', 'local_node', 'other_node']
+
+
+def column_name(field: str) -> str:
+    """
+    `Active(anon)` -> `active_anon`, `HugePages_Total` -> `hugepages_total`
+    """
+    return re.sub(r'[^a-z0-9]+', '_', field.lower()).strip('_')
+
+
+class MemInfo(Sensor):
+    """
+    Reads /proc/meminfo and the meminfo and numastat files of every NUMA node.
+    Every sample is one row per node (`node = -1` is the system wide view)
+    with one column per configured field, sizes are in bytes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # the datamodel of the default fields is known without `init`
+        self.select(DEFAULT_FIELDS, DEFAULT_NUMASTAT)
+
+    def select(self, fields: List[str], numastat: List[str]) -> None:
+        """
+        Set the fields and numastat counters to record
+
+        :param fields: names as in /proc/meminfo
+        :param numastat: names as in the numastat files of the nodes
+        """
+        self.fields = list(fields)
+        self.numastat = list(numastat)
+
+        # precompiled map of the line names to their slot in the row
+        self.field_index = {f'{field}:'.encode('ascii'): i for i, field in enumerate(self.fields)}
+        self.numastat_index = {
+            name.encode('ascii'): len(self.fields) + i for i, name in enumerate(self.numastat)
+        }
+        self.columns = [column_name(field) for field in self.fields + self.numastat]
+
+    def init(self, config: Dict[str, Any]) -> None:
+        super().init(config)
+        self.select(
+            config.get('fields', DEFAULT_FIELDS),
+            config.get('numastat', DEFAULT_NUMASTAT) if config.get('numa', True) else []
+        )
+
+        try:
+            self.meminfo_fd = os.open('/proc/meminfo', os.O_RDONLY)
+        except FileNotFoundError:
+            print("ERROR: /proc/meminfo not available!")
+            self.is_enabled = False
+            return
+
+        # (node, meminfo fd, numastat fd)
+        self.nodes: List[Tuple[int, int, Optional[int]]] = []
+        if config.get('numa', True):
+            for path in sorted(glob('/sys/devices/system/node/node[0-9]*')):
+                node = int(os.path.basename(path)[4:])
+                if not self.accept('meminfo', str(node)):
+                    continue
+                try:
+                    meminfo = os.open(os.path.join(path, 'meminfo'), os.O_RDONLY)
+                except (FileNotFoundError, PermissionError):
+                    continue
+                try:
+                    numastat = os.open(os.path.join(path, 'numastat'), os.O_RDONLY) if len(self.numastat) > 0 else None
+                except (FileNotFoundError, PermissionError):
+                    numastat = None
+                self.nodes.append((node, meminfo, numastat))
+
+    def close(self) -> None:
+        if not hasattr(self, 'meminfo_fd'):
+            return
+        os.close(self.meminfo_fd)
+        for _, meminfo, numastat in self.nodes:
+            os.close(meminfo)
+            if numastat is not None:
+                os.close(numastat)
+        del self.meminfo_fd
+
+    def create_datamodel(self, connection: Connection) -> None:
+        columns = [{"name": "node", "type": "INT", "null": "NOT NULL"}] + [
+            {"name": name, "type": "BIGINT", "null": "NULL"} for name in self.columns
+        ]
+        connection.create_table('meminfo', columns)
+        # fields are configurable, columns of newly configured fields are
+        # added to the existing table, removed ones are left empty
+        for column in columns[1:]:
+            connection.add_column('meminfo', column['name'], column['type'])
+        connection.create_index('meminfo', ('time', 'node'))
+        connection.create_index('meminfo', 'node')
+
+    def gather(self, timestamp: datetime):
+        nodes = []
+        for node, meminfo, numastat in self.nodes:
+            nodes.append((
+                node,
+                os.pread(meminfo, 16384, 0),
+                os.pread(numastat, 4096, 0) if numastat is not None else b''
+            ))
+        self.raw_data.append({
+            'time': timestamp,
+            'data': os.pread(self.meminfo_fd, 16384, 0) if self.accept('meminfo', '-1') else None,
+            'nodes': nodes
+        })
+
+    def parse(self, row: List[Optional[int]], data: bytes, name_column: int) -> None:
+        """
+        Fill the row slots of all configured fields found in meminfo style
+        lines (`Name:   123 kB`, node files prefix `Node 0 `)
+        """
+        index = self.field_index
+        for line in data.splitlines():
+            parts = line.split()
+            if len(parts) <= name_column + 1:
+                continue
+            i = index.get(parts[name_column], None)
+            if i is None:
+                continue
+            value = int(parts[name_column + 1])
+            if len(parts) > name_column + 2:
+                # everything with a unit is in kB
+                value *= 1024
+            row[i] = value
+
+    def data(self) -> Optional[List[Dict[str, Any]]]:
+        if self.raw_data is None:
+            return None
+
+        width = len(self.columns)
+        result = []
+        for item in self.raw_data:
+            if item['data'] is not None:
+                row = [None] * width
+                self.parse(row, item['data'], 0)
+                result.append({'time': item['time'], 'node': -1, **dict(zip(self.columns, row))})
+
+            for node, meminfo, numastat in item['nodes']:
+                row = [None] * width
+                self.parse(row, meminfo, 2)
+                index = self.numastat_index
+                for line in numastat.splitlines():
+                    name, _, value = line.partition(b' ')
+                    i = index.get(name, None)
+                    if i is not None:
+                        row[i] = int(value)
+                result.append({'time': item['time'], 'node': node, **dict(zip(self.columns, row))})
+        return result
+
+    def save(self, connection: Connection) -> None:
+        data = self.data()
+        if data is None:
+            print("ERROR: Could not read meminfo!")
+            return
+
+        for row in data:
+            connection.insert('meminfo', row)
+
+        self.raw_data = []
+
+Sensor.register(MemInfo)
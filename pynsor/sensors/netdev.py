@@ -0,0 +1,120 @@
+from typing import Optional, Dict, Any, List
+from datetime import datetime
+
+from .sensor import Sensor, SeriesFilter
+from pynsor.storage import Connection
+
+
+DEV_FIELDS = [
+    'rx_bytes', 'rx_packets', 'rx_errs', 'rx_drop', 'rx_fifo', 'rx_frame', 'rx_compressed', 'rx_multicast',
+    'tx_bytes', 'tx_packets', 'tx_errs', 'tx_drop', 'tx_fifo', 'tx_colls', 'tx_carrier', 'tx_compressed'
+]
+
+# (section, counter) in /proc/net/snmp and /proc/net/netstat -> column
+PROTOCOL_FIELDS = {
+    ('Tcp', 'ActiveOpens'):      'tcp_active_opens',
+    ('Tcp', 'PassiveOpens'):     'tcp_passive_opens',
+    ('Tcp', 'AttemptFails'):     'tcp_attempt_fails',
+    ('Tcp', 'EstabResets'):      'tcp_estab_resets',
+    ('Tcp', 'CurrEstab'):        'tcp_curr_estab',
+    ('Tcp', 'InErrs'):           'tcp_in_errs',
+    ('Tcp', 'OutRsts'):          'tcp_out_rsts',
+    ('Tcp', 'RetransSegs'):      'tcp_retrans_segs',
+    ('TcpExt', 'ListenOverflows'): 'tcp_listen_overflows',
+    ('TcpExt', 'ListenDrops'):   'tcp_listen_drops',
+    ('TcpExt', 'TCPTimeouts'):   'tcp_timeouts',
+    ('TcpExt', 'TCPSynRetrans'): 'tcp_syn_retrans',
+    ('Udp', 'InDatagrams'):      'udp_in_datagrams',
+    ('Udp', 'OutDatagrams'):     'udp_out_datagrams',
+    ('Udp', 'InErrors'):         'udp_in_errors',
+    ('Udp', 'NoPorts'):          'udp_no_ports',
+    ('Udp', 'RcvbufErrors'):     'udp_rcvbuf_errors',
+    ('Udp', 'SndbufErrors'):     'udp_sndbuf_errors',
+}
+
+
+class NetDev(Sensor):
+    def init(self, config: Dict[str, Any]) -> None:
+        super().init(config)
+        if 'include' in config or 'exclude' in config:
+            # shorthand for [sensor.NetDev.filter.net_dev]
+            filter_config = dict(config.get('filter', {}).get('net_dev', {}))
+            filter_config.setdefault('include', config.get('include', []))
+            filter_config.setdefault('exclude', config.get('exclude', []))
+            self.filters['net_dev'] = SeriesFilter(filter_config)
+
+    def create_datamodel(self, connection: Connection) -> None:
+        connection.create_table(
+            'net_dev',
+            [{"name": "interface", "type": "TEXT", "null": "NOT NULL"}] +
+            [{"name": name, "type": "BIGINT", "null": "NULL"} for name in DEV_FIELDS]
+        )
+        connection.create_index('net_dev', ('time', 'interface'))
+        connection.create_index('net_dev', 'interface')
+
+        connection.create_table(
+            'net_protocol',
+            [{"name": name, "type": "BIGINT", "null": "NULL"} for name in PROTOCOL_FIELDS.values()]
+        )
+
+    def gather(self, timestamp: datetime):
+        data = {}
+        for name in ('dev', 'snmp', 'netstat'):
+            try:
+                with open(f'/proc/net/{name}', 'r') as fp:
+                    data[name] = fp.read()
+            except FileNotFoundError:
+                data[name] = ''
+        self.raw_data.append({
+            'time': timestamp,
+            'data': data
+        })
+
+    def buffered_bytes(self) -> int:
+        return sum(sum(len(v) for v in item['data'].values()) for item in self.raw_data)
+
+    def data(self) -> Optional[List[Dict[str, Any]]]:
+        if self.raw_data is None:
+            return None
+
+        result = []
+        for item in self.raw_data:
+            net_dev = []
+            for line in item['data']['dev'].splitlines()[2:]:
+                interface, _, counters = line.partition(':')
+                interface = interface.strip()
+                if not self.accept('net_dev', interface):
+                    continue
+                row = dict(zip(DEV_FIELDS, map(int, counters.split())))
+                row['time'] = item['time']
+                row['interface'] = interface
+                net_dev.append(row)
+
+            protocol = {'time': item['time']}
+            for content in (item['data']['snmp'], item['data']['netstat']):
+                lines = content.splitlines()
+                # sections come in pairs of lines, header and values
+                for header, values in zip(lines[0::2], lines[1::2]):
+                    section, _, names = header.partition(':')
+                    for name, value in zip(names.split(), values.partition(':')[2].split()):
+                        column = PROTOCOL_FIELDS.get((section, name), None)
+                        if column is not None:
+                            protocol[column] = int(value)
+
+            result.append({'net_dev': net_dev, 'net_protocol': protocol})
+        return result
+
+    def save(self, connection: Connection) -> None:
+        data = self.data()
+        if data is None:
+            print("ERROR: Could not read sensordata from /proc/net!")
+            return
+
+        for item in data:
+            for measurement in item['net_dev']:
+                connection.insert('net_dev', measurement)
+            connection.insert('net_protocol', item['net_protocol'])
+
+        self.raw_data = []
+
+Sensor.register(NetDev)
@@ -3,7 +3,7 @@ import subprocess
 from datetime import datetime
 
 from .sensor import Sensor
-from pynsor.postgres import Connection
+from pynsor.storage import Connection
 
 
 class Netstat(Sensor):
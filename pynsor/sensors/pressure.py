@@ -0,0 +1,249 @@
+from typing import Optional, Dict, Any, List
+import os
+from array import array
+from threading import Thread, Event, Lock
+from time import monotonic
+from datetime import datetime
+
+from .sensor import Sensor
+from pynsor.storage import Connection
+
+
+RESOURCES = ('cpu', 'memory', 'io')
+KINDS = ('some', 'full')
+
+DEFAULT_VMSTAT = [
+    'pgpgin', 'pgpgout', 'pswpin', 'pswpout', 'pgfault', 'pgmajfault',
+    'pgscan_kswapd', 'pgscan_direct', 'pgsteal_kswapd', 'pgsteal_direct',
+    'allocstall_normal', 'allocstall_movable', 'compact_stall', 'oom_kill'
+]
+
+
+class Pressure(Sensor):
+    """
+    Samples pressure stall information and /proc/vmstat counters in a
+    background thread at `sample_interval` and writes the average and maximum
+    of every tick.
+    """
+
+    def init(self, config: Dict[str, Any]) -> None:
+        super().init(config)
+        self.sample_interval = config.get('sample_interval', 0.25)
+        self.counters = list(config.get('vmstat', DEFAULT_VMSTAT))
+
+        # precompiled lookup of the vmstat lines we are interested in
+        self.counter_index = {name.encode('ascii'): i for i, name in enumerate(self.counters)}
+
+        self.fds: Dict[str, int] = {}
+        for resource in RESOURCES:
+            try:
+                self.fds[resource] = os.open(f'/proc/pressure/{resource}', os.O_RDONLY)
+            except (FileNotFoundError, PermissionError):
+                pass
+        try:
+            self.vmstat_fd = os.open('/proc/vmstat', os.O_RDONLY)
+        except FileNotFoundError:
+            self.vmstat_fd = None
+
+        if len(self.fds) == 0 and self.vmstat_fd is None:
+            print("ERROR: Neither /proc/pressure nor /proc/vmstat available!")
+            self.is_enabled = False
+            return
+
+        # one slot per resource and kind, all preallocated so sampling only
+        # has to update numbers in place
+        slots = len(RESOURCES) * len(KINDS)
+        self.psi_total = array('d', [-1.0] * slots)
+        self.psi_sum = array('d', [0.0] * slots)
+        self.psi_max = array('d', [0.0] * slots)
+
+        count = len(self.counters)
+        self.vm_value = array('d', [-1.0] * count)
+        self.vm_sum = array('d', [0.0] * count)
+        self.vm_max = array('d', [0.0] * count)
+
+        self.samples = 0
+        self.lock = Lock()
+        self.stop = Event()
+        self.thread = Thread(target=self.sample_loop, name=f'pynsor-{self.name}', daemon=True)
+        self.thread.start()
+
+    def create_datamodel(self, connection: Connection) -> None:
+        connection.create_table(
+            'pressure',
+            [
+                {"name": "resource", "type": "TEXT", "null": "NOT NULL"},
+                {"name": "some_avg", "type": "FLOAT", "null": "NULL"},
+                {"name": "some_max", "type": "FLOAT", "null": "NULL"},
+                {"name": "full_avg", "type": "FLOAT", "null": "NULL"},
+                {"name": "full_max", "type": "FLOAT", "null": "NULL"}
+            ]
+        )
+        connection.create_index('pressure', ('time', 'resource'))
+        connection.create_index('pressure', 'resource')
+
+        connection.create_table(
+            'vmstat',
+            [
+                {"name": "counter", "type": "TEXT", "null": "NOT NULL"},
+                {"name": "value", "type": "BIGINT", "null": "NULL"},
+                {"name": "rate_avg", "type": "FLOAT", "null": "NULL"},
+                {"name": "rate_max", "type": "FLOAT", "null": "NULL"}
+            ]
+        )
+        connection.create_index('vmstat', ('time', 'counter'))
+        connection.create_index('vmstat', 'counter')
+
+    def close(self) -> None:
+        if not hasattr(self, 'thread'):
+            return
+        self.stop.set()
+        self.thread.join()
+        for fd in self.fds.values():
+            os.close(fd)
+        if self.vmstat_fd is not None:
+            os.close(self.vmstat_fd)
+        del self.thread
+
+    def sample_loop(self) -> None:
+        last = monotonic()
+        elapsed = 0.0
+        error = None
+        while True:
+            try:
+                with self.lock:
+                    self.sample(elapsed)
+                error = None
+            except Exception as e:
+                # keep sampling, but do not repeat the same error every sample
+                if repr(e) != error:
+                    error = repr(e)
+                    print(f"ERROR: Could not sample {self.name}: {error}")
+            if self.stop.wait(self.sample_interval):
+                break
+            now = monotonic()
+            elapsed = now - last
+            last = now
+
+    def sample(self, elapsed: float) -> None:
+        """
+        Read all counters, the first call (or any call with no `elapsed`
+        time) only remembers the counters and does not count as a sample
+        """
+        # PSI totals are cumulative stall microseconds, convert the delta to
+        # percent of the elapsed time
+        scale = 100.0 / 1000000.0 / elapsed if elapsed > 0 else 0.0
+        counted = False
+        for r, resource in enumerate(RESOURCES):
+            fd = self.fds.get(resource, None)
+            if fd is None:
+                continue
+            lines = os.pread(fd, 256, 0).splitlines()
+            for k in range(len(lines)):
+                slot = r * 2 + k
+                line = lines[k]
+                total = float(line[line.rfind(b'=') + 1:])
+                if self.psi_total[slot] >= 0 and elapsed > 0:
+                    counted = True
+                    value = (total - self.psi_total[slot]) * scale
+                    self.psi_sum[slot] += value
+                    if value > self.psi_max[slot]:
+                        self.psi_max[slot] = value
+                self.psi_total[slot] = total
+
+        if self.vmstat_fd is not None:
+            index = self.counter_index
+            for line in os.pread(self.vmstat_fd, 65536, 0).splitlines():
+                name, _, value = line.partition(b' ')
+                i = index.get(name, None)
+                if i is None:
+                    continue
+                value = float(value)
+                if self.vm_value[i] >= 0 and elapsed > 0:
+                    counted = True
+                    rate = (value - self.vm_value[i]) / elapsed
+                    self.vm_sum[i] += rate
+                    if rate > self.vm_max[i]:
+                        self.vm_max[i] = rate
+                self.vm_value[i] = value
+
+        if counted:
+            self.samples += 1
+
+    def gather(self, timestamp: datetime):
+        with self.lock:
+            samples = self.samples
+            if samples == 0:
+                return
+            psi_avg = [v / samples for v in self.psi_sum]
+            psi_max = list(self.psi_max)
+            vm_avg = [v / samples for v in self.vm_sum]
+            vm_max = list(self.vm_max)
+            vm_value = list(self.vm_value)
+
+            for values in (self.psi_sum, self.psi_max, self.vm_sum, self.vm_max):
+                for i in range(len(values)):
+                    values[i] = 0.0
+            self.samples = 0
+
+        self.raw_data.append({
+            'time': timestamp,
+            'data': {
+                'psi_avg': psi_avg,
+                'psi_max': psi_max,
+                'vm_avg': vm_avg,
+                'vm_max': vm_max,
+                'vm_value': vm_value
+            }
+        })
+
+    def data(self) -> Optional[List[Dict[str, Any]]]:
+        if self.raw_data is None:
+            return None
+
+        result = []
+        for item in self.raw_data:
+            data = item['data']
+            pressure = []
+            for r, resource in enumerate(RESOURCES):
+                if resource not in self.fds:
+                    continue
+                pressure.append({
+                    "time":     item['time'],
+                    "resource": resource,
+                    "some_avg": data['psi_avg'][r * 2],
+                    "some_max": data['psi_max'][r * 2],
+                    "full_avg": data['psi_avg'][r * 2 + 1],
+                    "full_max": data['psi_max'][r * 2 + 1],
+                })
+
+            vmstat = []
+            for i, counter in enumerate(self.counters):
+                if data['vm_value'][i] < 0:
+                    # not available on this kernel
+                    continue
+                vmstat.append({
+                    "time":     item['time'],
+                    "counter":  counter,
+                    "value":    int(data['vm_value'][i]),
+                    "rate_avg": data['vm_avg'][i],
+                    "rate_max": data['vm_max'][i],
+                })
+
+            result.append({'pressure': pressure, 'vmstat': vmstat})
+        return result
+
+    def save(self, connection: Connection) -> None:
+        data = self.data()
+        if data is None:
+            print("ERROR: Could not read pressure data!")
+            return
+
+        for item in data:
+            for table, measurements in item.items():
+                for measurement in measurements:
+                    connection.insert(table, measurement)
+
+        self.raw_data = []
+
+Sensor.register(Pressure)
@@ -0,0 +1,224 @@
+from typing import Optional, Dict, Any, List
+import os
+import heapq
+import resource
+from time import monotonic
+from datetime import datetime
+
+from .sensor import Sensor
+from pynsor.storage import Connection
+
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+class ProcessState:
+    __slots__ = ('fd', 'starttime', 'name', 'ticks', 'rss', 'read_bytes', 'write_bytes', 'cpu', 'read_rate', 'write_rate')
+
+    def __init__(self, fd: Optional[int], starttime: int, name: str):
+        self.fd = fd
+        self.starttime = starttime
+        self.name = name
+        self.ticks = None
+        self.rss = 0
+        self.read_bytes = None
+        self.write_bytes = None
+        self.cpu = 0.0
+        self.read_rate = 0.0
+        self.write_rate = 0.0
+
+
+class Processes(Sensor):
+    def init(self, config: Dict[str, Any]) -> None:
+        super().init(config)
+        self.top = config.get('top', 10)
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+        self.max_open_files = config.get('max_open_files', soft_limit // 2)
+        self.procs: Dict[int, ProcessState] = {}
+        self.open_files = 0
+        self.last_scan = None
+
+    def create_datamodel(self, connection: Connection) -> None:
+        connection.create_table(
+            'process_stats',
+            [
+                {"name": "pid", "type": "INT", "null": "NOT NULL"},
+                {"name": "name", "type": "TEXT", "null": "NULL"},
+                {"name": "cpu", "type": "FLOAT", "null": "NULL"},
+                {"name": "rss", "type": "BIGINT", "null": "NULL"},
+                {"name": "read_bytes", "type": "FLOAT", "null": "NULL"},
+                {"name": "write_bytes", "type": "FLOAT", "null": "NULL"},
+                {"name": "processes", "type": "INT", "null": "NULL"}
+            ]
+        )
+        connection.create_index('process_stats', ('time', 'pid'))
+        connection.create_index('process_stats', 'pid')
+
+    def close(self) -> None:
+        for state in self.procs.values():
+            if state.fd is not None:
+                os.close(state.fd)
+        self.procs = {}
+        self.open_files = 0
+        self.last_scan = None
+
+    def read_stat(self, pid: int, state: Optional[ProcessState]) -> Optional[bytes]:
+        try:
+            if state is not None and state.fd is not None:
+                return os.pread(state.fd, 4096, 0)
+            with open(f'/proc/{pid}/stat', 'rb') as fp:
+                return fp.read()
+        except (FileNotFoundError, ProcessLookupError):
+            return None
+
+    def read_io(self, pid: int, state: ProcessState) -> None:
+        try:
+            with open(f'/proc/{pid}/io', 'rb') as fp:
+                for line in fp:
+                    if line.startswith(b'read_bytes:'):
+                        state.read_bytes = int(line[11:])
+                    elif line.startswith(b'write_bytes:'):
+                        state.write_bytes = int(line[12:])
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            return
+
+    def track(self, pid: int, stat: bytes) -> ProcessState:
+        # the command name may contain spaces and parentheses, it ends at
+        # the last closing parenthesis
+        end = stat.rfind(b')')
+        name = stat[stat.find(b'(') + 1:end].decode('utf-8', 'replace')
+        fields = stat[end + 2:].split()
+        starttime = int(fields[19])
+
+        fd = None
+        if self.open_files < self.max_open_files:
+            try:
+                fd = os.open(f'/proc/{pid}/stat', os.O_RDONLY)
+                self.open_files += 1
+            except (FileNotFoundError, ProcessLookupError):
+                pass
+        return ProcessState(fd, starttime, name)
+
+    def forget(self, pid: int) -> None:
+        state = self.procs.pop(pid)
+        if state.fd is not None:
+            os.close(state.fd)
+            self.open_files -= 1
+
+    def gather(self, timestamp: datetime):
+        now = monotonic()
+        elapsed = now - self.last_scan if self.last_scan is not None else None
+        self.last_scan = now
+
+        seen = set()
+        for entry in os.scandir('/proc'):
+            if not entry.name.isdigit():
+                continue
+            pid = int(entry.name)
+            state = self.procs.get(pid, None)
+            stat = self.read_stat(pid, state)
+            if stat is None:
+                continue
+
+            end = stat.rfind(b')')
+            fields = stat[end + 2:].split()
+            if state is not None and int(fields[19]) != state.starttime:
+                # pid was reused by a new process
+                self.forget(pid)
+                state = None
+            if state is None:
+                state = self.track(pid, stat)
+                self.procs[pid] = state
+            seen.add(pid)
+
+            ticks = int(fields[11]) + int(fields[12])
+            state.rss = int(fields[21]) * PAGE_SIZE
+            if state.ticks is not None and ticks == state.ticks:
+                # process did not run since the last scan, so it did not do
+                # any I/O syscalls either, skip reading its io counters
+                state.cpu = 0.0
+                state.read_rate = 0.0
+                state.write_rate = 0.0
+                continue
+
+            previous_ticks = state.ticks
+            previous_read = state.read_bytes
+            previous_write = state.write_bytes
+            state.ticks = ticks
+            self.read_io(pid, state)
+            if previous_ticks is None or elapsed is None:
+                continue
+
+            state.cpu = (ticks - previous_ticks) * 100.0 / CLOCK_TICKS / elapsed
+            if previous_read is not None and state.read_bytes is not None:
+                state.read_rate = (state.read_bytes - previous_read) / elapsed
+                state.write_rate = (state.write_bytes - previous_write) / elapsed
+
+        for pid in [pid for pid in self.procs if pid not in seen]:
+            self.forget(pid)
+
+        if elapsed is None:
+            # first scan only establishes the baseline
+            return
+
+        self.raw_data.append({
+            'time': timestamp,
+            'data': self.top_processes()
+        })
+
+    def top_processes(self) -> List[Dict[str, Any]]:
+        items = list(self.procs.items())
+        top = set()
+        for key in (
+            lambda item: item[1].cpu,
+            lambda item: item[1].rss,
+            lambda item: item[1].read_rate + item[1].write_rate
+        ):
+            top.update(pid for pid, _ in heapq.nlargest(self.top, items, key=key))
+
+        rows = []
+        other = {"pid": -1, "name": "other", "cpu": 0.0, "rss": 0, "read_bytes": 0.0, "write_bytes": 0.0, "processes": 0}
+        for pid, state in items:
+            if pid in top:
+                rows.append({
+                    "pid": pid,
+                    "name": state.name,
+                    "cpu": state.cpu,
+                    "rss": state.rss,
+                    "read_bytes": state.read_rate,
+                    "write_bytes": state.write_rate,
+                    "processes": 1
+                })
+            else:
+                other['cpu'] += state.cpu
+                other['rss'] += state.rss
+                other['read_bytes'] += state.read_rate
+                other['write_bytes'] += state.write_rate
+                other['processes'] += 1
+        rows.append(other)
+        return rows
+
+    def data(self) -> Optional[List[Dict[str, Any]]]:
+        if self.raw_data is None:
+            return None
+
+        result = []
+        for item in self.raw_data:
+            for row in item['data']:
+                row['time'] = item['time']
+                result.append(row)
+        return result
+
+    def save(self, connection: Connection) -> None:
+        data = self.data()
+        if data is None:
+            print("ERROR: Could not read process data from /proc!")
+            return
+
+        for measurement in data:
+            connection.insert('process_stats', measurement)
+
+        self.raw_data = []
+
+Sensor.register(Processes)
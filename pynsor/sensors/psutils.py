@@ -1,14 +1,29 @@
 from typing import Optional, Dict, Any, List
+import select
 import psutil
+from threading import Thread
+from concurrent.futures import Future, wait
 from datetime import datetime
 
 from .sensor import Sensor
-from pynsor.postgres import Connection
+from pynsor.storage import Connection
 
 
 class PSUtil(Sensor):
     def init(self, config: Dict[str, Any]) -> None:
         super().init(config)
+        self.disk_usage_timeout = config.get('disk_usage_timeout', 2.0)
+        self.partitions = None
+        self.pending_usage: Dict[str, Future] = {}
+
+        # the kernel flags /proc/self/mountinfo with POLLPRI whenever the
+        # mount table changes, so we only re-read partitions in that case
+        try:
+            self.mountinfo = open('/proc/self/mountinfo', 'r')
+            self.mount_poll = select.poll()
+            self.mount_poll.register(self.mountinfo, select.POLLERR | select.POLLPRI)
+        except (FileNotFoundError, AttributeError):
+            self.mountinfo = None
 
     def create_datamodel(self, connection: Connection) -> None:
         connection.create_table(
@@ -128,29 +143,93 @@ class PSUtil(Sensor):
         connection.create_index('disk_io_counters', ('time', 'disk'))
         connection.create_index('disk_io_counters', 'disk')
 
-    def gather(self, timestamp: datetime):
-        partitions = psutil.disk_partitions(all=False)
+    def close(self) -> None:
+        if self.mountinfo is not None:
+            self.mountinfo.close()
+
+    def mounts_changed(self) -> bool:
+        if self.partitions is None or self.mountinfo is None:
+            return True
+        return len(self.mount_poll.poll(0)) > 0
+
+    def disk_usage(self, mountpoint: str) -> Future:
+        """
+        Run statvfs on a thread of its own, it blocks forever on a stale
+        network mount. The daemon thread of a hung mountpoint just stays
+        blocked, without delaying any other mountpoint.
+        """
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(psutil.disk_usage(mountpoint))
+            except Exception as e:
+                future.set_exception(e)
+
+        Thread(target=run, name='pynsor-statvfs', daemon=True).start()
+        return future
+
+    def gather_disk_usage(self) -> Dict[str, Any]:
+        if self.mounts_changed():
+            self.partitions = [
+                disk for disk in psutil.disk_partitions(all=False)
+                if disk.mountpoint is not None and self.accept('disk_usage', disk.device.replace('/dev/', ''))
+            ]
+
+        futures = {}
+        for disk in self.partitions:
+            # a previous call on this mountpoint is still hanging, skip it
+            # until it returns instead of piling up blocked threads
+            pending = self.pending_usage.get(disk.mountpoint)
+            if pending is not None and not pending.done():
+                continue
+            futures[disk.mountpoint] = self.disk_usage(disk.mountpoint)
+
+        wait(futures.values(), timeout=self.disk_usage_timeout)
+
         disk_usage = {}
-        for disk in partitions:
-            if disk.mountpoint is not None:
-                try:
-                    usage = psutil.disk_usage(disk.mountpoint)
-                except PermissionError:
-                    continue
-                disk_usage[disk.device.replace('/dev/', '')] = usage
+        for disk in self.partitions:
+            name = disk.device.replace('/dev/', '')
+            future = futures.get(disk.mountpoint)
+            if future is None:
+                continue
+            if not future.done():
+                print(f"WARNING: disk_usage for {disk.mountpoint} timed out, skipping")
+                self.pending_usage[disk.mountpoint] = future
+                continue
+            self.pending_usage.pop(disk.mountpoint, None)
+            try:
+                # a device mounted more than once is recorded only once
+                disk_usage.setdefault(name, future.result())
+            except (PermissionError, FileNotFoundError):
+                continue
+        return disk_usage
+
+    def gather_loadavg(self):
+        try:
+            with open('/proc/loadavg', 'r') as fp:
+                # e.g. "0.20 0.18 0.12 1/80 11206", fourth field is
+                # running/total scheduling entities
+                fields = fp.read().split()
+            return (float(fields[0]), float(fields[1]), float(fields[2])), int(fields[3].split('/')[1])
+        except FileNotFoundError:
+            return psutil.getloadavg(), len(psutil.pids())
+
+    def gather(self, timestamp: datetime):
+        load_avg, processes = self.gather_loadavg()
 
         self.raw_data.append({
             'time': timestamp,
             'data': {
                 "cpu_usage": psutil.cpu_times_percent(percpu=True),
                 "cpu_freq": psutil.cpu_freq(percpu=True),
-                "load_avg": psutil.getloadavg(),
+                "load_avg": load_avg,
                 "virtual_memory": psutil.virtual_memory(),
                 "swap": psutil.swap_memory(),
-                "disk_usage": disk_usage,
+                "disk_usage": self.gather_disk_usage(),
                 "net_io_counters": psutil.net_io_counters(pernic=True),
                 "disk_io_counters": psutil.disk_io_counters(perdisk=True),
-                "processes": len(psutil.pids())
+                "processes": processes
             } 
         })
 
@@ -166,22 +245,17 @@ class PSUtil(Sensor):
 
         for item in self.raw_data:
 
-            cpu_usage = [dict(v._asdict()) for v in item['data']['cpu_usage']]
-            sum = {}
-            i = 0
-            for core in cpu_usage:
-                for key, value in core.items():
-                    if key not in sum:
-                        sum[key] = 0
-                    sum[key] += value
-                core['core'] = i
-                core['time'] = item['time']
-                i += 1
-            for key, value in sum.items():
-                sum[key] /= len(item['data']['cpu_usage'])
-            sum['time'] = item['time']
-            sum['core'] = -1
-            cpu_usage.append(sum)
+            cores = item['data']['cpu_usage']
+            fields = cores[0]._fields
+            cpu_usage = [
+                dict(zip(fields, core), core=i, time=item['time'])
+                for i, core in enumerate(cores)
+            ]
+            # transpose once and average every column in a single pass
+            average = {key: sum(column) / len(cores) for key, column in zip(fields, zip(*cores))}
+            average['time'] = item['time']
+            average['core'] = -1
+            cpu_usage.append(average)
 
             cpu_freq = []
             i = 0
@@ -203,6 +277,8 @@ class PSUtil(Sensor):
 
             net_io = []
             for interface, io in item['data']['net_io_counters'].items():
+                if not self.accept('net_io_counters', interface):
+                    continue
                 net = dict(io._asdict())
                 net['interface'] = interface
                 net['time'] = item['time']
@@ -210,6 +286,8 @@ class PSUtil(Sensor):
 
             disk_io = []
             for disk, io in item['data']['disk_io_counters'].items():
+                if not self.accept('disk_io_counters', disk):
+                    continue
                 disk_dict = dict(io._asdict())
                 disk_dict['disk'] = disk
                 disk_dict['time'] = item['time']
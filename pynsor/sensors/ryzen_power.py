@@ -3,7 +3,7 @@ import subprocess
 from datetime import datetime
 
 from .sensor import Sensor
-from pynsor.postgres import Connection
+from pynsor.storage import Connection
 
 class RyzenPower(Sensor):
     def init(self, config: Dict[str, Any]) -> None:
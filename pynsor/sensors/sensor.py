@@ -1,18 +1,297 @@
 from __future__ import annotations
-from typing import Dict, Any, List, Optional
-from pynsor.postgres import DB, Connection
-from datetime import datetime
+from typing import Dict, Any, List, Optional, Type, Union, Tuple, Set
+import re
+import sys
+from fnmatch import translate
+from time import monotonic
+from importlib import import_module
+from pynsor.storage import DB, Connection
+from pynsor.flush import FlushPolicy
+from datetime import datetime, timezone
+
+def plain(value: Any) -> Any:
+    """
+    Convert parsed TOML containers into plain dicts and lists for comparison
+    """
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [plain(v) for v in value]
+    return value
+
+
+def compile_patterns(globs: List[str], regexes: List[str]=[]) -> Optional[re.Pattern]:
+    """
+    Compile glob and regex patterns into a single regex, None if empty
+    """
+    patterns = [translate(p) for p in globs] + [f'(?:{p})\\Z' for p in regexes]
+    if len(patterns) == 0:
+        return None
+    return re.compile("|".join(patterns))
+
+
+class SeriesFilter:
+    """
+    Include/exclude filter for the series names of a table plus the columns
+    to write. Configured per sensor and table:
+
+        [sensor.<name>.filter.<table>]
+        include = ["sd*"]
+        exclude = ["loop*"]
+        include_regex = []
+        exclude_regex = []
+        columns = []          # only write these columns
+        drop = []             # do not write these columns
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.include = compile_patterns(config.get('include', []), config.get('include_regex', []))
+        self.exclude = compile_patterns(config.get('exclude', []), config.get('exclude_regex', []))
+        self.columns = set(config['columns']) if 'columns' in config else None
+        self.drop = set(config.get('drop', []))
+
+    def accept(self, name: str) -> bool:
+        if self.include is not None and self.include.match(name) is None:
+            return False
+        if self.exclude is not None and self.exclude.match(name) is not None:
+            return False
+        return True
+
+    def project(self, row: Dict[str, Any], keys: List[str]) -> Dict[str, Any]:
+        if self.columns is None and len(self.drop) == 0:
+            return row
+        return {
+            k: v for k, v in row.items()
+            if k == 'time' or k in keys or (
+                (self.columns is None or k in self.columns) and k not in self.drop
+            )
+        }
+
+
+class RowRecorder:
+    """
+    Stand-in for a connection that only records the rows a sensor writes,
+    optionally only those of some tables
+    """
+
+    def __init__(self, tables: Optional[Set[str]]=None):
+        self.rows: List[Tuple[str, Dict[str, Any]]] = []
+        self.tables = tables
+
+    def insert(self, table: str, data: Dict[str, Any]) -> None:
+        if self.tables is None or table in self.tables:
+            self.rows.append((table, data))
+
+    def upsert(self, table: str, data: Dict[str, Any], keys: List[str]) -> None:
+        pass
+
+
+class SensorConnection:
+    """
+    Wraps a storage connection for a single sensor. Records the schema the
+    sensor creates and hands the inserted rows to the registered observers
+    once they are saved (see `publish`).
+    """
+
+    def __init__(self, sensor: Sensor, connection: Connection):
+        self.sensor = sensor
+        self.connection = connection
+        self.inserted = 0
+        self.rows: List[Tuple[str, Dict[str, Any]]] = []
+
+        # (table, series) -> [row, number of rows, sums of the FLOAT columns]
+        # while the sensor is aggregated
+        self.groups: Dict[Tuple[str, Tuple], List[Any]] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.connection, name)
+
+    def create_table(self, table: str, items: List[Dict[str, str]], **kwargs) -> str:
+        Sensor.schema[table] = {'columns': items, 'keys': []}
+        self.sensor.tables.add(table)
+        return self.connection.create_table(table, items, **kwargs)
+
+    def create_index(self, table: str, field: Union[str, List[str], Tuple[str]], type: str='BTREE', unique: bool=False) -> str:
+        # single column indices are created on the series name columns
+        # (disk, core, interface, ...), remember them as series keys
+        if isinstance(field, str) and table in Sensor.schema:
+            keys = Sensor.schema[table]['keys']
+            if field not in keys:
+                keys.append(field)
+        return self.connection.create_index(table, field, type=type, unique=unique)
+
+    def insert(self, table: str, data: Dict[str, Any]) -> None:
+        series_filter = self.sensor.filters.get(table, None)
+        if series_filter is not None:
+            # catches everything the sensor did not already filter itself
+            keys = Sensor.schema.get(table, {}).get('keys', [])
+            if len(keys) > 0 and not series_filter.accept(str(data.get(keys[0], ''))):
+                return
+            data = series_filter.project(data, keys)
+
+        if data.get('time', None) in self.sensor.burst_times:
+            if table not in Sensor.burst_tables:
+                self.connection.add_column(table, 'burst', 'BOOLEAN')
+                Sensor.burst_tables.add(table)
+            data = dict(data, burst=True)
+
+        captured = self.sensor.capture_times.get(data.get('time', None), None)
+        if captured is not None:
+            if table not in Sensor.captured_tables:
+                self.connection.add_column(table, 'captured', 'TIMESTAMPTZ')
+                Sensor.captured_tables.add(table)
+            data = dict(data, captured=captured)
+
+        if self.sensor.aggregate:
+            self.accumulate(table, data)
+            return
+        self.write(table, data)
+
+    def write(self, table: str, data: Dict[str, Any]) -> None:
+        self.connection.insert(table, data)
+        self.inserted += 1
+        if len(Sensor.observers) > 0:
+            self.rows.append((table, data))
+
+    def publish(self) -> None:
+        """
+        Hand the written rows to the observers, called after the savepoint
+        of the sensor was released so rolled back rows are never seen
+        """
+        for observer in Sensor.observers:
+            for table, data in self.rows:
+                observer.record(table, data)
+        self.rows = []
+
+    def accumulate(self, table: str, data: Dict[str, Any]) -> None:
+        schema = Sensor.schema.get(table, {'columns': [], 'keys': []})
+        key = (table, tuple(data.get(k, None) for k in schema['keys']))
+        group = self.groups.get(key, None)
+        if group is None:
+            group = self.groups[key] = [data, 0, {}]
+        elif group[0].get('burst', False):
+            data = dict(data, burst=True)
+
+        group[0] = data
+        group[1] += 1
+        sums = group[2]
+        for column in schema['columns']:
+            name = column['name']
+            value = data.get(name, None)
+            if column['type'] == 'FLOAT' and isinstance(value, (int, float)):
+                sums[name] = sums.get(name, 0.0) + value
+
+    def finish(self) -> None:
+        """
+        Write the aggregated rows: the last row of every series with FLOAT
+        columns replaced by their mean
+        """
+        for (table, _), (row, count, sums) in self.groups.items():
+            if count > 1:
+                row = dict(row, **{name: value / count for name, value in sums.items()})
+            self.write(table, row)
+        self.groups = {}
+
 
 class Sensor:
+    # sensors shipped with pynsor, only imported when enabled in the config
+    builtins: Dict[str, str] = {
+        'Agent':      'pynsor.sensors.agent:Agent',
+        'CGroups':    'pynsor.sensors.cgroups:CGroups',
+        'DiskStats':  'pynsor.sensors.diskstats:DiskStats',
+        'Execd':      'pynsor.sensors.execd:Execd',
+        'Interrupts': 'pynsor.sensors.interrupts:Interrupts',
+        'LMSensors':  'pynsor.sensors.lm_sensors:LMSensors',
+        'MemInfo':    'pynsor.sensors.meminfo:MemInfo',
+        'NetDev':     'pynsor.sensors.netdev:NetDev',
+        'Netstat':    'pynsor.sensors.netstat:Netstat',
+        'Pressure':   'pynsor.sensors.pressure:Pressure',
+        'ProcStat':   'pynsor.sensors.stat:ProcStat',
+        'Processes':  'pynsor.sensors.processes:Processes',
+        'PSUtil':     'pynsor.sensors.psutils:PSUtil',
+        'RyzenPower': 'pynsor.sensors.ryzen_power:RyzenPower',
+        'SMARTCtl':   'pynsor.sensors.smartctl:SMARTCtl',
+    }
+
+    # entry point group third party packages can use to add sensors
+    entry_point_group = 'pynsor.sensors'
+
+    classes: Dict[str, Type[Sensor]] = {}
     registry: List[Sensor] = []
 
+    # table name -> {'columns': [...], 'keys': [...]} as created by the sensors
+    schema: Dict[str, Dict[str, Any]] = {}
+
+    # tables that have been extended with the `burst` column
+    burst_tables = set()
+
+    # tables that have been extended with the `captured` column
+    captured_tables = set()
+
+    # set while the tables of the running sensors could not be created (the
+    # DB was down at startup or after switching DBs), nothing is written
+    # until `ensure_datamodels` succeeded
+    datamodels_pending = False
+
+    # objects with `record(table, row)` and `flush(connection)` methods that
+    # want to see every row that is written, `commit()` or `rollback()` is
+    # called when the transaction the rows were recorded in ended
+    observers: List[Any] = []
+
+    # `pynsor.profiling.Profiler` while the agent is profiled, runs `gather`
+    # and `save` of every sensor with `call(sensor, phase, method, *args)`
+    profiler: Optional[Any] = None
+
     def __init__(self):
         self.raw_data = []
+        self.name = self.__class__.__name__
+        self.config = {}
+        self.filters = {}
+        self.tables = set()
+
+        # timestamps of samples taken in burst mode
+        self.burst_times = set()
+
+        # sample timestamp -> time the sample was actually taken, with
+        # `capture_time = true`
+        self.capture_times: Dict[datetime, datetime] = {}
+
+        # learned on every save, used to estimate the rows of buffered samples
+        self.rows_per_sample = 1.0
+        self.failed_saves = 0
+
+        # cost of the last gather and of saving one sample in seconds
+        self.gather_time = 0.0
+        self.save_time = 0.0
+
+        # set by the scheduler and the back pressure handling
+        self.interval: Optional[float] = None
+        self.interval_factor = 1.0
+        self.aggregate = False
+        self.degradations = 0
 
     def init(self, config: Dict[str, Any]) -> None:
+        self.config = plain(config)
         self.is_enabled = True
         if 'enabled' in config and config['enabled'] is False:
             self.is_enabled = False
+        self.filters: Dict[str, SeriesFilter] = {
+            table: SeriesFilter(filter_config)
+            for table, filter_config in config.get('filter', {}).items()
+        }
+
+    def accept(self, table: str, name: str) -> bool:
+        """
+        Check if a series should be recorded, sensors call this before
+        parsing the data of a series to avoid work for filtered series
+
+        :param table: Table the series is written to
+        :param name: Series name (value of the first key column)
+        """
+        series_filter = self.filters.get(table, None)
+        if series_filter is None:
+            return True
+        return series_filter.accept(name)
 
     def gather(self, timestamp: datetime):
         raise NotImplemented("Has to be overridden by sensor subclass")
@@ -26,29 +305,379 @@ class Sensor:
     def create_datamodel(self, connection: Connection) -> None:
         raise NotImplemented("Has to be overridden by sensor subclass")
 
+    def close(self) -> None:
+        pass
+
+    def peek(self, tables: Optional[Set[str]]=None) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Rows the most recent sample would be written as, without writing or
+        consuming anything.
+
+        This runs `save` on the most recent sample, so the sample is parsed
+        twice (once more when it is written). Only call it for sensors whose
+        rows are actually needed.
+
+        :param tables: only return the rows of these tables
+        :returns: list of (table, row)
+        """
+        if len(self.raw_data) == 0:
+            return []
+        raw_data = self.raw_data
+        recorder = RowRecorder(tables)
+        try:
+            self.raw_data = raw_data[-1:]
+            self.save(recorder)
+        finally:
+            self.raw_data = raw_data
+        return recorder.rows
+
+    def drop_oldest(self, max_samples: Optional[int]) -> None:
+        """
+        Drop the oldest buffered samples so at most `max_samples` are left,
+        keeps the memory bounded while the DB can not be written to
+        """
+        excess = len(self.raw_data) - max_samples if max_samples is not None else 0
+        if excess <= 0:
+            return
+        print(f"ERROR: Dropping the {excess} oldest samples of {self.name}, {max_samples} samples are buffered already")
+        for sample in self.raw_data[:excess]:
+            self.burst_times.discard(sample['time'])
+            self.capture_times.pop(sample['time'], None)
+        self.raw_data = self.raw_data[excess:]
+
+    def buffered_bytes(self) -> int:
+        """
+        Approximate size of the buffered raw data
+        """
+        size = 0
+        for item in self.raw_data:
+            data = item.get('data', None)
+            if isinstance(data, (str, bytes)):
+                size += len(data)
+            else:
+                size += sys.getsizeof(data)
+        return size
+
     @classmethod
     def register(cls, sensor_class: type) -> None:
         print(f"Registering {sensor_class.__name__}...")
-        cls.registry.append(sensor_class())
+        cls.classes[sensor_class.__name__] = sensor_class
+
+    @classmethod
+    def discover(cls) -> Dict[str, str]:
+        """
+        Find all available sensors without importing them
+
+        :returns: dict of sensor name to 'module:ClassName'
+        """
+        sensors = dict(cls.builtins)
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return sensors
+
+        eps = entry_points()
+        if hasattr(eps, 'select'):
+            group = eps.select(group=cls.entry_point_group)
+        else:
+            group = eps.get(cls.entry_point_group, [])
+        for ep in group:
+            sensors[ep.name] = ep.value
+        return sensors
+
+    @classmethod
+    def load(cls, name: str) -> Type[Sensor]:
+        """
+        Import a sensor class by its name
+
+        :param name: Sensor name as used in the config (``[sensor.<name>]``)
+        :returns: Sensor subclass
+        """
+        if name in cls.classes:
+            return cls.classes[name]
+
+        path = cls.discover().get(name, None)
+        if path is None:
+            raise ValueError(f"Unknown sensor {name}")
+
+        module_name, _, class_name = path.partition(':')
+        sensor_class = getattr(import_module(module_name), class_name)
+        cls.classes[name] = sensor_class
+        return sensor_class
+
+    @classmethod
+    def kind_of(cls, name: str, config: Dict[str, Any]) -> Tuple[Type[Sensor], bool]:
+        # `type` allows running multiple instances of the same sensor
+        return (cls.load(config.get('type', name)), config.get('isolate', False))
+
+    @classmethod
+    def create(cls, name: str, config: Dict[str, Any]) -> Sensor:
+        """
+        Instantiate the sensor for a config section, sensors with
+        `isolate = true` run in a worker process
+        """
+        sensor_class, isolate = cls.kind_of(name, config)
+        if isolate:
+            from pynsor.workers import IsolatedSensor
+            item = IsolatedSensor(sensor_class, config.get('type', name))
+        else:
+            item = sensor_class()
+        item.name = name
+        return item
+
+    def kind(self) -> Tuple[Type[Sensor], bool]:
+        return (self.__class__, False)
 
     @classmethod
     def init_all(cls, db: DB, config: Dict[str, Any]) -> None:
+        for name, sensor_config in config.items():
+            if sensor_config.get('enabled', True) is False:
+                continue
+            item = cls.create(name, sensor_config)
+            item.init(sensor_config)
+            if item.is_enabled:
+                cls.registry.append(item)
+
+        # the sensors run while the DB is down, their data is kept until the
+        # tables could be created
+        cls.datamodels_pending = True
+        cls.ensure_datamodels(db)
+
+    @classmethod
+    def reload_all(cls, db: DB, config: Dict[str, Any]) -> None:
+        """
+        Apply a changed sensor configuration to the running sensors.
+
+        Sensors that were removed or disabled write their buffered data and
+        are closed, sensors with changed settings are re-initialized in place
+        (buffered data and counter state are kept), new sensors are started.
+        Untouched sensors are not affected at all. If a sensor can not be
+        reconfigured it keeps running with its old settings, a new sensor
+        that fails to start is left out.
+        """
+        running = {item.name: item for item in cls.registry}
+        registry = []
+
+        with db.connect() as cursor:
+            for index, (name, item) in enumerate(running.items()):
+                savepoint = f'reload_{index}'
+                cursor.savepoint(savepoint)
+                old_config = item.config
+                reinitialized = False
+                try:
+                    sensor_config = config.get(name, None)
+                    if sensor_config is None \
+                            or sensor_config.get('enabled', True) is False \
+                            or cls.kind_of(name, sensor_config) != item.kind():
+                        print(f"Stopping {name}...")
+                        connection = SensorConnection(item, cursor)
+                        item.save(connection)
+                        cursor.release_savepoint(savepoint)
+                        connection.publish()
+                        item.close()
+                        continue
+
+                    if plain(sensor_config) != item.config:
+                        print(f"Reconfiguring {name}...")
+                        item.close()
+                        reinitialized = True
+                        item.init(sensor_config)
+                        if not item.is_enabled:
+                            connection = SensorConnection(item, cursor)
+                            item.save(connection)
+                            cursor.release_savepoint(savepoint)
+                            connection.publish()
+                            continue
+                        item.create_datamodel(SensorConnection(item, cursor))
+                    cursor.release_savepoint(savepoint)
+                except Exception as e:
+                    cursor.rollback_to_savepoint(savepoint)
+                    print(f"ERROR: Could not reload {name}, keeping the old configuration: {e!r}")
+                    if reinitialized:
+                        try:
+                            item.close()
+                            item.init(old_config)
+                        except Exception as e:
+                            print(f"ERROR: Could not restore {name}, stopping it: {e!r}")
+                            continue
+                registry.append(item)
+
+            for index, (name, sensor_config) in enumerate(config.items()):
+                if name in running or sensor_config.get('enabled', True) is False:
+                    continue
+                print(f"Starting {name}...")
+                savepoint = f'start_{index}'
+                cursor.savepoint(savepoint)
+                item = None
+                try:
+                    item = cls.create(name, sensor_config)
+                    item.init(sensor_config)
+                    if item.is_enabled:
+                        item.create_datamodel(SensorConnection(item, cursor))
+                        registry.append(item)
+                    cursor.release_savepoint(savepoint)
+                except Exception as e:
+                    cursor.rollback_to_savepoint(savepoint)
+                    print(f"ERROR: Could not start {name}: {e!r}")
+                    if item is not None:
+                        if item in registry:
+                            registry.remove(item)
+                        try:
+                            item.close()
+                        except Exception:
+                            pass
+        cls.commit_observers()
+
+        cls.registry = registry
+
+    @classmethod
+    def create_datamodels(cls, db: DB) -> None:
+        """
+        Create the tables of all running sensors, e.g. after switching to
+        another DB
+        """
+        cls.burst_tables = set()
+        cls.captured_tables = set()
         with db.connect() as cursor:
             for item in cls.registry:
-                item.init(config[item.__class__.__name__])
-                if item.is_enabled:
-                    item.create_datamodel(cursor)
+                item.create_datamodel(SensorConnection(item, cursor))
+
+    @classmethod
+    def ensure_datamodels(cls, db: DB) -> bool:
+        """
+        Create the tables of all running sensors if that failed before
+
+        :returns: True if the tables exist
+        """
+        if not cls.datamodels_pending:
+            return True
+        try:
+            cls.create_datamodels(db)
+        except Exception as e:
+            print(f"ERROR: Could not create the tables, keeping data for the next try: {e!r}")
+            return False
+        cls.datamodels_pending = False
+        return True
 
     @classmethod
-    def gather_all(cls) -> None:
-        t = datetime.now()
+    def close_all(cls) -> None:
         for item in cls.registry:
+            item.close()
+
+    @classmethod
+    def gather_all(cls, items: Optional[List[Sensor]]=None, burst: List[Sensor]=[], timestamp: Optional[datetime]=None) -> None:
+        """
+        Take a sample of all (or the given) sensors
+
+        :param items: sensors to sample, defaults to all
+        :param burst: sensors whose sample should be flagged as burst sample
+        :param timestamp: time to stamp all samples with, by default every
+                          sample gets the time its sensor started (UTC)
+        """
+        for item in (items if items is not None else cls.registry):
             if item.is_enabled:
-                item.gather(t)
+                captured = datetime.now(timezone.utc)
+                t = timestamp or captured
+                start = monotonic()
+                if cls.profiler is not None:
+                    cls.profiler.call(item, 'gather', item.gather, t)
+                else:
+                    item.gather(t)
+                item.gather_time = monotonic() - start
+                if item in burst:
+                    item.burst_times.add(t)
+                if item.config.get('capture_time', False):
+                    item.capture_times[t] = captured
 
     @classmethod
-    def save_all(cls, db: DB) -> None:
-        with db.connect() as cursor:
-            for item in cls.registry:
-                if item.is_enabled:
-                    item.save(cursor)
+    def save_all(cls, db: DB, policy: Optional[FlushPolicy]=None, items: Optional[List[Sensor]]=None) -> None:
+        """
+        Write buffered data to the DB
+
+        :param db: DB to write to
+        :param policy: if set, only sensors that are due according to the
+                       policy are written, otherwise all sensors
+        :param items: sensors to write, defaults to all
+        """
+        items = [item for item in (items if items is not None else cls.registry) if item.is_enabled]
+        if policy is not None:
+            items = policy.due(items)
+            if len(items) == 0:
+                return
+
+        max_retries = policy.max_retries if policy is not None else 3
+        max_buffered = policy.max_buffered if policy is not None else 10000
+        if not cls.ensure_datamodels(db):
+            for item in items:
+                item.drop_oldest(max_buffered)
+            return
+
+        # remember what was buffered, in case the whole transaction fails
+        buffered = [(item, item.raw_data) for item in items]
+        try:
+            with db.connect() as cursor:
+                for index, item in enumerate(items):
+                    samples = len(item.raw_data)
+                    connection = SensorConnection(item, cursor)
+                    savepoint = f'sensor_{index}'
+                    start = monotonic()
+
+                    # every sensor writes in its own savepoint so a failing
+                    # sensor does not roll back the data of all others
+                    cursor.savepoint(savepoint)
+                    raw_data = item.raw_data
+                    try:
+                        if cls.profiler is not None:
+                            cls.profiler.call(item, 'save', item.save, connection)
+                        else:
+                            item.save(connection)
+                        connection.finish()
+                        cursor.release_savepoint(savepoint)
+                        connection.publish()
+                    except Exception as e:
+                        cursor.rollback_to_savepoint(savepoint)
+                        # the sensor may have consumed its data already
+                        item.raw_data = raw_data
+                        item.failed_saves += 1
+                        print(f"ERROR: Could not save {item.name} ({item.failed_saves}/{max_retries}): {e!r}")
+                        if item.failed_saves >= max_retries:
+                            print(f"ERROR: Dropping {samples} samples of {item.name}")
+                            item.raw_data = []
+                            item.burst_times = set()
+                            item.capture_times = {}
+                            item.failed_saves = 0
+                        continue
+                    item.failed_saves = 0
+                    item.burst_times = set()
+                    item.capture_times = {}
+
+                    duration = monotonic() - start
+                    if samples > 0:
+                        item.rows_per_sample = connection.inserted / samples
+                        item.save_time = duration / samples
+                    if policy is not None:
+                        policy.observe(item, connection.inserted, duration)
+                for observer in cls.observers:
+                    observer.flush(cursor)
+        except Exception as e:
+            for observer in cls.observers:
+                observer.rollback()
+            print(f"ERROR: Could not write to the DB, keeping data for the next try: {e!r}")
+            for item, raw_data in buffered:
+                if item.raw_data is not raw_data:
+                    # merge with anything gathered in the meantime
+                    item.raw_data = raw_data + item.raw_data
+                item.drop_oldest(max_buffered)
+            return
+
+        # the rows are in the DB now, a failing observer must not cause them
+        # to be written again
+        cls.commit_observers()
+
+    @classmethod
+    def commit_observers(cls) -> None:
+        for observer in cls.observers:
+            try:
+                observer.commit()
+            except Exception as e:
+                print(f"ERROR: Could not hand the written rows to {observer.__class__.__name__}: {e!r}")
@@ -1,12 +1,129 @@
 from typing import Optional, Dict, Any, List
 import os
 import subprocess
-import json
 from datetime import datetime
 from glob import glob
 
+try:
+    from orjson import loads, JSONDecodeError
+except ImportError:
+    try:
+        from ujson import loads, JSONDecodeError
+    except ImportError:
+        from json import loads, JSONDecodeError
+
 from .sensor import Sensor
-from pynsor.postgres import Connection
+from pynsor.storage import Connection
+
+SATA_FIELDS = [
+    {"name": "disk",                    "type": "TEXT", "null": "NOT NULL"},
+    {"name": "model_name",              "type": "TEXT", "null": "NULL"},
+    {"name": "firmware_version",        "type": "TEXT", "null": "NULL"},
+    {"name": "serial_number",           "type": "TEXT", "null": "NULL"},
+    {"name": "smart_status_passed",     "type": "BOOL", "null": "NULL"},
+    {"name": "logical_block_size",      "type": "INT",  "null": "NULL"},
+    {"name": "physical_block_size",     "type": "INT",  "null": "NULL"},
+
+    {"name": "raw_read_error_rate",     "type": "INT", "null": "NULL"},
+    {"name": "throughput_performance",  "type": "INT", "null": "NULL"},
+    {"name": "spin_up_time",            "type": "INT", "null": "NULL"},
+    {"name": "start_stop_count",        "type": "INT", "null": "NULL"},
+    {"name": "reallocated_sector_ct",   "type": "INT", "null": "NULL"},
+    {"name": "seek_error_rate",         "type": "INT", "null": "NULL"},
+    {"name": "seek_time_performance",   "type": "INT", "null": "NULL"},
+    {"name": "power_on_hours",          "type": "INT", "null": "NULL"},
+    {"name": "spin_retry_count",        "type": "INT", "null": "NULL"},
+    {"name": "power_cycle_count",       "type": "INT", "null": "NULL"},
+    {"name": "g_sense_error_rate",      "type": "INT", "null": "NULL"},
+    {"name": "power_off_retract_count", "type": "INT", "null": "NULL"},
+    {"name": "load_cycle_count",        "type": "INT", "null": "NULL"},
+    {"name": "temperature_celsius",     "type": "BIGINT", "null": "NULL"},
+    {"name": "reallocated_event_count", "type": "INT", "null": "NULL"},
+    {"name": "current_pending_sector",  "type": "BIGINT", "null": "NULL"},
+    {"name": "offline_uncorrectable",   "type": "INT", "null": "NULL"},
+    {"name": "udma_crc_error_count",    "type": "INT", "null": "NULL"},
+    {"name": "disk_shift",              "type": "BIGINT", "null": "NULL"},
+    {"name": "loaded_hours",            "type": "INT", "null": "NULL"},
+    {"name": "load_retry_count",        "type": "INT", "null": "NULL"},
+    {"name": "load_friction",           "type": "INT", "null": "NULL"},
+    {"name": "load_in_time",            "type": "INT", "null": "NULL"},
+    {"name": "head_flying_hours",       "type": "INT", "null": "NULL"},
+    {"name": "calibration_retry_count", "type": "INT", "null": "NULL"},
+    {"name": "multi_zone_error_rate",   "type": "INT", "null": "NULL"},
+
+    # ssd specific
+    {"name": "wear_leveling_count",     "type": "BIGINT", "null": "NULL"},
+    {"name": "used_rsvd_blk_cnt_tot",   "type": "BIGINT", "null": "NULL"},
+    {"name": "program_fail_cnt_total",  "type": "INT", "null": "NULL"},
+    {"name": "erase_fail_count_total",  "type": "INT", "null": "NULL"},
+    {"name": "runtime_bad_block",       "type": "INT", "null": "NULL"},
+    {"name": "uncorrectable_error_cnt", "type": "INT", "null": "NULL"},
+    {"name": "airflow_temperature_cel", "type": "INT", "null": "NULL"},
+    {"name": "ecc_error_rate",          "type": "INT", "null": "NULL"},
+    {"name": "crc_error_count",         "type": "INT", "null": "NULL"},
+    {"name": "por_recovery_count",      "type": "INT", "null": "NULL"},
+    {"name": "total_lbas_written",      "type": "BIGINT", "null": "NULL"},
+
+    # dev stats
+    {"name": "lbas_written",            "type": "BIGINT", "null": "NULL"},
+    {"name": "lbas_read",               "type": "BIGINT", "null": "NULL"},
+]
+
+NVME_FIELDS = [
+    {"name": "disk",                      "type": "TEXT", "null": "NOT NULL"},
+    {"name": "model_name",                "type": "TEXT", "null": "NULL"},
+    {"name": "firmware_version",          "type": "TEXT", "null": "NULL"},
+    {"name": "serial_number",             "type": "TEXT", "null": "NULL"},
+    {"name": "smart_status_passed",       "type": "BOOL", "null": "NULL"},
+    {"name": "logical_block_size",        "type": "INT",  "null": "NULL"},
+
+    {"name": "critical_warning",          "type": "INT", "null": "NULL"},
+    {"name": "temperature",               "type": "INT", "null": "NULL"},
+    {"name": "available_spare",           "type": "INT", "null": "NULL"},
+    {"name": "available_spare_threshold", "type": "INT", "null": "NULL"},
+    {"name": "percentage_used",           "type": "INT", "null": "NULL"},
+    {"name": "data_units_read",           "type": "BIGINT", "null": "NULL"},
+    {"name": "data_units_written",        "type": "BIGINT", "null": "NULL"},
+    {"name": "host_reads",                "type": "BIGINT", "null": "NULL"},
+    {"name": "host_writes",               "type": "BIGINT", "null": "NULL"},
+    {"name": "controller_busy_time",      "type": "INT", "null": "NULL"},
+    {"name": "power_cycles",              "type": "INT", "null": "NULL"},
+    {"name": "power_on_hours",            "type": "INT", "null": "NULL"},
+    {"name": "unsafe_shutdowns",          "type": "INT", "null": "NULL"},
+    {"name": "media_errors",              "type": "INT", "null": "NULL"},
+    {"name": "warning_temp_time",         "type": "INT", "null": "NULL"},
+    {"name": "critical_comp_time",        "type": "INT", "null": "NULL"},
+]
+
+# smartctl attribute name -> column, e.g. `Raw_Read_Error_Rate`, filled on
+# first sight of a name so every attribute is normalized only once
+SATA_COLUMNS = frozenset(field['name'] for field in SATA_FIELDS)
+ATTRIBUTE_COLUMNS: Dict[str, Optional[str]] = {}
+
+# device statistics page -> statistic -> column
+DEVSTAT_COLUMNS = {
+    'General Statistics': {
+        'Logical Sectors Written': 'lbas_written',
+        'Logical Sectors Read':    'lbas_read',
+    }
+}
+
+# columns taken from the nvme health log
+NVME_COLUMNS = [
+    field['name'] for field in NVME_FIELDS
+    if field['name'] not in ('disk', 'model_name', 'firmware_version', 'serial_number', 'smart_status_passed', 'logical_block_size')
+]
+
+
+def attribute_column(name: str) -> Optional[str]:
+    column = ATTRIBUTE_COLUMNS.get(name, False)
+    if column is False:
+        column = name.lower().replace('-', '_')
+        if column not in SATA_COLUMNS:
+            column = None
+        ATTRIBUTE_COLUMNS[name] = column
+    return column
+
 
 class SMARTCtl(Sensor):
     def init(self, config: Dict[str, Any]) -> None:
@@ -18,88 +135,7 @@ class SMARTCtl(Sensor):
             self.disks.extend(glob(item))
 
     def fields(self, typ: str):
-        fields = {
-            'sata': [
-                {"name": "disk",                    "type": "TEXT", "null": "NOT NULL"},
-                {"name": "model_name",              "type": "TEXT", "null": "NULL"},
-                {"name": "firmware_version",        "type": "TEXT", "null": "NULL"},
-                {"name": "serial_number",           "type": "TEXT", "null": "NULL"},
-                {"name": "smart_status_passed",     "type": "BOOL", "null": "NULL"},
-                {"name": "logical_block_size",      "type": "INT",  "null": "NULL"},
-                {"name": "physical_block_size",     "type": "INT",  "null": "NULL"},
-
-                {"name": "raw_read_error_rate",     "type": "INT", "null": "NULL"},
-                {"name": "throughput_performance",  "type": "INT", "null": "NULL"},
-                {"name": "spin_up_time",            "type": "INT", "null": "NULL"},
-                {"name": "start_stop_count",        "type": "INT", "null": "NULL"},
-                {"name": "reallocated_sector_ct",   "type": "INT", "null": "NULL"},
-                {"name": "seek_error_rate",         "type": "INT", "null": "NULL"},
-                {"name": "seek_time_performance",   "type": "INT", "null": "NULL"},
-                {"name": "power_on_hours",          "type": "INT", "null": "NULL"},
-                {"name": "spin_retry_count",        "type": "INT", "null": "NULL"},
-                {"name": "power_cycle_count",       "type": "INT", "null": "NULL"},
-                {"name": "g_sense_error_rate",      "type": "INT", "null": "NULL"},
-                {"name": "power_off_retract_count", "type": "INT", "null": "NULL"},
-                {"name": "load_cycle_count",        "type": "INT", "null": "NULL"},
-                {"name": "temperature_celsius",     "type": "BIGINT", "null": "NULL"},
-                {"name": "reallocated_event_count", "type": "INT", "null": "NULL"},
-                {"name": "current_pending_sector",  "type": "BIGINT", "null": "NULL"},
-                {"name": "offline_uncorrectable",   "type": "INT", "null": "NULL"},
-                {"name": "udma_crc_error_count",    "type": "INT", "null": "NULL"},
-                {"name": "disk_shift",              "type": "BIGINT", "null": "NULL"},
-                {"name": "loaded_hours",            "type": "INT", "null": "NULL"},
-                {"name": "load_retry_count",        "type": "INT", "null": "NULL"},
-                {"name": "load_friction",           "type": "INT", "null": "NULL"},
-                {"name": "load_in_time",            "type": "INT", "null": "NULL"},
-                {"name": "head_flying_hours",       "type": "INT", "null": "NULL"},
-                {"name": "calibration_retry_count", "type": "INT", "null": "NULL"},
-                {"name": "multi_zone_error_rate",   "type": "INT", "null": "NULL"},
-                
-                # ssd specific
-                {"name": "wear_leveling_count",     "type": "BIGINT", "null": "NULL"},
-                {"name": "used_rsvd_blk_cnt_tot",   "type": "BIGINT", "null": "NULL"},
-                {"name": "program_fail_cnt_total",  "type": "INT", "null": "NULL"},
-                {"name": "erase_fail_count_total",  "type": "INT", "null": "NULL"},
-                {"name": "runtime_bad_block",       "type": "INT", "null": "NULL"},
-                {"name": "uncorrectable_error_cnt", "type": "INT", "null": "NULL"},
-                {"name": "airflow_temperature_cel", "type": "INT", "null": "NULL"},
-                {"name": "ecc_error_rate",          "type": "INT", "null": "NULL"},
-                {"name": "crc_error_count",         "type": "INT", "null": "NULL"},
-                {"name": "por_recovery_count",      "type": "INT", "null": "NULL"},
-                {"name": "total_lbas_written",      "type": "BIGINT", "null": "NULL"},
-
-                # dev stats
-                {"name": "lbas_written",            "type": "BIGINT", "null": "NULL"},
-                {"name": "lbas_read",               "type": "BIGINT", "null": "NULL"},
-
-            ],
-            'nvme': [
-                {"name": "disk",                      "type": "TEXT", "null": "NOT NULL"},
-                {"name": "model_name",                "type": "TEXT", "null": "NULL"},
-                {"name": "firmware_version",          "type": "TEXT", "null": "NULL"},
-                {"name": "serial_number",             "type": "TEXT", "null": "NULL"},
-                {"name": "smart_status_passed",       "type": "BOOL", "null": "NULL"},
-                {"name": "logical_block_size",        "type": "INT",  "null": "NULL"},
-                
-                {"name": "critical_warning",          "type": "INT", "null": "NULL"},
-                {"name": "temperature",               "type": "INT", "null": "NULL"},
-                {"name": "available_spare",           "type": "INT", "null": "NULL"},
-                {"name": "available_spare_threshold", "type": "INT", "null": "NULL"},
-                {"name": "percentage_used",           "type": "INT", "null": "NULL"},
-                {"name": "data_units_read",           "type": "BIGINT", "null": "NULL"},
-                {"name": "data_units_written",        "type": "BIGINT", "null": "NULL"},
-                {"name": "host_reads",                "type": "BIGINT", "null": "NULL"},
-                {"name": "host_writes",               "type": "BIGINT", "null": "NULL"},
-                {"name": "controller_busy_time",      "type": "INT", "null": "NULL"},
-                {"name": "power_cycles",              "type": "INT", "null": "NULL"},
-                {"name": "power_on_hours",            "type": "INT", "null": "NULL"},
-                {"name": "unsafe_shutdowns",          "type": "INT", "null": "NULL"},
-                {"name": "media_errors",              "type": "INT", "null": "NULL"},
-                {"name": "warning_temp_time",         "type": "INT", "null": "NULL"},
-                {"name": "critical_comp_time",        "type": "INT", "null": "NULL"},
-            ]
-        }
-        return fields[typ]
+        return {'sata': SATA_FIELDS, 'nvme': NVME_FIELDS}[typ]
 
     def create_datamodel(self, connection: Connection) -> None:
         connection.create_table('sata_smart', self.fields('sata'))
@@ -113,13 +149,18 @@ class SMARTCtl(Sensor):
 
     def gather(self, timestamp: datetime):
         for path in self.disks:
+            disk = os.path.basename(path)
+            if not self.accept('sata_smart', disk) and not self.accept('nvme_smart', disk):
+                continue
             try:
-                output = subprocess.check_output([self.binary_path, '--nocheck', 'standby', '-a', '-l', 'devstat', '-j', path])
+                # only the sections that are written, `-a` adds the error and
+                # self test logs which are large on old disks
+                output = subprocess.check_output([self.binary_path, '--nocheck', 'standby', '-i', '-H', '-A', '-l', 'devstat', '-j', path])
             except subprocess.CalledProcessError as e:
                 output = e.output
             self.raw_data.append({
                 'time': timestamp,
-                'disk': os.path.basename(path),
+                'disk': disk,
                 'data': output
             })
             
@@ -131,7 +172,12 @@ class SMARTCtl(Sensor):
         result = []
         for item in self.raw_data:
             try:
-                json_data = json.loads(item['data'])
+                json_data = loads(item['data'])
+            except (ValueError, JSONDecodeError):
+                print(f"WARNING: Could not decode smartctl output for {item['disk']}, skipping")
+                continue
+
+            try:
                 data = {
                     'data': {
                         'time': item['time'],
@@ -144,35 +190,45 @@ class SMARTCtl(Sensor):
                     }
                 }
             except KeyError as e:
-                if json_data['smartctl']['messages'][0]['string'].startswith('Device is in STANDBY mode'):
+                messages = json_data.get('smartctl', {}).get('messages', [])
+                if len(messages) > 0 and messages[0]['string'].startswith('Device is in STANDBY mode'):
                     continue
-                raise e
-
-            if json_data['device']['type'] == 'nvme':
-                data['type'] = 'nvme_smart'
-                for field in self.fields('nvme'):
-                    value = json_data['nvme_smart_health_information_log'].get(field['name'], None)
-                    if value is not None:
-                        data['data'][field['name']] = value
-
-            if json_data['device']['type'] == 'sat':
-                data['type'] = 'sata_smart'
-                data['data']['physical_block_size'] = json_data['physical_block_size']
-                if 'ata_device_statistics' in json_data:
-                    for page in json_data['ata_device_statistics']['pages']:
-                        if page['name'] == 'General Statistics':
-                            for column in page['table']:
-                                if column['name'] == 'Logical Sectors Written':
-                                    data['data']['lbas_written'] = column['value']
-                                if column['name'] == 'Logical Sectors Read':
-                                    data['data']['lbas_read'] = column['value']
-                for smart_attribute in json_data['ata_smart_attributes']['table']:
-                    name = smart_attribute['name'].lower().replace('-', '_')
-                    value = smart_attribute['raw']['value']
-                    for field in self.fields('sata'):
-                        if field['name'] == name:
-                            data['data'][name] = value
-                            break
+                # only skip this disk, do not lose the readings of all others
+                print(f"WARNING: Unexpected smartctl output for {item['disk']}, missing {e}, skipping")
+                continue
+
+            try:
+                device_type = json_data['device']['type']
+                if device_type == 'nvme':
+                    data['type'] = 'nvme_smart'
+                    health = json_data['nvme_smart_health_information_log']
+                    for column in NVME_COLUMNS:
+                        value = health.get(column, None)
+                        if value is not None:
+                            data['data'][column] = value
+
+                if device_type == 'sat':
+                    data['type'] = 'sata_smart'
+                    data['data']['physical_block_size'] = json_data['physical_block_size']
+                    if 'ata_device_statistics' in json_data:
+                        for page in json_data['ata_device_statistics']['pages']:
+                            columns = DEVSTAT_COLUMNS.get(page['name'], None)
+                            if columns is None:
+                                continue
+                            for statistic in page['table']:
+                                column = columns.get(statistic['name'], None)
+                                if column is not None:
+                                    data['data'][column] = statistic['value']
+                    for smart_attribute in json_data['ata_smart_attributes']['table']:
+                        column = attribute_column(smart_attribute['name'])
+                        if column is not None:
+                            data['data'][column] = smart_attribute['raw']['value']
+            except KeyError as e:
+                print(f"WARNING: Unexpected smartctl output for {item['disk']}, missing {e}, skipping")
+                continue
+
+            if 'type' not in data:
+                continue
 
             result.append(data)
 
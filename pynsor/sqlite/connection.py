@@ -0,0 +1,333 @@
+from typing import Dict, Any, List, Union, Tuple, Optional
+import os
+import sqlite3
+from time import monotonic
+from datetime import datetime, timedelta, timezone
+
+from pynsor import storage
+
+
+# partition length -> (days, function returning the first day of the partition)
+PARTITIONS = {
+    'day':   (1, lambda t: t),
+    'week':  (7, lambda t: t - timedelta(days=t.weekday())),
+    'month': (31, lambda t: t.replace(day=1)),
+}
+
+# SQLite refuses compound selects of more than 500 terms (SQLITE_MAX_COMPOUND_SELECT)
+MAX_VIEW_PARTITIONS = 500
+
+
+def utc(value: datetime) -> datetime:
+    """
+    Naive UTC time of a timestamp, naive timestamps are taken as local time
+    """
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def convert(value: Any) -> Any:
+    # times are stored as UTC text, which sorts and compares correctly
+    if isinstance(value, datetime):
+        return utc(value).isoformat(sep=' ')
+    return value
+
+
+class DB(storage.DB):
+    """
+    Local SQLite database in WAL mode.
+
+    Time series tables are partitioned by time into tables named
+    `<table>_<YYYYMMDD>` (first day of the partition), a view named `<table>`
+    unions the newest `view_partitions` partitions. Partitions older than
+    `retention_days` are dropped.
+    """
+
+    data_errors = storage.DB.data_errors + (sqlite3.IntegrityError, sqlite3.DataError)
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        self.path = config.get('path', '/var/lib/pynsor/pynsor.db')
+        self.partition_length = config.get('partition', 'day')
+        if self.partition_length not in PARTITIONS:
+            print(f"ERROR: Unknown partition length {self.partition_length}, using day")
+            self.partition_length = 'day'
+        self.retention_days = config.get('retention_days', 30)
+        self.prune_interval = config.get('prune_interval', 3600)
+        self.view_partitions = config.get('view_partitions', MAX_VIEW_PARTITIONS)
+        if not 0 < self.view_partitions <= MAX_VIEW_PARTITIONS:
+            print(f"ERROR: view_partitions has to be between 1 and {MAX_VIEW_PARTITIONS}, using {MAX_VIEW_PARTITIONS}")
+            self.view_partitions = MAX_VIEW_PARTITIONS
+        self.last_prune = None
+
+        # table -> {'columns': [...], 'hypertable': bool, 'indexes': [(field, unique), ...]}
+        self.tables: Dict[str, Dict[str, Any]] = {}
+
+        # table -> first days of the existing partitions, read from the DB
+        # when None
+        self.partitions: Optional[Dict[str, List[str]]] = None
+
+        self.connection = None
+
+    def connect(self) -> 'Connection':
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory != '':
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        return Connection(self)
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def stats(self) -> Dict[str, int]:
+        size = 0
+        for path in (self.path, self.path + '-wal'):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        free = 0
+        if self.connection is not None:
+            page_size = self.execute("PRAGMA page_size").fetchone()[0]
+            free = self.execute("PRAGMA freelist_count").fetchone()[0] * page_size
+        return {'bytes': size, 'free_bytes': free}
+
+    def execute(self, sql: str, parameters: Union[Tuple, Dict[str, Any]]=()) -> sqlite3.Cursor:
+        return self.connection.execute(sql, parameters)
+
+    def existing_partitions(self) -> Dict[str, List[str]]:
+        if self.partitions is None:
+            self.partitions = {}
+            names = [row[0] for row in self.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            for table in self.tables:
+                if not self.tables[table]['hypertable']:
+                    continue
+                prefix = table + '_'
+                self.partitions[table] = sorted(
+                    name[len(prefix):] for name in names
+                    if name.startswith(prefix) and len(name) == len(prefix) + 8 and name[len(prefix):].isdigit()
+                )
+        return self.partitions
+
+    def columns(self, table: str) -> List[str]:
+        return [row[1] for row in self.execute(f'PRAGMA table_info("{table}")')]
+
+    def create_physical(self, name: str, table: str) -> None:
+        definition = self.tables[table]
+        fields = [f'"{value["name"]}" {value["type"]} {value["null"]}' for value in definition['columns']]
+        fields = ",\n".join(["time TEXT NOT NULL DEFAULT (datetime('now'))"] + fields)
+        self.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (\n{fields}\n)')
+
+        # bring tables of earlier runs up to date with added columns
+        existing = self.columns(name)
+        for value in definition['columns']:
+            if value['name'] not in existing:
+                self.execute(f'ALTER TABLE "{name}" ADD COLUMN "{value["name"]}" {value["type"]}')
+
+        for field, unique in definition['indexes']:
+            self.create_physical_index(name, field, unique)
+
+    def create_physical_index(self, name: str, field: Union[str, List[str], Tuple[str]], unique: bool) -> None:
+        fields = [field] if isinstance(field, str) else list(field)
+        index_name = name + "_" + ("_".join(fields)) + "_idx"
+        sql = "CREATE UNIQUE INDEX" if unique else "CREATE INDEX"
+        sql += f' IF NOT EXISTS "{index_name}" ON "{name}" (' + (",".join([f'"{v}"' for v in fields])) + ")"
+        self.execute(sql)
+
+    def update_view(self, table: str) -> None:
+        columns = ", ".join(['time'] + [f'"{value["name"]}"' for value in self.tables[table]['columns']])
+        partitions = self.existing_partitions().get(table, [])
+        self.execute(f'DROP VIEW IF EXISTS "{table}"')
+        if len(partitions) == 0:
+            return
+        # older partitions are still there, but only readable on their own
+        partitions = partitions[-self.view_partitions:]
+        selects = [f'SELECT {columns} FROM "{table}_{partition}"' for partition in partitions]
+        self.execute(f'CREATE VIEW "{table}" AS ' + " UNION ALL ".join(selects))
+
+    def partition(self, table: str, timestamp: Any) -> str:
+        """
+        Name of the physical table a row is written to, creates the partition
+        if needed
+        """
+        if not self.tables.get(table, {}).get('hypertable', False):
+            return table
+        timestamp = utc(timestamp) if isinstance(timestamp, datetime) else utc(datetime.now(timezone.utc))
+        _, first_day = PARTITIONS[self.partition_length]
+        partition = first_day(timestamp).strftime('%Y%m%d')
+
+        partitions = self.existing_partitions().setdefault(table, [])
+        if partition not in partitions:
+            self.create_physical(f'{table}_{partition}', table)
+            partitions.append(partition)
+            partitions.sort()
+            self.update_view(table)
+        return f'{table}_{partition}'
+
+    def prune(self) -> None:
+        """
+        Drop all partitions that are completely older than the retention
+        period
+        """
+        now = monotonic()
+        if self.retention_days <= 0 or (self.last_prune is not None and now - self.last_prune < self.prune_interval):
+            return
+        self.last_prune = now
+
+        days, _ = PARTITIONS[self.partition_length]
+        cutoff = (utc(datetime.now(timezone.utc)) - timedelta(days=self.retention_days + days)).strftime('%Y%m%d')
+        self.execute("BEGIN")
+        try:
+            for table, partitions in self.existing_partitions().items():
+                expired = [partition for partition in partitions if partition < cutoff]
+                if len(expired) == 0:
+                    continue
+                for partition in expired:
+                    print(f"Dropping expired partition {table}_{partition}")
+                    self.execute(f'DROP TABLE "{table}_{partition}"')
+                    partitions.remove(partition)
+                self.update_view(table)
+            self.execute("COMMIT")
+        except Exception:
+            self.execute("ROLLBACK")
+            self.partitions = None
+            raise
+
+
+class Connection(storage.Connection):
+    """
+    A transaction on the SQLite DB. Inserted rows are collected and written
+    with one `executemany` per table and column set when a savepoint is
+    released or the transaction is committed, so a failing row is rolled
+    back with its savepoint.
+    """
+
+    def __init__(self, db: DB):
+        self.db = db
+
+    def __enter__(self):
+        # (table, columns) -> rows
+        self.batches: Dict[Tuple[str, Tuple[str, ...]], List[Dict[str, Any]]] = {}
+        self.savepoints: Dict[str, Dict[Tuple[str, Tuple[str, ...]], int]] = {}
+        self.db.execute("BEGIN")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            try:
+                self.write()
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                self.db.partitions = None
+                raise
+            self.db.prune()
+        else:
+            self.db.execute("ROLLBACK")
+            self.db.partitions = None
+        self.batches = {}
+
+    def write(self) -> None:
+        # rows of a batch can end up in different partitions
+        physical: Dict[Tuple[str, Tuple[str, ...]], List[Tuple]] = {}
+        for (table, columns), rows in self.batches.items():
+            for row in rows:
+                name = self.db.partition(table, row.get('time', None))
+                physical.setdefault((name, columns), []).append(tuple(convert(row[c]) for c in columns))
+
+        for (name, columns), rows in physical.items():
+            keys = ", ".join([f'"{k}"' for k in columns])
+            placeholders = ", ".join(['?'] * len(columns))
+            self.db.connection.executemany(f'INSERT INTO "{name}" ({keys}) VALUES ({placeholders})', rows)
+        self.batches = {}
+
+    def savepoint(self, name: str) -> None:
+        self.savepoints[name] = {key: len(rows) for key, rows in self.batches.items()}
+        self.db.execute(f"SAVEPOINT {name}")
+
+    def release_savepoint(self, name: str) -> None:
+        # errors in the rows of the savepoint are raised before it is released
+        self.write()
+        self.savepoints.pop(name, None)
+        self.db.execute(f"RELEASE SAVEPOINT {name}")
+
+    def rollback_to_savepoint(self, name: str) -> None:
+        counts = self.savepoints.get(name, {})
+        for key, rows in self.batches.items():
+            del rows[counts.get(key, 0):]
+        self.db.execute(f"ROLLBACK TO SAVEPOINT {name}")
+        # partitions created inside the savepoint are gone again
+        self.db.partitions = None
+
+    def insert(self, table: str, data: Dict[str, Any]) -> None:
+        self.batches.setdefault((table, tuple(data.keys())), []).append(data)
+
+    def upsert(self, table: str, data: Dict[str, Any], keys: List[str]) -> None:
+        name = self.db.partition(table, data.get('time', None))
+        values = {k: convert(v) for k, v in data.items()}
+        columns = ", ".join([f'"{k}"' for k in data.keys()])
+        placeholders = ", ".join([f':{k}' for k in data.keys()])
+        if len(keys) == 0:
+            self.db.execute(f'DELETE FROM "{name}"')
+            self.db.execute(f'INSERT INTO "{name}" ({columns}) VALUES ({placeholders})', values)
+            return
+
+        conflict = ", ".join([f'"{k}"' for k in keys])
+        updates = ", ".join([f'"{k}" = excluded."{k}"' for k in data.keys() if k not in keys])
+        self.db.execute(
+            f'INSERT INTO "{name}" ({columns}) VALUES ({placeholders}) ON CONFLICT ({conflict}) DO UPDATE SET {updates}',
+            values
+        )
+
+    def create_table(self, table: str, items: List[Dict[str, str]], hypertable: bool=True) -> str:
+        result = 'already_exists' if table in self.db.tables else 'ok'
+        indexes = self.db.tables.get(table, {}).get('indexes', [])
+        # like on PostgreSQL columns are never dropped, e.g. `burst` or
+        # columns of fields that are no longer configured
+        names = {value['name'] for value in items}
+        columns = list(items) + [
+            value for value in self.db.tables.get(table, {}).get('columns', [])
+            if value['name'] not in names
+        ]
+        self.db.tables[table] = {'columns': columns, 'hypertable': hypertable, 'indexes': indexes}
+        if hypertable:
+            # rediscover the partitions of this table
+            self.db.partitions = None
+            for partition in self.db.existing_partitions().get(table, []):
+                self.db.create_physical(f'{table}_{partition}', table)
+            self.db.update_view(table)
+        else:
+            self.db.create_physical(table, table)
+        return result
+
+    def add_column(self, table: str, name: str, type: str, null: str='NULL') -> None:
+        definition = self.db.tables[table]
+        if any(value['name'] == name for value in definition['columns']):
+            return
+        definition['columns'].append({'name': name, 'type': type, 'null': null})
+        if definition['hypertable']:
+            names = [f'{table}_{partition}' for partition in self.db.existing_partitions().get(table, [])]
+        else:
+            names = [table]
+        for physical in names:
+            # may already exist from an earlier run
+            if name not in self.db.columns(physical):
+                self.db.execute(f'ALTER TABLE "{physical}" ADD COLUMN "{name}" {type}')
+        if definition['hypertable']:
+            self.db.update_view(table)
+
+    def create_index(self, table: str, field: Union[str, List[str], Tuple[str]], type: str='BTREE', unique: bool=False) -> str:
+        # SQLite only knows btree indices, `type` is ignored
+        definition = self.db.tables[table]
+        key = (tuple(field) if not isinstance(field, str) else field, unique)
+        if key in definition['indexes']:
+            return 'already_exists'
+        definition['indexes'].append(key)
+        if definition['hypertable']:
+            for partition in self.db.existing_partitions().get(table, []):
+                self.db.create_physical_index(f'{table}_{partition}', field, unique)
+        else:
+            self.db.create_physical_index(table, field, unique)
+        return 'ok'
@@ -0,0 +1,149 @@
+from typing import Dict, Any, List, Union, Tuple, Type
+from importlib import import_module
+
+
+class Connection:
+    """
+    Interface of a storage backend connection. Sensors only use these calls,
+    a connection is used as a context manager that commits everything
+    written on a clean exit and rolls back on exceptions.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def savepoint(self, name: str) -> None:
+        raise NotImplementedError
+
+    def release_savepoint(self, name: str) -> None:
+        raise NotImplementedError
+
+    def rollback_to_savepoint(self, name: str) -> None:
+        raise NotImplementedError
+
+    def insert(self, table: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def upsert(self, table: str, data: Dict[str, Any], keys: List[str]) -> None:
+        """
+        Insert a row or update the existing row with the same keys
+
+        :param table: Table name, needs a unique index over `keys`
+        :param data: Row to write
+        :param keys: Columns identifying the row, if empty the table only
+                     ever holds a single row
+        """
+        raise NotImplementedError
+
+    def create_table(self, table: str, items: List[Dict[str, str]], hypertable: bool=True) -> str:
+        """
+        Create a table if it not exists already, every table has an additional
+        `time` column
+
+        :param table: Table name
+        :param items: Fields to create, is a list {'name': 'measurement', 'type': "TEXT", 'null': 'NOT NULL'}
+        :param hypertable: set to False to create a plain (not time partitioned) table
+        :returns: 'already_exists', 'ok' or 'error'
+        """
+        raise NotImplementedError
+
+    def add_column(self, table: str, name: str, type: str, null: str='NULL') -> None:
+        """
+        Add a column to an existing table if it does not exist yet, called
+        on every start (and for every new `burst`/`captured` table), so an
+        existing column must not touch (or lock) the table
+        """
+        raise NotImplementedError
+
+    def create_index(self, table: str, field: Union[str, List[str], Tuple[str]], type: str='BTREE', unique: bool=False) -> str:
+        """
+        Create an index over the fields
+
+        :param table: Table to create index on
+        :param field: str or list of str, fields to create index over
+        :param type: index type, defaults to btree
+        :returns: 'already_exists', 'ok' or 'error'
+        """
+        raise NotImplementedError
+
+
+class DB:
+    """
+    Interface of a storage backend
+    """
+
+    # whether connections may be used from multiple threads at the same time
+    concurrent = False
+
+    # errors caused by the data written rather than by the backend, writing
+    # the same rows again will fail again
+    data_errors: Tuple[Type[Exception], ...] = (ValueError, TypeError, OverflowError)
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+
+    def connect(self) -> Connection:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Storage used by the backend, e.g. `bytes` on disk
+
+        :returns: dict of counter name to value, empty if not supported
+        """
+        return {}
+
+
+# storage backends, only imported when configured
+backends: Dict[str, str] = {
+    'columnar': 'pynsor.columnar:DB',
+    'postgres': 'pynsor.postgres:DB',
+    'sqlite':   'pynsor.sqlite:DB',
+}
+
+
+def load_backend(name: str) -> DB:
+    if name not in backends:
+        raise ValueError(f"Unknown storage backend {name}")
+    module, _, cls = backends[name].partition(':')
+    return getattr(import_module(module), cls)
+
+
+def open_db(config: Dict[str, Any]) -> DB:
+    """
+    Open the configured destinations:
+
+    - `[db]`: the DB, `backend` is `postgres` by default or `sqlite`
+    - `[columnar]`: columnar files
+    - `[destination.<name>]`: any number of named destinations with routing
+      rules, see `pynsor.fanout.Destination`
+
+    A single `[db]` or `[columnar]` section is written to directly, otherwise
+    every destination gets its own queue and writer.
+    """
+    destinations = {}
+    if 'db' in config and config['db'].get('enabled', True):
+        destinations['db'] = dict(config['db'])
+    if 'columnar' in config and config['columnar'].get('enabled', True):
+        destinations['columnar'] = dict(config['columnar'], backend='columnar')
+    for name, destination in config.get('destination', {}).items():
+        if destination.get('enabled', True):
+            destinations[name] = dict(destination)
+    if len(destinations) == 0:
+        raise ValueError("No [db], [columnar] or [destination.<name>] configured")
+
+    if len(destinations) == 1 and 'destination' not in config:
+        destination = next(iter(destinations.values()))
+        return load_backend(destination.get('backend', 'postgres'))(destination)
+
+    from .fanout import Destination, FanoutDB
+    return FanoutDB([
+        Destination(name, load_backend(destination.get('backend', 'postgres'))(destination), destination)
+        for name, destination in destinations.items()
+    ])
@@ -0,0 +1,302 @@
+from typing import Dict, Any, List, Tuple, Optional, Type
+import os
+import pickle
+import signal
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from time import monotonic
+from datetime import datetime
+
+from pynsor.storage import Connection
+from pynsor.sensors.sensor import Sensor
+
+
+class OperationRecorder:
+    """
+    Stand-in for a connection that records all calls
+    """
+
+    def __init__(self):
+        self.operations: List[Tuple[str, Tuple, Dict[str, Any]]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        def record(*args, **kwargs):
+            self.operations.append((name, args, kwargs))
+            return 'ok'
+        return record
+
+
+def columnar(operations: List[Tuple[str, Tuple, Dict[str, Any]]]) -> List[Tuple]:
+    """
+    Turn runs of inserts into the same table with the same columns into
+    column lists, all other calls are kept as they are
+    """
+    result = []
+    for name, args, kwargs in operations:
+        if name != 'insert':
+            result.append((name, args, kwargs))
+            continue
+        table, data = args
+        columns = tuple(data.keys())
+        if len(result) > 0 and result[-1][0] == 'columns' and result[-1][1] == table and result[-1][2] == columns:
+            values = result[-1][3]
+        else:
+            values = [[] for _ in columns]
+            result.append(('columns', table, columns, values))
+        for i, value in enumerate(data.values()):
+            values[i].append(value)
+    return result
+
+
+def replay(operations: List[Tuple], connection: Connection) -> None:
+    for operation in operations:
+        if operation[0] == 'columns':
+            _, table, columns, values = operation
+            for row in zip(*values):
+                connection.insert(table, dict(zip(columns, row)))
+        else:
+            name, args, kwargs = operation
+            getattr(connection, name)(*args, **kwargs)
+
+
+def block_name(pid: int, sequence: int) -> str:
+    """
+    Name of the shared memory block for the `sequence`th sample of a worker,
+    known to both sides so the parent can clean up after a hung worker
+    """
+    return f'pynsor-{pid}-{sequence}'
+
+
+def worker_main(pipe: Any, sensor_type: str, name: str, config: Dict[str, Any]) -> None:
+    """
+    Runs a sensor in a worker process: every `gather` command takes a sample,
+    converts it to rows and sends them back in a shared memory block
+    """
+    # the parent handles ctrl-c and shuts the workers down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    sensor = Sensor.load(sensor_type)()
+    sensor.name = name
+    sensor.init(config)
+    recorder = OperationRecorder()
+    sensor.create_datamodel(recorder)
+    pipe.send(('ready', sensor.is_enabled, recorder.operations))
+
+    sequence = 0
+    while True:
+        try:
+            message = pipe.recv()
+        except EOFError:
+            break
+        if message[0] == 'stop':
+            break
+
+        timestamp = message[1]
+        sequence += 1
+        try:
+            sensor.gather(timestamp)
+            recorder = OperationRecorder()
+            sensor.save(recorder)
+            payload = pickle.dumps(columnar(recorder.operations), protocol=pickle.HIGHEST_PROTOCOL)
+            shm = SharedMemory(name=block_name(os.getpid(), sequence), create=True, size=max(1, len(payload)))
+            shm.buf[:len(payload)] = payload
+            pipe.send(('batch', timestamp, shm.name, len(payload)))
+            shm.close()
+        except Exception as e:
+            pipe.send(('error', timestamp, repr(e)))
+    sensor.close()
+
+
+class IsolatedSensor(Sensor):
+    """
+    Proxy for a sensor that runs in its own worker process (`isolate = true`
+    in the sensor section). Parsing happens in the worker, the parsed rows
+    come back as column lists through shared memory. A crashed worker is
+    restarted on the next tick, a worker that stays `worker_max_pending`
+    samples behind for longer than `worker_timeout` is considered hung and
+    restarted as well.
+    """
+
+    def __init__(self, sensor_class: Type[Sensor], sensor_type: str):
+        super().__init__()
+        self.sensor_class = sensor_class
+        self.sensor_type = sensor_type
+        self.process = None
+        self.pipe = None
+        self.pending = 0
+        self.sequence = 0
+        self.behind_since = None
+        self.last_start = None
+        self.datamodel: List[Tuple] = []
+
+    def kind(self) -> Tuple[Type[Sensor], bool]:
+        return (self.sensor_class, True)
+
+    def init(self, config: Dict[str, Any]) -> None:
+        super().init(config)
+        self.timeout = self.config.get('worker_timeout', 30)
+        self.max_pending = self.config.get('worker_max_pending', 3)
+        self.restart_interval = self.config.get('worker_restart_interval', 10)
+        self.start()
+        if self.process is None:
+            self.is_enabled = False
+
+    def start(self) -> None:
+        self.last_start = monotonic()
+        context = multiprocessing.get_context('spawn')
+        self.pipe, child = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(child, self.sensor_type, self.name, self.config),
+            name=f'pynsor-{self.name}',
+            daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.pending = 0
+        self.sequence = 0
+        self.behind_since = None
+
+        try:
+            if not self.pipe.poll(self.timeout):
+                raise TimeoutError("worker did not start")
+            _, is_enabled, self.datamodel = self.pipe.recv()
+        except (EOFError, OSError, TimeoutError) as e:
+            print(f"ERROR: Could not start worker for {self.name}: {e!r}")
+            self.stop()
+            return
+        if not is_enabled:
+            print(f"ERROR: {self.name} disabled itself in the worker")
+            self.stop()
+            return
+        print(f"Started worker for {self.name} (pid {self.process.pid})")
+
+    def stop(self, terminate: bool=False) -> None:
+        """
+        Stop the worker and free the shared memory of all batches it did not
+        deliver
+
+        :param terminate: do not wait for a hung worker to stop by itself
+        """
+        if self.process is None:
+            return
+        if not terminate:
+            try:
+                self.pipe.send(('stop',))
+            except OSError:
+                pass
+            self.process.join(self.timeout)
+        if self.process.is_alive() and not terminate:
+            self.process.terminate()
+            self.process.join(self.timeout)
+        if self.process.is_alive():
+            # a hung worker might not even react to SIGTERM
+            self.process.kill()
+            self.process.join()
+
+        # free the shared memory of batches that were not collected
+        try:
+            while self.pipe.poll():
+                message = self.pipe.recv()
+                self.pending -= 1
+                if message[0] == 'batch':
+                    shm = SharedMemory(name=message[2])
+                    shm.close()
+                    shm.unlink()
+        except (EOFError, OSError):
+            pass
+
+        # and of the ones a killed worker created but never sent, the
+        # outstanding samples are always the last ones requested
+        for sequence in range(self.sequence - self.pending + 1, self.sequence + 1):
+            try:
+                shm = SharedMemory(name=block_name(self.process.pid, sequence))
+            except FileNotFoundError:
+                continue
+            shm.close()
+            shm.unlink()
+        self.pending = 0
+        self.pipe.close()
+        self.process = None
+        self.pipe = None
+
+    def close(self) -> None:
+        self.stop()
+
+    def create_datamodel(self, connection: Connection) -> None:
+        replay(self.datamodel, connection)
+
+    def collect(self) -> None:
+        """
+        Fetch all batches the worker finished
+        """
+        if self.pipe is None:
+            return
+        try:
+            while self.pipe.poll():
+                message = self.pipe.recv()
+                self.pending -= 1
+                if message[0] == 'error':
+                    print(f"ERROR: {self.name} failed in the worker: {message[2]}")
+                    continue
+
+                _, timestamp, name, size = message
+                shm = SharedMemory(name=name)
+                try:
+                    with shm.buf[:size] as view:
+                        operations = pickle.loads(view)
+                finally:
+                    shm.close()
+                    shm.unlink()
+                self.raw_data.append({
+                    'time': timestamp,
+                    'data': operations,
+                    'size': size
+                })
+        except (EOFError, OSError):
+            print(f"ERROR: Worker of {self.name} died (exit code {self.process.exitcode})")
+            self.stop()
+
+    def gather(self, timestamp: datetime):
+        self.collect()
+        if self.process is None or not self.process.is_alive():
+            if self.process is not None:
+                print(f"ERROR: Worker of {self.name} died (exit code {self.process.exitcode})")
+                self.stop()
+            if monotonic() - self.last_start < self.restart_interval:
+                return
+            print(f"Restarting worker for {self.name}")
+            self.start()
+            if self.process is None:
+                return
+
+        if self.pending >= self.max_pending:
+            now = monotonic()
+            if self.behind_since is None:
+                self.behind_since = now
+            elif now - self.behind_since > self.timeout:
+                print(f"ERROR: Worker of {self.name} did not deliver a sample for {now - self.behind_since:.0f}s, restarting it")
+                self.stop(terminate=True)
+                self.start()
+                if self.process is None:
+                    return
+            else:
+                print(f"WARNING: Worker of {self.name} is falling behind, skipping a sample")
+                return
+        else:
+            self.behind_since = None
+        self.pipe.send(('gather', timestamp))
+        self.pending += 1
+        self.sequence += 1
+
+    def buffered_bytes(self) -> int:
+        return sum(item['size'] for item in self.raw_data)
+
+    def data(self) -> Optional[List[Dict[str, Any]]]:
+        return self.raw_data
+
+    def save(self, connection: Connection) -> None:
+        # batches are collected on gather only, so `peek` sees a stable buffer
+        for item in self.raw_data:
+            replay(item['data'], connection)
+        self.raw_data = []